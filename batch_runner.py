@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import queue
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from results_store import ResultsStore, solution_status
+
+
+def read_commands(path):
+    """
+    Read a command file as (name, command) pairs.
+
+    Entries are separated by blank lines: the first line is the instance name,
+    the following lines the command. Lines continued with a trailing '`'
+    (PowerShell) or '\\' (sh) are joined, so command_end_line works as well as
+    the one-line files.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        blocks = re.split(r"\n\s*\n", f.read())
+    commands = []
+    for block in blocks:
+        lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+        if len(lines) < 2:
+            continue
+        command = " ".join(line.rstrip("`\\").strip() for line in lines[1:])
+        commands.append((lines[0], command))
+    return commands
+
+
+def safe_name(name):
+    return name.replace(" ", "_").replace(":", "").replace('"', "").replace("'", "")
+
+
+def command_option(command, option):
+    """
+    Return the value following `option` in a command line, or None.
+    """
+    try:
+        tokens = shlex.split(command, posix=os.name != "nt")
+    except ValueError:
+        tokens = command.split()
+    for i, token in enumerate(tokens[:-1]):
+        if token == option:
+            return tokens[i + 1].strip('"')
+    return None
+
+
+def with_option(command, option, value):
+    """
+    Return `command` with the value of `option` replaced by `value`, or with
+    `option value` appended when the command does not have the option.
+    """
+    quoted = shlex.quote(value) if os.name == "posix" else f'"{value}"'
+    pattern = rf"""(?<!\S){re.escape(option)}\s+("[^"]*"|'[^']*'|\S+)"""
+    command, count = re.subn(pattern, lambda match: f"{option} {quoted}", command, count=1)
+    return command if count else f"{command} {option} {quoted}"
+
+
+def cpu_slots(jobs, cpus_per_job):
+    """
+    Split the CPUs this process may run on into `jobs` disjoint sets of
+    `cpus_per_job` CPUs. Returns None when pinning is not possible (no
+    sched_setaffinity, or fewer CPUs than requested).
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if cpus_per_job < 1 or jobs * cpus_per_job > len(cpus):
+        return None
+    return [set(cpus[i * cpus_per_job:(i + 1) * cpus_per_job]) for i in range(jobs)]
+
+
+def load_record(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class BatchRunner:
+    """
+    Runs the commands of a command file concurrently and writes one JSON
+    record per instance into `output_folder`.
+
+    Every command runs as its own process group with at most `jobs` of them
+    alive at a time. With `cpus_per_job`, each running command is pinned to a
+    disjoint set of CPUs (inherited by the solver it starts); with `mem_limit`
+    (MB) its address space is capped. Both are applied by starting the
+    command's shell through taskset and prlimit (util-linux), since
+    preexec_fn is not safe from the worker threads. A command still running
+    after its wall limit gets SIGTERM, then SIGKILL `grace` seconds later.
+
+    The stdout/stderr of each command goes to <name>.txt as before. Each
+    command gets its own solution folder, `output_folder`/<name> (its --sol
+    is replaced), so concurrent jobs never share a log.txt, and a --job-id of
+    its own. Counts, cost and status are taken from the run the command wrote
+    with that job id to the results store (its --results-db, else
+    `output_folder`/results.db), see results_store.py. Instances whose record
+    says 'ok' and has a cost (a roster was found) are skipped, which makes an
+    interrupted sweep resumable.
+    """
+
+    def __init__(self, output_folder, jobs=1, cpus_per_job=None, wall_limit=None,
+                 wall_slack=300, mem_limit=None, grace=30, force=False):
+        self.output_folder = output_folder
+        self.jobs = jobs
+        self.wall_limit = wall_limit
+        self.wall_slack = wall_slack
+        self.mem_limit = mem_limit
+        self.grace = grace
+        self.force = force
+        self.slots = queue.Queue()
+        slots = cpu_slots(jobs, cpus_per_job) if cpus_per_job else None
+        if cpus_per_job and slots is None:
+            print(f"Cannot pin {jobs} jobs to {cpus_per_job} CPUs each; running unpinned")
+        if slots and shutil.which("taskset") is None:
+            print("taskset not found; running unpinned")
+            slots = None
+        if mem_limit is not None and (os.name != "posix" or shutil.which("prlimit") is None):
+            print("prlimit not found; running without a memory limit")
+            self.mem_limit = None
+        for slot in slots or [None] * jobs:
+            self.slots.put(slot)
+        os.makedirs(output_folder, exist_ok=True)
+
+    def record_path(self, name):
+        return os.path.join(self.output_folder, f"{safe_name(name)}.json")
+
+    def is_done(self, name):
+        # Exit code 0 alone is not enough: the solve may have found no roster
+        record = load_record(self.record_path(name))
+        return (record is not None and record.get("status") == "ok"
+                and record.get("total_cost") is not None)
+
+    def job_command(self, name, command, job_id):
+        """
+        Return `command` with the solution folder of job `name`, its job id
+        and, unless it has one, the results store of the output folder.
+        """
+        command = with_option(command, "--sol", os.path.join(self.output_folder, safe_name(name)))
+        if command_option(command, "--results-db") is None:
+            command = with_option(command, "--results-db", os.path.join(self.output_folder, "results.db"))
+        return with_option(command, "--job-id", job_id)
+
+    def job_wall_limit(self, command):
+        """
+        The explicit wall limit, else the command's own --timeout plus the
+        slack for encoding and validation, else None (no limit).
+        """
+        if self.wall_limit is not None:
+            return self.wall_limit
+        timeout = command_option(command, "--timeout")
+        if timeout is None:
+            return None
+        return float(timeout) + self.wall_slack
+
+    def run(self, commands):
+        """
+        Run every (name, command) pair that is not done yet. Returns the list
+        of records written by this call.
+        """
+        pending = [(name, command) for name, command in commands
+                   if self.force or not self.is_done(name)]
+        skipped = len(commands) - len(pending)
+        if skipped:
+            print(f"Skipping {skipped} completed instances")
+
+        records = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(self.run_one, name, command)
+                       for name, command in pending]
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                records.append(record)
+                print(f"[{done}/{len(pending)}] {record['name']}: {record['status']} "
+                      f"({record['wall_seconds']:.1f}s)")
+        return records
+
+    def run_one(self, name, command):
+        slot = self.slots.get()
+        try:
+            record = self._execute(name, command, slot)
+        finally:
+            self.slots.put(slot)
+        with open(self.record_path(name), "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        return record
+
+    def job_argv(self, command, slot):
+        """
+        Return the argv running `command` through sh, started by taskset on
+        the CPUs of `slot` and by prlimit with the address space limit, so the
+        shell and the solver it starts inherit both.
+        """
+        argv = ["sh", "-c", command]
+        if self.mem_limit is not None:
+            argv = ["prlimit", f"--as={int(self.mem_limit) * 1024 * 1024}", "--"] + argv
+        if slot is not None:
+            argv = ["taskset", "-c", ",".join(map(str, sorted(slot)))] + argv
+        return argv
+
+    def _execute(self, name, command, slot):
+        output_file = os.path.join(self.output_folder, f"{safe_name(name)}.txt")
+        job_id = uuid.uuid4().hex
+        command = self.job_command(name, command, job_id)
+        wall_limit = self.job_wall_limit(command)
+        record = {
+            "name": name,
+            "command": command,
+            "job_id": job_id,
+            "cpus": sorted(slot) if slot is not None else None,
+            "wall_limit": wall_limit,
+            "mem_limit_mb": self.mem_limit,
+            "started": time.time(),
+        }
+
+        with open(output_file, "w", encoding="utf-8") as out:
+            start = time.monotonic()
+            if os.name == "posix":
+                process = subprocess.Popen(
+                    self.job_argv(command, slot), stdout=out, stderr=subprocess.PIPE,
+                    text=True, start_new_session=True)
+            else:
+                process = subprocess.Popen(
+                    command, shell=True, stdout=out, stderr=subprocess.PIPE, text=True)
+            timed_out = False
+            try:
+                _, stderr = process.communicate(timeout=wall_limit)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                self._signal(process, signal.SIGTERM)
+                try:
+                    _, stderr = process.communicate(timeout=self.grace)
+                except subprocess.TimeoutExpired:
+                    self._signal(process, signal.SIGKILL)
+                    _, stderr = process.communicate()
+            wall = time.monotonic() - start
+            out.write("\n--- ERROR OUTPUT ---\n")
+            out.write(stderr)
+
+        record["wall_seconds"] = wall
+        record["returncode"] = process.returncode
+        if timed_out:
+            record["status"] = "timeout"
+        elif "MemoryError" in stderr or "bad_alloc" in stderr:
+            record["status"] = "memout"
+        elif process.returncode != 0:
+            record["status"] = "failed"
+        else:
+            record["status"] = "ok"
+
+        sol = command_option(command, "--sol")
+        record["solution_folder"] = sol
+        run = self.stored_run(command, job_id)
+        if run is not None:
+            record.update({
+                "run_id": run["id"],
+                "soft_clauses": run["soft_clauses"],
+                "hard_clauses": run["hard_clauses"],
+                "variables": run["variables"],
+                "total_cost": run["best_cost"],
+                "solution_status": run["status"],
+            })
+            return record
+
+        # No record in the results store (older script or --results-db ''):
+        # fall back to the printed counts and the solver log
+        from extract_to_xlsx import extract_clauses
+        soft, hard, variables, timeout, total_cost, status = extract_clauses(output_file)
+        record.update({
+            "soft_clauses": soft,
+            "hard_clauses": hard,
+            "variables": variables,
+            "total_cost": total_cost,
+            "encoding_status": status,
+        })
+        record["solution_status"] = solution_status(os.path.join(sol, "log.txt"))
+        return record
+
+    @staticmethod
+    def stored_run(command, job_id):
+        """
+        Return the results store run the command recorded with `job_id`, or
+        None.
+        """
+        db_path = command_option(command, "--results-db")
+        if not db_path or not os.path.exists(db_path):
+            return None
+        with ResultsStore(db_path) as store:
+            return store.latest("job_id = ?", (job_id,))
+
+    @staticmethod
+    def _signal(process, sig):
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, sig)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the commands of a command file in parallel, resumably.")
+    parser.add_argument('commands', nargs='?', default="run_instances.sh",
+                        help='Command file: name line, command line(s), blank line')
+    parser.add_argument('--output', default="test",
+                        help='Folder for the <name>.txt outputs, <name>.json records and '
+                             '<name> solution folders')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of commands running at the same time (default 1)')
+    parser.add_argument('--cpus-per-job', type=int,
+                        help='Pin each running command to this many CPUs of its own')
+    parser.add_argument('--wall-limit', type=float,
+                        help="Seconds before a command is stopped (default: its --timeout "
+                             "plus --wall-slack)")
+    parser.add_argument('--wall-slack', type=float, default=300,
+                        help='Seconds added to the --timeout of a command (default 300)')
+    parser.add_argument('--mem-limit', type=int,
+                        help='Address space limit per command in MB')
+    parser.add_argument('--force', action='store_true',
+                        help='Rerun instances that already have an ok record')
+    parser.add_argument('--xlsx', action='store_true',
+                        help='Export the runs recorded in <output>/results.db to '
+                             'statistic/<output>.xlsx afterwards (needs pandas)')
+    args = parser.parse_args(argv)
+
+    runner = BatchRunner(args.output, jobs=args.jobs, cpus_per_job=args.cpus_per_job,
+                         wall_limit=args.wall_limit, wall_slack=args.wall_slack,
+                         mem_limit=args.mem_limit, force=args.force)
+    records = runner.run(read_commands(args.commands))
+    if args.xlsx:
+        from extract_to_xlsx import export_xlsx
+        # statistic/<name of the output folder>.xlsx, also for nested or absolute --output
+        os.makedirs("statistic", exist_ok=True)
+        xlsx = os.path.join("statistic", f"{os.path.basename(os.path.normpath(args.output))}.xlsx")
+        with ResultsStore(os.path.join(args.output, "results.db")) as store:
+            export_xlsx(store, xlsx, "job_id IS NOT NULL")
+    failed = [r["name"] for r in records if r["status"] != "ok" or r.get("total_cost") is None]
+    if failed:
+        print(f"Not completed: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+import global_nurse_rostering_sat as nrs
+
+# Relative increase over the baseline that counts as a regression
+DEFAULT_THRESHOLDS = {
+    "seconds": 0.20,
+    "peak_rss_mb": 0.10,
+    "variables": 0.0,
+    "clauses": 0.0,
+}
+# Timing differences below this many seconds are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.05
+
+
+def case_files(input_folder, case):
+    """
+    Return (scenario, history, week files) of a case name such as
+    n030w4_1_6-2-9-1: instance, history index, week indices.
+    """
+    instance, history, weeks = case.split('_')
+    folder = os.path.join(input_folder, instance)
+    return (os.path.join(folder, f"Sc-{instance}.json"),
+            os.path.join(folder, f"H0-{instance}-{history}.json"),
+            [os.path.join(folder, f"WD-{instance}-{week}.json") for week in weeks.split('-')])
+
+
+def case_matrix(input_folder, instances, histories, samples, seed):
+    """
+    Name the cases of a benchmark run: for every instance and history index,
+    `samples` week sequences drawn (with repetition, as in the INRC-II
+    instances) from the week files of the instance. The draw only depends on
+    `seed`, the instance and the history, so the matrix is stable.
+    """
+    cases = []
+    for instance in instances:
+        num_weeks = int(re.search(r'w(\d+)$', instance).group(1))
+        week_ids = sorted(int(re.search(r'-(\d+)\.json$', name).group(1))
+                          for name in os.listdir(os.path.join(input_folder, instance))
+                          if name.startswith('WD-'))
+        for history in histories:
+            rng = random.Random(f"{seed}-{instance}-{history}")
+            for _ in range(samples):
+                weeks = [rng.choice(week_ids) for _ in range(num_weeks)]
+                cases.append(f"{instance}_{history}_{'-'.join(map(str, weeks))}")
+    return cases
+
+
+def encode_case(task):
+    """
+    Load and encode one case `repeat` times in this (fresh) process and return
+    its metrics: the fastest load/encode times, the peak RSS and the formula
+    size per family. With `profile`, one more encoding runs under the family
+    profiler and its report is added; it does not count for the times. With
+    `profile_memory`, a further traced encoding adds the allocated bytes per
+    family to that report. `encodings` holds the --sequence-encoding and
+    --amo-encoding specs of the encoder. Solver output stays silent.
+    """
+    input_folder, case, repeat, workers, profile, profile_memory, encodings = task
+    profile_runs = [False] * repeat + [True] * profile + ['memory'] * profile_memory
+    report = {}
+    sce, his, weeks = case_files(input_folder, case)
+    args = argparse.Namespace(stream=False, stream_buffer=1 << 20, workers=workers, simplify=False,
+                              propagate=False, symmetry_breaking=False, **encodings)
+    load_times, encode_times = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for profiled in profile_runs:
+            started = time.perf_counter()
+            scenario, history, weekdays, N, D, S, SK, W, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types, coverage = nrs.load_data(
+                sce, his, weeks)
+            load_times.append(time.perf_counter() - started)
+            # The constraint functions read it as a module global, set by __main__
+            nrs.nurse_name_to_index = nurse_name_to_index
+
+            nrs.init_encoding_cache()
+            nrs.init_profiler(bool(profiled), memory=profiled == 'memory')
+            started = time.perf_counter()
+            nrs.encode_instance(args, N, D, S, SK, W, weekdays, coverage, nurse_skills, forbidden_shifts,
+                                nurse_history, nurse_name_to_index, nurse_contracts, contracts, shift_types, None)
+            if not profiled:
+                encode_times.append(time.perf_counter() - started)
+            elif profiled == 'memory':
+                for family, record in nrs.profiler.report()["families"].items():
+                    report[family]["alloc_peak_bytes"] = record["alloc_peak_bytes"]
+                    report[family]["alloc_net_bytes"] = record["alloc_net_bytes"]
+            else:
+                report = nrs.profiler.report()["families"]
+
+    formula, registry = nrs.formula, nrs.registry
+    metrics = {
+        "load_seconds": min(load_times),
+        "encode_seconds": min(encode_times),
+        "seconds": min(load_times) + min(encode_times),
+        "peak_rss_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                        if resource is not None else None),
+        "variables": registry.top,
+        "clauses": len(formula),
+        "hard_clauses": formula.num_hard,
+        "soft_clauses": formula.num_soft,
+        "literals": formula.num_literals(),
+        "clause_families": formula.family_counts,
+        "variable_families": registry.family_counts(),
+    }
+    if profile:
+        metrics["profile"] = report
+    return case, metrics
+
+
+def encode_case_isolated(task):
+    """
+    Run encode_case in a fresh process, so the peak RSS is the case's own.
+    The process is not daemonic, so the encoder may start its --workers.
+    """
+    with ProcessPoolExecutor(1) as pool:
+        return pool.submit(encode_case, task).result()
+
+
+def run_benchmark(input_folder, cases, repeat=3, workers=1, jobs=1, profile=False,
+                  profile_memory=False, sequence_encoding=None, amo_encoding=None):
+    """
+    Encode every case in its own process, `jobs` at a time (1 for stable
+    timings), and return {case: metrics}.
+    """
+    encodings = {'sequence_encoding': sequence_encoding, 'amo_encoding': amo_encoding}
+    tasks = [(input_folder, case, repeat, workers, profile, profile and profile_memory, encodings)
+             for case in cases]
+    results = {}
+    with ThreadPoolExecutor(jobs) as threads:
+        for case, metrics in threads.map(encode_case_isolated, tasks):
+            results[case] = metrics
+            print(f"{case}: {metrics['seconds']:.3f}s, {metrics['peak_rss_mb'] or 0:.0f} MB, "
+                  f"{metrics['variables']} variables, {metrics['clauses']} clauses")
+            if profile:
+                families = sorted(metrics["profile"].items(),
+                                  key=lambda item: -item[1]["wall_seconds"])
+                print("    " + ", ".join(f"{family} {record['wall_seconds']:.3f}s"
+                                         for family, record in families))
+    return results
+
+
+def compare(results, baseline, thresholds):
+    """
+    Compare the results with a baseline of the same format. Returns a list of
+    (case, metric, baseline value, new value, relative change, regression?)
+    for every metric that changed; per-family clause counts are compared as
+    'clauses:<family>' with the 'clauses' threshold.
+    """
+    changes = []
+
+    def check(case, metric, old, new, threshold):
+        if old is None or new is None or old == new:
+            return
+        relative = (new - old) / old if old else float('inf')
+        regression = relative > threshold
+        if metric == "seconds" and new - old < MIN_SECONDS_DELTA:
+            regression = False
+        changes.append((case, metric, old, new, relative, regression))
+
+    for case, metrics in results.items():
+        old = baseline.get(case)
+        if old is None:
+            continue
+        for metric, threshold in thresholds.items():
+            check(case, metric, old.get(metric), metrics.get(metric), threshold)
+        old_families = old.get("clause_families", {})
+        for family, counts in metrics.get("clause_families", {}).items():
+            if family in old_families:
+                check(case, f"clauses:{family}",
+                      sum(old_families[family].values()), sum(counts.values()),
+                      thresholds["clauses"])
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark load_data + encoding (no solver) over the INRC-II instances")
+    parser.add_argument('--input', default='input', help='Folder holding the instance folders')
+    parser.add_argument('--instances', nargs='+',
+                        help='Instance folders to use (default: all of --input)')
+    parser.add_argument('--histories', nargs='+', type=int, default=[0],
+                        help='History indices per instance (default 0)')
+    parser.add_argument('--samples', type=int, default=1,
+                        help='Week sequences per instance and history (default 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the week sequences')
+    parser.add_argument('--cases', nargs='+',
+                        help='Explicit cases instead of the matrix, e.g. n030w4_1_6-2-9-1')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Encodings per case; the fastest counts (default 3)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='--workers of the encoder (default 1 = serial)')
+    parser.add_argument('--sequence-encoding', nargs='+', metavar='[FAMILY=]MODE',
+                        help='--sequence-encoding of the encoder (default window)')
+    parser.add_argument('--amo-encoding', nargs='+', metavar='[FAMILY=]MODE',
+                        help='--amo-encoding of the encoder (default pairwise); compare with a '
+                             'baseline of the default to see the clauses and variables it saves')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Cases benchmarked at the same time (default 1)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Add a per-family profile (one extra encoding) to each case')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='With --profile, add the bytes allocated per family '
+                             '(one more encoding under tracemalloc)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write the results to --baseline instead of comparing')
+    for metric, threshold in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f'--max-{metric.replace("_", "-")}', type=float, default=threshold,
+                            dest=f'max_{metric}',
+                            help=f'Allowed relative increase of {metric} (default {threshold:g})')
+    args = parser.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline FILE")
+    try:
+        nrs.sequence_encoding_modes(args.sequence_encoding)
+        nrs.amo_encoding_modes(args.amo_encoding)
+    except ValueError as error:
+        parser.error(str(error))
+
+    cases = args.cases or case_matrix(
+        args.input, args.instances or sorted(os.listdir(args.input)),
+        args.histories, args.samples, args.seed)
+    results = run_benchmark(args.input, cases, args.repeat, args.workers, args.jobs,
+                            args.profile, args.profile_memory, args.sequence_encoding,
+                            args.amo_encoding)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    thresholds = {metric: getattr(args, f'max_{metric}') for metric in DEFAULT_THRESHOLDS}
+    changes = compare(results, baseline, thresholds)
+    missing = [case for case in results if case not in baseline]
+    if missing:
+        print(f"Not in the baseline: {', '.join(missing)}")
+    for case, metric, old, new, relative, regression in changes:
+        mark = "REGRESSION" if regression else "changed"
+        print(f"{mark:10} {case} {metric}: {old:.6g} -> {new:.6g} ({relative:+.1%})")
+    regressions = sum(change[-1] for change in changes)
+    print(f"{regressions} regressions, {len(changes) - regressions} other changes")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+from array import array
+
+import numpy as np
+
+
+class FlatClauses:
+    """
+    Clauses held as one flat literal array plus the end offset of each clause.
+
+    ClauseStore copies them in bulk; any other consumer can iterate them as
+    lists of ints.
+    """
+
+    def __init__(self, literals, ends):
+        self.literals = literals
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __iter__(self):
+        literals = self.literals.tolist()
+        start = 0
+        for end in self.ends.tolist():
+            yield literals[start:end]
+            start = end
+
+
+class ClauseStore:
+    """
+    Flat storage for a weighted CNF formula.
+
+    All literals live in one array('i') buffer. Clause i spans
+    literals[offsets[i]:offsets[i + 1]] and has weight weights[i], where a
+    weight of HARD (0) marks a hard clause. Clauses are added as int iterables
+    without the trailing 0.
+    """
+
+    HARD = 0
+
+    def __init__(self):
+        self.literals = array('i')
+        self.offsets = array('q', [0])
+        self.weights = array('q')
+        self.num_hard = 0
+        # Clause counts per constraint family, filled by mark()
+        self.family_counts = {}
+        self._marked_hard = 0
+        self._marked_soft = 0
+        # Reports of the simplify.py passes that ran, by pass
+        self.simplification = None
+        # Literals fixed by simplify.propagate_units, see complete_model()
+        self.fixed = None
+
+    def __len__(self):
+        return len(self.weights)
+
+    @property
+    def num_soft(self):
+        return len(self) - self.num_hard
+
+    def add_hard(self, clause):
+        self.literals.extend(clause)
+        self.offsets.append(len(self.literals))
+        self.weights.append(self.HARD)
+        self.num_hard += 1
+
+    def add_soft(self, weight, clause):
+        self.literals.extend(clause)
+        self.offsets.append(len(self.literals))
+        self.weights.append(weight)
+
+    def extend_hard(self, clauses):
+        if isinstance(clauses, FlatClauses):
+            self.add_flat(self.HARD, clauses.literals, clauses.ends)
+            return
+        for clause in clauses:
+            self.add_hard(clause)
+
+    def extend_soft(self, weight, clauses):
+        if isinstance(clauses, FlatClauses):
+            self.add_flat(weight, clauses.literals, clauses.ends)
+            return
+        for clause in clauses:
+            self.add_soft(weight, clause)
+
+    def add_hard_rows(self, rows):
+        """
+        Add every row of a 2-D integer array as a hard clause.
+        """
+        count, width = rows.shape
+        self.add_flat(self.HARD, rows.ravel(), width * np.arange(1, count + 1))
+
+    def add_flat(self, weight, literals, ends):
+        """
+        Add the clauses literals[ends[i - 1]:ends[i]] (NumPy arrays) by copying
+        them into the buffers in one go. `weight` is either one weight for all
+        clauses or an array with one weight per clause.
+        """
+        count = len(ends)
+        if count == 0:
+            return
+        ends = len(self.literals) + np.asarray(ends)
+        weights = np.broadcast_to(weight, (count,))
+        self.literals.frombytes(
+            np.asarray(literals).astype(self.literals.typecode, copy=False).tobytes())
+        self.offsets.frombytes(ends.astype(self.offsets.typecode).tobytes())
+        self.weights.frombytes(weights.astype(self.weights.typecode).tobytes())
+        self.num_hard += int(np.count_nonzero(weights == self.HARD))
+
+    def clause(self, i):
+        return self.literals[self.offsets[i]:self.offsets[i + 1]]
+
+    def mark(self, family):
+        """
+        Attribute the clauses added since the previous mark() to `family`.
+
+        Returns (hard, soft), the number of hard and soft clauses of the family.
+        """
+        hard = self.num_hard - self._marked_hard
+        soft = self.num_soft - self._marked_soft
+        self._marked_hard, self._marked_soft = self.num_hard, self.num_soft
+        self.family_counts[family] = {"hard": hard, "soft": soft}
+        return hard, soft
+
+    def __iter__(self):
+        """
+        Yield (weight, literals) for every clause in insertion order.
+        """
+        return self._iter_buffer()
+
+    def _iter_buffer(self):
+        literals, offsets = self.literals, self.offsets
+        for i, weight in enumerate(self.weights):
+            yield weight, literals[offsets[i]:offsets[i + 1]]
+
+    def hard_clauses(self):
+        for weight, clause in self:
+            if weight == self.HARD:
+                yield clause
+
+    def soft_clauses(self):
+        for weight, clause in self:
+            if weight != self.HARD:
+                yield weight, clause
+
+    def num_literals(self):
+        return len(self.literals)
+
+    def complete_model(self, true_vars):
+        """
+        Return the model (IDs of the true variables) of the formula before
+        propagation: the variables fixed by simplify.propagate_units no longer
+        occur here, so a solver model does not say anything about them.
+        """
+        if self.fixed is None or true_vars is None:
+            return true_vars
+        true_vars = np.asarray(true_vars, dtype=np.int64)
+        true_vars = true_vars[~np.isin(true_vars, np.abs(self.fixed))]
+        return np.concatenate((true_vars, self.fixed[self.fixed > 0])).tolist()
+
+    def nbytes(self):
+        """
+        Return the memory used by the three buffers in bytes.
+        """
+        return sum(buf.itemsize * len(buf)
+                   for buf in (self.literals, self.offsets, self.weights))
+
+    def write_wcnf(self, f, order=None):
+        """
+        Write the formula to an open text file in the tt-open-wbo-inc format:
+        hard clauses are prefixed with 'h', soft clauses with their weight.
+
+        `order` is an optional permutation of the clause indices, e.g. to give
+        solvers in a portfolio differently shuffled copies of one formula.
+        """
+        clauses = self if order is None else (
+            (self.weights[i], self.clause(i)) for i in order)
+        for weight, clause in clauses:
+            prefix = "h" if weight == self.HARD else str(weight)
+            f.write(f"{prefix} {' '.join(map(str, clause))} 0\n")
+
+    def write_wcnf_header(self, f, num_vars, weight_hard):
+        """
+        Write the formula in the classic 'p wcnf' format with a numeric top weight.
+        """
+        f.write(f"p wcnf {num_vars} {len(self)} {weight_hard}\n")
+        for weight, clause in self:
+            w = weight_hard if weight == self.HARD else weight
+            f.write(f"{w} {' '.join(map(str, clause))} 0\n")
+
+    def to_wcnf(self):
+        """
+        Build a pysat WCNF from the stored clauses without going through text.
+        """
+        from pysat.formula import WCNF
+
+        wcnf = WCNF()
+        for weight, clause in self:
+            if weight == self.HARD:
+                wcnf.append(clause.tolist())
+            else:
+                wcnf.append(clause.tolist(), weight=weight)
+        return wcnf
+
+    def evaluate(self, true_vars):
+        """
+        Return (hard clauses violated, total weight of violated soft clauses)
+        for the assignment where exactly the variables in `true_vars` are true.
+        """
+        literals = np.frombuffer(self.literals, dtype=np.int32)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        weights = np.frombuffer(self.weights, dtype=np.int64)
+        true_vars = np.asarray(true_vars, dtype=np.int64)
+        top = int(max(np.abs(literals).max(initial=0), true_vars.max(initial=0)))
+        value = np.zeros(top + 1, dtype=bool)
+        value[true_vars] = True
+
+        literal_true = value[np.abs(literals)] == (literals > 0)
+        satisfied = np.zeros(len(weights), dtype=bool)
+        non_empty = offsets[1:] > offsets[:-1]
+        if len(literals):
+            satisfied[non_empty] = np.logical_or.reduceat(
+                literal_true, offsets[:-1][non_empty])
+        violated = ~satisfied
+        hard = weights == self.HARD
+        return (int(np.count_nonzero(violated & hard)),
+                int(weights[violated & ~hard].sum()))
+
+    def stats(self):
+        stats = {
+            "hard_clauses": self.num_hard,
+            "soft_clauses": self.num_soft,
+            "literals": self.num_literals(),
+            "bytes": self.nbytes(),
+            "families": self.family_counts,
+        }
+        if self.simplification is not None:
+            stats["simplification"] = self.simplification
+        return stats
+
+
+class StreamingClauseStore(ClauseStore):
+    """
+    ClauseStore that writes its clauses to an open file in the tt-open-wbo-inc
+    format as they are produced.
+
+    Clauses are buffered until the buffer holds `buffer_literals` literals and
+    are then flushed, so memory is bounded by the buffer size instead of the
+    formula size. Counts (clauses, literals, families) stay cumulative. The
+    clauses themselves are no longer available in memory once flushed.
+
+    With `weight_hard` set, the classic 'p wcnf' format is written instead: a
+    fixed-width header line is reserved up front and back-patched by close().
+    The file must then be seekable.
+    """
+
+    HEADER_WIDTH = 64
+
+    def __init__(self, f, buffer_literals=1 << 20, weight_hard=None):
+        super().__init__()
+        self.file = f
+        self.buffer_literals = buffer_literals
+        self.weight_hard = weight_hard
+        self.flushed_clauses = 0
+        self.flushed_literals = 0
+        if weight_hard is not None:
+            self._header_pos = f.tell()
+            f.write(" " * (self.HEADER_WIDTH - 1) + "\n")
+
+    def __len__(self):
+        return self.flushed_clauses + len(self.weights)
+
+    def add_hard(self, clause):
+        super().add_hard(clause)
+        if len(self.literals) >= self.buffer_literals:
+            self.flush()
+
+    def add_soft(self, weight, clause):
+        super().add_soft(weight, clause)
+        if len(self.literals) >= self.buffer_literals:
+            self.flush()
+
+    def add_flat(self, weight, literals, ends):
+        super().add_flat(weight, literals, ends)
+        if len(self.literals) >= self.buffer_literals:
+            self.flush()
+
+    def num_literals(self):
+        return self.flushed_literals + len(self.literals)
+
+    def __iter__(self):
+        if self.flushed_clauses:
+            raise ValueError(
+                "The formula was streamed to file; read it back from there.")
+        return self._iter_buffer()
+
+    def flush(self):
+        hard_prefix = "h" if self.weight_hard is None else str(self.weight_hard)
+        for weight, clause in self._iter_buffer():
+            prefix = hard_prefix if weight == self.HARD else str(weight)
+            self.file.write(f"{prefix} {' '.join(map(str, clause))} 0\n")
+        self.flushed_clauses += len(self.weights)
+        self.flushed_literals += len(self.literals)
+        self.literals = array('i')
+        self.offsets = array('q', [0])
+        self.weights = array('q')
+
+    def close(self, num_vars=None):
+        """
+        Flush the remaining clauses, back-patch the header if one was reserved
+        and close the file.
+        """
+        self.flush()
+        if self.weight_hard is not None:
+            header = f"p wcnf {num_vars} {len(self)} {self.weight_hard}"
+            if len(header) >= self.HEADER_WIDTH:
+                raise ValueError(f"Header does not fit the reserved line: {header}")
+            self.file.seek(self._header_pos)
+            self.file.write(header.ljust(self.HEADER_WIDTH - 1))
+        self.file.close()
@@ -0,0 +1,99 @@
+import argparse
+import os
+import random
+import tempfile
+import unittest
+
+from pysat.solvers import Solver
+
+import global_nurse_rostering_sat as nrs
+from benchmark_encoding import encode_case
+from clause_store import ClauseStore
+from simplify_test import NUM_VARS, assignments, random_formula
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input')
+
+
+def bounded_hard_clauses(formula, bound, num_vars=NUM_VARS, max_literals=None):
+    """
+    The hard clauses of the WCNF of `formula` with export_cost_bound appended,
+    and whether the bound was written.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'formular.wcnf')
+        nrs.export_cnf_custom_format(filename, formula)
+        written = nrs.export_cost_bound(filename, formula, bound, num_vars, max_literals)
+        with open(filename) as f:
+            return [[int(lit) for lit in line.split()[1:-1]]
+                    for line in f if line.startswith('h ')], written
+
+
+def scaled(formula, factor):
+    """
+    A copy of `formula` with every soft weight multiplied by `factor`.
+    """
+    copy = ClauseStore()
+    for weight, clause in formula:
+        if weight == ClauseStore.HARD:
+            copy.add_hard(clause.tolist())
+        else:
+            copy.add_soft(weight * factor, clause.tolist())
+    return copy
+
+
+class ExportCostBoundTest(unittest.TestCase):
+    def test_feasible_exactly_below_the_bound(self):
+        rng = random.Random(3)
+        for trial in range(60):
+            formula = random_formula(rng, duplicates=False)
+            if trial % 2:
+                # Weights with a common divisor, bounds that are not multiples of it
+                formula = scaled(formula, 5)
+            costs = [formula.evaluate(true_vars) for true_vars in assignments()]
+            feasible = [soft for hard, soft in costs if hard == 0]
+            if not feasible:
+                continue
+            bound = rng.randint(min(feasible) - 1, max(feasible))
+            clauses, written = bounded_hard_clauses(formula, bound)
+            self.assertTrue(written)
+            with Solver(name='g3', bootstrap_with=clauses) as oracle:
+                for true_vars, (hard, soft) in zip(assignments(), costs):
+                    assumptions = [v if v in true_vars else -v for v in range(1, NUM_VARS + 1)]
+                    self.assertEqual(oracle.solve(assumptions=assumptions),
+                                     hard == 0 and soft <= bound, (trial, true_vars))
+
+    def test_skipped_above_the_literal_limit(self):
+        formula = ClauseStore()
+        for v in range(1, 6):
+            formula.add_soft(3, [v, v + 1])
+        clauses, written = bounded_hard_clauses(formula, 2, max_literals=4)
+        self.assertFalse(written)
+        self.assertEqual(len(clauses), 0)
+
+    def test_instance_bound_cuts_the_incumbent(self):
+        # One week of n030w4: a model of the hard clauses stays feasible under
+        # the bound of its own cost, not under one below it, and a model found
+        # under that bound is cheaper
+        encode_case((INPUT, 'n030w4_0_1', 1, 1, False, False,
+                     {'sequence_encoding': None, 'amo_encoding': None}))
+        formula, top = nrs.formula, nrs.registry.top
+        with Solver(name='g3', bootstrap_with=[c.tolist() for c in formula.hard_clauses()]) as oracle:
+            self.assertTrue(oracle.solve())
+            model = oracle.get_model()
+        cost = formula.evaluate([v for v in model if v > 0])[1]
+        self.assertGreater(cost, 0)
+
+        for bound, expected in ((cost, True), (cost - 1, False)):
+            clauses, written = bounded_hard_clauses(formula, bound, top)
+            self.assertTrue(written)
+            with Solver(name='g3', bootstrap_with=clauses) as oracle:
+                self.assertEqual(oracle.solve(assumptions=model), expected, bound)
+                if not expected:
+                    self.assertTrue(oracle.solve())
+                    better = [v for v in oracle.get_model() if 0 < v <= top]
+                    self.assertEqual(formula.evaluate(better)[0], 0)
+                    self.assertLess(formula.evaluate(better)[1], cost)
+
+
+if __name__ == '__main__':
+    unittest.main()
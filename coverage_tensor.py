@@ -0,0 +1,44 @@
+import numpy as np
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday',
+             'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Index of the last axis of the coverage tensor
+COV_MIN = 0
+COV_OPT = 1
+
+
+def build_coverage(weekdays, S, SK):
+    """
+    Build the coverage requirements of the whole horizon as one int array of
+    shape (D, |S|, |SK|, 2), with D = 7 * len(weekdays).
+
+    coverage[d, s, sk, COV_MIN] and coverage[d, s, sk, COV_OPT] are the minimum
+    and optimal number of nurses for day d, shift S[s] and skill SK[sk].
+    Missing requirements are 0.
+    """
+    shift_index = {s: i for i, s in enumerate(S)}
+    skill_index = {sk: i for i, sk in enumerate(SK)}
+    coverage = np.zeros((len(weekdays) * 7, len(S), len(SK), 2), dtype=np.int32)
+
+    for week_index, weekday in enumerate(weekdays):
+        for req in reversed(weekday.get('requirements', [])):
+            # Reversed so that the first entry for a (shift, skill) pair wins
+            si = shift_index.get(req['shiftType'])
+            ki = skill_index.get(req['skill'])
+            if si is None or ki is None:
+                continue
+            for day_offset, day in enumerate(DAY_NAMES):
+                day_req = req.get(f'requirementOn{day}', {})
+                d = week_index * 7 + day_offset
+                coverage[d, si, ki, COV_MIN] = day_req.get('minimum', 0)
+                coverage[d, si, ki, COV_OPT] = day_req.get('optimal', 0)
+    return coverage
+
+
+def coverage_cells(mask):
+    """
+    Return the (d, s, sk) index triples where `mask` is True, in the same
+    day/shift/skill order as nested loops over the tensor.
+    """
+    return np.argwhere(mask).tolist()
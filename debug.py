@@ -2,6 +2,7 @@ import json
 import os
 from collections import defaultdict
 from openpyxl import Workbook
+from coverage_tensor import build_coverage, DAY_NAMES, COV_OPT
 
 
 def log_nurse_allocation_to_excel(solution_folders, input_base_folder, output_file):
@@ -61,12 +62,20 @@ def log_nurse_allocation_to_excel(solution_folders, input_base_folder, output_fi
                     skill = assignment["skill"]
                     solution_counts[folder_index][day][shift][skill] += 1
 
+            # Requirements of this week as a (7, S, SK, 2) coverage tensor
+            requirement_pairs = [(requirement["shiftType"], requirement["skill"])
+                                 for requirement in input_data["requirements"]]
+            shifts = list(dict.fromkeys(shift for shift, _ in requirement_pairs))
+            skills = list(dict.fromkeys(skill for _, skill in requirement_pairs))
+            coverage = build_coverage([input_data], shifts, skills)
+            shift_index = {shift: s for s, shift in enumerate(shifts)}
+            skill_index = {skill: sk for sk, skill in enumerate(skills)}
+
             # Compare with input requirements
-            for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-                for requirement in input_data["requirements"]:
-                    shift = requirement["shiftType"]
-                    skill = requirement["skill"]
-                    required_nurses = requirement[f"requirementOn{day}"]["optimal"]
+            for day_index, day in enumerate(DAY_NAMES):
+                for shift, skill in requirement_pairs:
+                    required_nurses = int(coverage[day_index, shift_index[shift],
+                                                   skill_index[skill], COV_OPT])
 
                     # Map short day names in solution to full day names in input
                     day_mapping = {
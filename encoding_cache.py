@@ -0,0 +1,98 @@
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+from optilog.encoders.pb import Encoder
+
+from clause_store import FlatClauses
+
+
+class EncodingCache:
+    """
+    Memoized optilog cardinality encodings.
+
+    A constraint such as at_least_k(literals, k) is encoded once per shape
+    (kind, len(literals), k, encoding) against the placeholder literals
+    1..len(literals) with the auxiliary variables numbered from
+    len(literals) + 1. Later calls with the same shape relabel the template:
+    placeholder i becomes literals[i - 1] (keeping the sign) and auxiliary
+    variable len(literals) + j becomes max_var + j. The result is the formula
+    the encoder would have produced for those literals.
+
+    Templates are kept in an LRU dict of at most `maxsize` entries. With
+    `path`, the templates are loaded from that file on creation and written
+    back by save(), so later runs start warm.
+    """
+
+    def __init__(self, maxsize=4096, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.templates.update(pickle.load(f))
+            while len(self.templates) > maxsize:
+                self.templates.popitem(last=False)
+
+    def at_least_k(self, literals, bound, max_var, encoding='best'):
+        return self.encode('at_least_k', literals, bound, max_var, encoding)
+
+    def at_most_k(self, literals, bound, max_var, encoding='best'):
+        return self.encode('at_most_k', literals, bound, max_var, encoding)
+
+    def encode(self, kind, literals, bound, max_var, encoding):
+        """
+        Return (top_var, clauses) like Encoder.at_least_k / Encoder.at_most_k,
+        with the clauses as FlatClauses.
+        """
+        num_inputs = len(literals)
+        key = (kind, num_inputs, bound, encoding)
+        template = self.templates.get(key)
+        if template is None:
+            self.misses += 1
+            template = self._build_template(kind, num_inputs, bound, encoding)
+            self.templates[key] = template
+            if len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+        else:
+            self.hits += 1
+            self.templates.move_to_end(key)
+
+        num_aux, template_literals, ends = template
+        if num_aux < 0:
+            # Trivial bound: the encoder returns (0, []) whatever max_var is
+            return num_inputs + num_aux, []
+        labels = np.empty(num_inputs + num_aux + 1, dtype=np.int64)
+        labels[0] = 0
+        labels[1:num_inputs + 1] = literals
+        labels[num_inputs + 1:] = np.arange(max_var + 1, max_var + num_aux + 1)
+        relabeled = np.sign(template_literals) * labels[np.abs(template_literals)]
+        return max_var + num_aux, FlatClauses(relabeled, ends)
+
+    @staticmethod
+    def _build_template(kind, num_inputs, bound, encoding):
+        top_var, clauses = getattr(Encoder, kind)(
+            list(range(1, num_inputs + 1)), bound, max_var=num_inputs,
+            encoding=encoding)
+        template_literals = np.fromiter(
+            (lit for clause in clauses for lit in clause), dtype=np.int64)
+        ends = np.cumsum([len(clause) for clause in clauses], dtype=np.int64)
+        return top_var - num_inputs, template_literals, ends
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, "wb") as f:
+            pickle.dump(self.templates, f)
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / calls if calls else 0.0,
+            "templates": len(self.templates),
+        }
@@ -1,16 +1,15 @@
+import argparse
 import os
 import re
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from results_store import ResultsStore, solution_status
 
 
 def extract_clauses(file_path):
     with open(file_path, 'r') as file:
         content = file.read()
 
-        status = 'SAT'
-        if "No valid solution found in the output." in content:
-            status = 'UNSAT'
-
         soft_clauses_match = re.search(
             r'Number of soft clauses:\s*(\d+)', content)
         hard_clauses_match = re.search(
@@ -26,77 +25,164 @@ def extract_clauses(file_path):
                            ) if hard_clauses_match else 0
         variables = int(variables_match.group(1)) if variables_match else 0
         timeout = int(timeout_match.group(1)) if timeout_match else 0
-        total_cost = int(total_cost_match.group(1)) if total_cost_match else 0
+        # No "Total cost:" line means no roster was evaluated (no solution,
+        # killed at the wall limit, ...): None, not a cost of 0
+        total_cost = int(total_cost_match.group(1)) if total_cost_match else None
+        if total_cost is not None:
+            status = 'SAT'
+        elif "The problem is unsatisfiable." in content or re.search(
+                r'^s UNSATISFIABLE', content, re.MULTILINE):
+            status = 'UNSAT'
+        else:
+            status = 'UNKNOWN'
 
         return soft_clauses, hard_clauses, variables, timeout, total_cost, status
 
 
 def extract_solution_status(solution_folder):
-    log_file_path = os.path.join(solution_folder, 'log.txt')
-    if not os.path.exists(log_file_path):
-        return 'UNKNOWN'
-
-    with open(log_file_path, 'r') as file:
-        for line in file:
-            if line.startswith('s'):
-                if 'OPTIMUM' in line:
-                    return 'OPTIMUM'
-                elif 'SATISFIABLE' in line:
-                    return 'SATISFIABLE'
-                elif 'UNKNOWN' in line:
-                    return 'TIMEOUT'
-    return 'UNKNOWN'
-
-
-def extract_to_xlsx(output_folder, solution_folder):
-    results = []
-
-    # Get sorted list of files
-    files = sorted([f for f in os.listdir(
-        output_folder) if f.endswith('.txt')])
-
-    for filename in files:
+    return solution_status(os.path.join(solution_folder, 'log.txt'))
+
+
+def output_record(task):
+    """
+    Build a results store record from a solver output .txt file and the
+    log.txt of its solution folder (runs made before the store existed).
+    """
+    file_path, solution_folder = task
+    soft_clauses, hard_clauses, variables, timeout, total_cost, status = extract_clauses(
+        file_path)
+    return {
+        'instance': os.path.basename(file_path)[:-4],  # Remove the .txt extension
+        'solution_folder': solution_folder,
+        'config': {'timeout': timeout},
+        'variables': variables,
+        'hard_clauses': hard_clauses,
+        'soft_clauses': soft_clauses,
+        'best_cost': total_cost if status == 'SAT' else None,
+        'status': extract_solution_status(solution_folder),
+        'source': file_path,
+        'source_mtime': os.path.getmtime(file_path),
+    }
+
+
+def import_outputs(store, output_folder, solution_folder, workers=None):
+    """
+    Import the <instance>.txt outputs of `output_folder` into the store.
+
+    Only files that are new or changed since the last import are parsed, in
+    `workers` processes. Returns the number of files imported.
+    """
+    imported = store.source_mtimes()
+    tasks = []
+    for filename in sorted(os.listdir(output_folder)):
+        if not filename.endswith('.txt'):
+            continue
         file_path = os.path.join(output_folder, filename)
-        soft_clauses, hard_clauses, variables, timeout, total_cost, status = extract_clauses(
-            file_path)
-        instance_name = filename[:-4]  # Remove the .txt extension
-
-        # Extract solution status
-        solution_status = extract_solution_status(
-            os.path.join(solution_folder, instance_name))
+        if imported.get(file_path) != os.path.getmtime(file_path):
+            tasks.append((file_path, os.path.join(solution_folder, filename[:-4])))
+    if not tasks:
+        return 0
+    with ProcessPoolExecutor(workers) as pool:
+        for record in pool.map(output_record, tasks, chunksize=16):
+            store.add_run(record)
+    return len(tasks)
+
+
+def run_outcome(run):
+    """
+    SAT when the run has a cost, UNSAT only when the solver proved it,
+    TIMEOUT when it stopped without a model, UNKNOWN otherwise (e.g. killed
+    before writing an 's' line).
+    """
+    if run['best_cost'] is not None:
+        return 'SAT'
+    if run['status'] == 'UNSATISFIABLE':
+        return 'UNSAT'
+    if run['status'] == 'TIMEOUT':
+        return 'TIMEOUT'
+    return 'UNKNOWN'
 
-        # Calculate total clauses
-        total_clauses = soft_clauses + hard_clauses
 
-        results.append({
-            'Instance': instance_name,
+def runs_frame(store, where='', params=()):
+    """
+    Return the matching runs as a DataFrame with the columns of the xlsx
+    exports (Instance, Variables, Total Clauses, ... as read by draw*.py),
+    followed by the objective, peak memory and phase timings.
+    """
+    import pandas as pd
+
+    rows = []
+    for run in store.runs(where, params):
+        config = run['config'] or {}
+        timings = run['timings'] or {}
+        soft_clauses = run['soft_clauses'] or 0
+        hard_clauses = run['hard_clauses'] or 0
+        rows.append({
+            'Instance': run['instance'],
             'Soft Clauses': soft_clauses,
             'Hard Clauses': hard_clauses,
-            'Total Clauses': total_clauses,
-            'Variables': variables,
-            'Timeout(s)': timeout,
-            'Total Cost': total_cost,
-            'Status': status,
-            'Solution Status': solution_status
+            'Total Clauses': soft_clauses + hard_clauses,
+            'Variables': run['variables'] or 0,
+            'Timeout(s)': config.get('timeout') or 0,
+            # Left empty for runs without a solution, not a cost of 0
+            'Total Cost': run['best_cost'],
+            'Status': run_outcome(run),
+            'Solution Status': run['status'],
+            'Solver': config.get('solver'),
+            'Objective': run['objective'],
+            'Peak Memory (MB)': run['peak_memory_mb'],
+            **{f'{phase.capitalize()} (s)': seconds for phase, seconds in timings.items()},
         })
+    return pd.DataFrame(rows)
 
-    # Convert results to a DataFrame
-    df = pd.DataFrame(results)
 
-    # Write DataFrame to an Excel file
-    output_excel_file = f'statistic/{output_folder}.xlsx'
-    os.makedirs(os.path.dirname(output_excel_file), exist_ok=True)
+def export_xlsx(store, output_excel_file, where='', params=()):
+    df = runs_frame(store, where, params)
+    os.makedirs(os.path.dirname(output_excel_file) or '.', exist_ok=True)
     df.to_excel(output_excel_file, index=False)
-
     print(f"Data written to {output_excel_file}")
 
 
+def extract_to_xlsx(output_folder, solution_folder, db_path='results.db', workers=None):
+    with ResultsStore(db_path) as store:
+        imported = import_outputs(store, output_folder, solution_folder, workers)
+        print(f"Imported {imported} new or changed outputs from {output_folder}")
+        name = os.path.basename(os.path.normpath(output_folder))
+        export_xlsx(store, os.path.join('statistic', f'{name}.xlsx'),
+                    "source LIKE ?", (os.path.join(output_folder, '') + '%',))
+
+
 if __name__ == "__main__":
 
     # tt-open-wbo-inc Intel
     # OptiLog
     # extract_to_xlsx('output_binomial_new_optilog(best)_tt_open_wbo_intel', 'solution_binomial_new_optilog(best)_tt_open_wbo_intel')
-    # extract_to_xlsx('output_sc_new_optilog(best)_tt_open_wbo_intel', 'solution_sc_new_optilog(best)_tt_open_wbo_intel') 
-
-    extract_to_xlsx('output_binomial_optilog(best)_tt_open_wbo_intel', 'solution_binomial_optilog(best)_tt_open_wbo_intel')
-    # extract_to_xlsx('output_sc_optilog(best)_tt_open_wbo_intel', 'solution_sc_optilog(best)_tt_open_wbo_intel')
\ No newline at end of file
+    # extract_to_xlsx('output_sc_new_optilog(best)_tt_open_wbo_intel', 'solution_sc_new_optilog(best)_tt_open_wbo_intel')
+
+    parser = argparse.ArgumentParser(description="Export runs of the results store to xlsx")
+    parser.add_argument('--db', default='results.db', help='SQLite results store')
+    parser.add_argument('--xlsx', help='Export the runs recorded by the solver to this file')
+    parser.add_argument('--instance', help="Only instances matching this SQL LIKE pattern, e.g. 'n030%%'")
+    parser.add_argument('--solver', help='Only runs made with this --solver')
+    parser.add_argument('--import', dest='folders', nargs=2,
+                        metavar=('OUTPUT_FOLDER', 'SOLUTION_FOLDER'),
+                        help='Import an output folder of main_ubu.py/batch_runner.py runs and '
+                             'export it to statistic/<OUTPUT_FOLDER>.xlsx')
+    parser.add_argument('--workers', type=int, help='Processes parsing output files')
+    args = parser.parse_args()
+
+    if args.folders:
+        extract_to_xlsx(*args.folders, db_path=args.db, workers=args.workers)
+    elif args.xlsx:
+        conditions, params = ["source IS NULL"], []
+        if args.instance:
+            conditions.append("instance LIKE ?")
+            params.append(args.instance)
+        if args.solver:
+            conditions.append("json_extract(config, '$.solver') = ?")
+            params.append(args.solver)
+        with ResultsStore(args.db) as store:
+            export_xlsx(store, args.xlsx, " AND ".join(conditions), params)
+    else:
+        extract_to_xlsx('output_binomial_optilog(best)_tt_open_wbo_intel', 'solution_binomial_optilog(best)_tt_open_wbo_intel')
+        # extract_to_xlsx('output_sc_optilog(best)_tt_open_wbo_intel', 'solution_sc_optilog(best)_tt_open_wbo_intel')
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from importlib import metadata
+
+import numpy as np
+
+from clause_store import ClauseStore
+
+
+def code_version(paths, packages=()):
+    """
+    Hash the source files the encoding depends on and the versions of the
+    encoder packages, so that a cached formula is not reused after either
+    changes.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    for package in packages:
+        try:
+            version = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            version = None
+        digest.update(f"{package}={version}".encode())
+    return digest.hexdigest()
+
+
+class FormulaCache:
+    """
+    Content-addressed store of encoded formulas.
+
+    An entry is keyed by the SHA-256 of the input files (contents, in order),
+    the encoding settings and the code version, see key(). It holds the clause
+    buffers of a ClauseStore (literals, offsets and weights, i.e. the WCNF)
+    with its per-family clause counts, simplification report and propagation
+    back-map, the pickled VariableRegistry (the variable map) and the pickled
+    state the encoding leaves for the solve (e.g. the symmetry classes), in
+    one compressed .npz file per key.
+
+    Entries are written to a temporary file and renamed, so concurrent runs
+    never read a partial entry. Loading an entry touches it; when the
+    directory grows beyond `max_bytes`, the least recently used entries are
+    removed.
+    """
+
+    def __init__(self, directory, max_bytes=2 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(input_paths, settings, version):
+        digest = hashlib.sha256()
+        for path in input_paths:
+            with open(path, "rb") as f:
+                content = f.read()
+            # Length prefix: the concatenation of the files is not ambiguous
+            digest.update(len(content).to_bytes(8, "little"))
+            digest.update(content)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        digest.update(version.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key):
+        """
+        Return (registry, formula, state) of a cached entry, or None on a
+        miss.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                formula = ClauseStore()
+                formula.literals.frombytes(entry["literals"].tobytes())
+                formula.offsets.frombytes(entry["offsets"][1:].tobytes())
+                formula.weights.frombytes(entry["weights"].tobytes())
+                formula.num_hard = int(np.count_nonzero(entry["weights"] == ClauseStore.HARD))
+                formula.family_counts = json.loads(entry["family_counts"].tobytes())
+                if "simplification" in entry.files:
+                    formula.simplification = json.loads(entry["simplification"].tobytes())
+                if "fixed" in entry.files:
+                    formula.fixed = entry["fixed"]
+                registry = pickle.loads(entry["registry"].tobytes())
+                state = pickle.loads(entry["state"].tobytes())
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            # Missing, or evicted/damaged while we were reading it
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return registry, formula, state
+
+    def save(self, key, registry, formula, state=None):
+        """
+        Store the registry, formula and encoding state under `key` and evict
+        old entries.
+        Returns the size of the entry in bytes.
+        """
+        arrays = {
+            "literals": np.frombuffer(formula.literals, dtype=np.int32),
+            "offsets": np.frombuffer(formula.offsets, dtype=np.int64),
+            "weights": np.frombuffer(formula.weights, dtype=np.int64),
+            "family_counts": np.frombuffer(
+                json.dumps(formula.family_counts).encode(), dtype=np.uint8),
+            "registry": np.frombuffer(pickle.dumps(registry), dtype=np.uint8),
+            "state": np.frombuffer(pickle.dumps(state or {}), dtype=np.uint8),
+        }
+        if formula.simplification is not None:
+            arrays["simplification"] = np.frombuffer(
+                json.dumps(formula.simplification).encode(), dtype=np.uint8)
+        if formula.fixed is not None:
+            arrays["fixed"] = formula.fixed
+        fd, temporary = tempfile.mkstemp(suffix=".npz.tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        size = os.path.getsize(self.path(key))
+        self.evict(keep=key)
+        return size
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries (other than `keep`) until the
+        entries take at most max_bytes. Returns the number removed.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == f"{keep}.npz":
+                continue
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
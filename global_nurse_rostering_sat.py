@@ -1,76 +1,227 @@
-from itertools import permutations
 import subprocess
 import os
-from math import ceil
 import json
 import argparse
+import copy
+import threading
+import time
+import math
+import signal
+import shutil
+from contextlib import contextmanager
+from multiprocessing import Pool, Process, Queue, Event
+import numpy as np
 from itertools import combinations
+from collections import defaultdict
 from pypblib import pblib
 from pypblib.pblib import PBConfig, Pb2cnf
-from optilog.encoders.pb import Encoder
-
-variable_dict = {}
-reverse_variable_dict = {}
-counter = 1
-hard_clauses = []
+from pysat.examples.rc2 import RC2, RC2Stratified
+from pysat.solvers import Solver
+from variable_registry import VariableRegistry
+from encoding_cache import EncodingCache
+from clause_store import ClauseStore, StreamingClauseStore
+from coverage_tensor import build_coverage, coverage_cells, COV_MIN, COV_OPT
+from roster import RosterContext, roster_cost, nurse_costs, next_history, load_roster, evaluate_roster
+from profiling import FamilyProfiler
+from formula_cache import FormulaCache, code_version
+from simplify import simplify_formula, propagate_units, REMOVALS
+from symmetry import nurse_classes, lex_leader_roster
+from ladder_encoder import LadderEncoder
+from results_store import ResultsStore, solution_status, read_trajectory, peak_memory_mb
+
+registry = None
+formula = ClauseStore()
 
 pypblib_encoding = pblib.PB_BEST
 optilog_encoding = 'best'
 
+# Largest number of soft clause relaxation literals the warm-start cost bound
+# of export_cost_bound covers (about 500k clauses); larger formulas are
+# solved without it
+COST_BOUND_MAX_LITERALS = 12000
+encoding_cache = EncodingCache()
+
+# (nurse, day, shift) cells fixed to off that the coverage encodings leave
+# out, see coverage_nurses(); filled by encode_instance with --propagate
+excluded_x = set()
+
+# Classes of interchangeable nurses whose rosters are ordered by
+# constraint_symmetry_breaking; filled by encode_instance with
+# --symmetry-breaking
+symmetric_classes = []
+
+# Encoding of the consecutive days/shifts families: 'window' (one clause per
+# window) or 'counter' (the validator's penalties, see encode_sequence_counter);
+# filled by encode_instance from --sequence-encoding
+SEQUENCE_FAMILIES = ('S2_day', 'S2_shift', 'S3')
+sequence_encoding = dict.fromkeys(SEQUENCE_FAMILIES, 'window')
+
+# Encoding of the at-most-one families: 'pairwise' or 'ladder' (see
+# ladder_encoder.LadderEncoder); filled by encode_instance from --amo-encoding
+AMO_FAMILIES = ('H1', 'aux', 'H3')
+amo_encoding = dict.fromkeys(AMO_FAMILIES, 'pairwise')
+
+# Globals set by encode_instance that the solve reads as well; a formula
+# cache entry stores them, see encode_instance_cached()
+ENCODING_STATE = ('excluded_x', 'symmetric_classes', 'sequence_encoding', 'amo_encoding')
+
+# Content-addressed cache of encoded formulas, see init_formula_cache()
+formula_cache = None
+
+# Sources whose changes invalidate cached formulas, see formula_cache_key()
+ENCODER_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                   for name in ('global_nurse_rostering_sat.py', 'variable_registry.py',
+                                'clause_store.py', 'encoding_cache.py', 'coverage_tensor.py',
+                                'ladder_encoder.py', 'symmetry.py', 'simplify.py',
+                                'formula_cache.py')]
+
+# Seconds spent per phase of the run (load, encode, solve, save), see timed()
+run_timings = {}
+
+# Per constraint family accounting, see init_profiler()
+profiler = FamilyProfiler()
+
+
+def init_registry(N, D, W, S, SK, nurse_skills):
+    """
+    Create the global variable registry for the loaded instance.
+    """
+    global registry
+    registry = VariableRegistry(N, D, W, S, SK, nurse_skills)
+    return registry
+
+
+def init_encoding_cache(path=None, maxsize=4096):
+    """
+    Create the global cache of optilog encoding templates, persisted to `path`
+    if given.
+    """
+    global encoding_cache
+    encoding_cache = EncodingCache(maxsize, path)
+    return encoding_cache
+
+
+def init_formula_cache(directory=None, max_mb=2048):
+    """
+    Create the global formula cache in `directory`, or disable it (None).
+    """
+    global formula_cache
+    formula_cache = None if directory is None else FormulaCache(directory, max_mb << 20)
+    return formula_cache
+
+
+def init_formula(stream_file=None, buffer_literals=1 << 20):
+    """
+    Create the global clause store. With `stream_file`, clauses are written to
+    that file in the tt-open-wbo-inc format while they are generated, keeping
+    at most `buffer_literals` literals in memory.
+    """
+    global formula
+    if stream_file is None:
+        formula = ClauseStore()
+    else:
+        formula = StreamingClauseStore(open(stream_file, "w"), buffer_literals)
+    return formula
+
+
+def encoding_counters():
+    """
+    Counters the profiler reports per family: auxiliary variables allocated,
+    clauses emitted and encoder calls (all cardinality encodings go through
+    the encoding cache; misses are the calls that ran the encoder).
+    """
+    return {
+        "variables": registry.top,
+        "hard_clauses": formula.num_hard,
+        "soft_clauses": formula.num_soft,
+        "literals": formula.num_literals(),
+        "encoder_calls": encoding_cache.hits + encoding_cache.misses,
+        "encoder_misses": encoding_cache.misses,
+    }
+
 
-def get_variable(name):
-    global counter, reverse_variable_dict
-    if name not in variable_dict and counter not in reverse_variable_dict:
-        if name.startswith('auxvarsc_'):
-            parts = name.split('_')
-            first, last = parts[1], parts[2]
-            if first == last:
-                return first
+def init_profiler(enabled=False, cprofile_dir=None, memory=False):
+    """
+    Create the global per-family profiler (disabled by default).
+    """
+    global profiler
+    profiler = FamilyProfiler(enabled, cprofile_dir, encoding_counters, memory)
+    return profiler
 
-        variable_dict[name] = counter
-        reverse_variable_dict[counter] = name
-        counter += 1
 
-    return variable_dict[name]
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent in the with-block to run_timings[phase].
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run_timings[phase] = run_timings.get(phase, 0.0) + time.perf_counter() - started
 
 
 def map_to_x_variables():
-    global hard_clauses
-    for name in variable_dict:
-        if name.startswith('e_'):
-            parts = name.split('_')
-            n, d = parts[1], parts[2]
-            shifts = [get_variable(f"x_{n}_{d}_{s}_{sk}")
-                      for s in S for sk in nurse_skills.get(int(n), [])]
-            hard_clauses.append(
-                f"-{variable_dict[name]} {' '.join(map(str, shifts))} 0")
-            for shift in shifts:
-                hard_clauses.append(f"-{shift} {variable_dict[name]} 0")
-
-            # shift_vars = [get_variable(f"o_{n}_{d}_{s}") for s in S]
-            # hard_clauses.append(
-            #     f"-{variable_dict[name]} {' '.join(map(str, shift_vars))} 0"
-            # )
-            # for shift_var in shift_vars:
-            #     hard_clauses.append(f"-{shift_var} {variable_dict[name]} 0")
-        elif name.startswith('o_'):
-            parts = name.split('_')
-            n, d, s = parts[1], parts[2], parts[3]
-            shift_vars = [get_variable(f"x_{n}_{d}_{s}_{sk}")
-                          for sk in nurse_skills.get(int(n), [])]
-            hard_clauses.append(
-                f"-{variable_dict[name]} {' '.join(map(str, shift_vars))} 0")
-            for shift_var in shift_vars:
-                hard_clauses.append(f"-{shift_var} {variable_dict[name]} 0")
-        elif name.startswith('q_'):
-            parts = name.split('_')
-            n, w = parts[1], parts[2]
-            saturday = get_variable(f"e_{n}_{int(w) * 7 + 5}")
-            sunday = get_variable(f"e_{n}_{int(w) * 7 + 6}")
-            hard_clauses.append(
-                f"-{variable_dict[name]} {saturday} {sunday} 0")
-            hard_clauses.append(f"-{saturday} {variable_dict[name]} 0")
-            hard_clauses.append(f"-{sunday} {variable_dict[name]} 0")
+    """
+    Add the channeling clauses e/o/q <-> x for every e, o and q variable that
+    some constraint requested.
+
+    The requested variables are read from the registry bitmaps and the clauses
+    are built as arrays, so the cost depends only on the channel variables in
+    use.
+    """
+    D, W = registry.D, registry.W
+    num_shifts = registry.num_shifts
+    x_base = np.frombuffer(registry.x_base, dtype=np.int64)
+    skill_count = np.array([len(skill_ids)
+                           for skill_ids in registry.nurse_skill_ids], dtype=np.int64)
+    e_used = np.frombuffer(registry.e_used, dtype=np.uint8)
+
+    # q first: it requests the weekend e variables channeled below
+    q_index = np.flatnonzero(np.frombuffer(registry.q_used, dtype=np.uint8))
+    n, w = np.divmod(q_index, W)
+    q_vars = registry.q_base + q_index
+    # Weekend outside the horizon: nobody can work it
+    outside = w * 7 + 5 >= D
+    formula.add_hard_rows(-q_vars[outside, None])
+    n, w, q_vars = n[~outside], w[~outside], q_vars[~outside]
+    weekend_index = n[:, None] * D + w[:, None] * 7 + np.array([5, 6])
+    e_used[weekend_index.ravel()] = 1
+    weekend = registry.e_base + weekend_index
+    formula.add_hard_rows(np.column_stack((-q_vars, weekend)))
+    formula.add_hard_rows(np.column_stack(
+        (-weekend.ravel(), np.repeat(q_vars, 2))))
+
+    # e(n, d): the x variables of a day form one contiguous block
+    e_index = np.flatnonzero(e_used)
+    n, d = np.divmod(e_index, D)
+    add_channeling_clauses(registry.e_base + e_index,
+                           x_base[n] + d * num_shifts * skill_count[n],
+                           num_shifts * skill_count[n])
+
+    # o(n, d, s): the x variables of a shift form one contiguous block
+    o_index = np.flatnonzero(np.frombuffer(registry.o_used, dtype=np.uint8))
+    cell, s = np.divmod(o_index, num_shifts)
+    n = cell // D
+    add_channeling_clauses(registry.o_base + o_index,
+                           x_base[n] + cell % D * num_shifts * skill_count[n]
+                           + s * skill_count[n],
+                           skill_count[n])
+
+
+def add_channeling_clauses(channel_vars, x_start, x_count):
+    """
+    Add c -> OR(x) and x -> c for every channel variable c, whose x variables
+    are x_start .. x_start + x_count - 1. Channels with the same number of x
+    variables are added as one block.
+    """
+    for width in np.unique(x_count):
+        group = x_count == width
+        c = channel_vars[group]
+        x = x_start[group, None] + np.arange(width)
+        formula.add_hard_rows(np.column_stack((-c, x)))
+        formula.add_hard_rows(np.column_stack(
+            (-x.ravel(), np.repeat(c, width))))
 
 
 def load_data(scenario_file, history_file, week_files):
@@ -110,322 +261,237 @@ def load_data(scenario_file, history_file, week_files):
     # Map shift types by ID
     shift_types = {shift['id']: shift for shift in scenario['shiftTypes']}
 
-    return scenario, history, weekdays, N, D, S, SK, W, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types
+    # Coverage requirements (D, S, SK, [min, opt])
+    coverage = build_coverage(weekdays, S, SK)
+
+    return scenario, history, weekdays, N, D, S, SK, W, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types, coverage
 
 
 def get_week_index(day_index):
     return (day_index // 7)
 
 
-def get_Cmin(weekdays, d, s, sk):
-    week_index = get_week_index(d)
-    weekday = weekdays[week_index]
-
-    day_mapping = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday',
-                   3: 'Thursday', 4: 'Friday', 5: 'Saturday', 6: 'Sunday'}
-    day = day_mapping.get(d % 7, 'Monday')
-
-    for req in weekday.get('requirements', []):
-        if req['shiftType'] == s and req['skill'] == sk:
-            return req.get(f'requirementOn{day}', {}).get('minimum', 0)
-    return 0
-
-
-def get_Copt(weekdays, d, s, sk):
-    week_index = get_week_index(d)
-    weekday = weekdays[week_index]
-
-    day_mapping = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday',
-                   3: 'Thursday', 4: 'Friday', 5: 'Saturday', 6: 'Sunday'}
-    day = day_mapping.get(d % 7, 'Monday')
-
-    for req in weekday.get('requirements', []):
-        if req['shiftType'] == s and req['skill'] == sk:
-            return req.get(f'requirementOn{day}', {}).get('optimal', 0)
-    return 0
-
-
 def constraint_aux(N, D, S, nurse_skills):
-    clauses = []
+    if amo_encoding['aux'] == 'ladder':
+        # One ladder per (nurse, day, shift), batched by the number of skills
+        rows = defaultdict(list)
+        for n in range(N):
+            skill_ids = registry.nurse_skill_ids[n]
+            if len(skill_ids) < 2:
+                continue
+            rows[len(skill_ids)].extend([registry.x(n, d, s, sk) for sk in skill_ids]
+                                        for d in range(D) for s in range(len(S)))
+        encoder = LadderEncoder(registry, formula)
+        for _, literals in sorted(rows.items()):
+            encoder.at_most_one(np.array(literals), 'aux')
+        return
+
     for n in range(N):
         for d in range(D):
             skills = [sk for sk in nurse_skills.get(n, [])]
             if len(skills) < 2:
                 continue
-            for s in S:
-                shifts = [get_variable(f"x_{n}_{d}_{s}_{sk}")
-                          for sk in nurse_skills.get(n, [])]
+            for s in range(len(S)):
+                shifts = [registry.x(n, d, s, sk)
+                          for sk in registry.nurse_skill_ids[n]]
                 for (s1, s2) in combinations(shifts, 2):
-                    clauses.append(f"-{s1} -{s2} 0")
-    return clauses
+                    formula.add_hard((-s1, -s2))
 
 
 def constraint_H1(N, D, S):
-    clauses = []
+    if amo_encoding['H1'] == 'ladder':
+        shifts = np.array([[registry.o(n, d, s) for s in range(len(S))]
+                           for n in range(N) for d in range(D)])
+        LadderEncoder(registry, formula).at_most_one(shifts, 'H1')
+        return
+
     for n in range(N):
         for d in range(D):
-            shifts = [get_variable(f"o_{n}_{d}_{s}")
-                      for s in S]
+            shifts = [registry.o(n, d, s)
+                      for s in range(len(S))]
 
             for (s1, s2) in combinations(shifts, 2):
-                clauses.append(f"-{s1} -{s2} 0")
-    return clauses
+                formula.add_hard((-s1, -s2))
 
 
 def constraint_H3(N, D, forbidden_shifts, nurse_history):
-    clauses = []
+    shift_index = registry.shift_index
+    successions = [(shift_index[forbidden_shift['precedingShiftType']], shift_index[s2])
+                   for forbidden_shift in forbidden_shifts
+                   for s2 in forbidden_shift['succeedingShiftTypes']]
+    if amo_encoding['H3'] == 'ladder':
+        # Windows over each nurse's shifts; the successions they do not
+        # cover stay pairwise
+        offsets, successions = succession_windows(forbidden_shifts)
+        shifts = np.array([[registry.o(n, d, s) for d in range(D) for s in range(registry.num_shifts)]
+                           for n in range(N)])
+        LadderEncoder(registry, formula).windowed_at_most_one(
+            shifts, registry.num_shifts, offsets, aligned=False, label='H3')
+
     for n in range(N):
         for d in range(D - 1):
-            for forbidden_shift in forbidden_shifts:
-                s1 = forbidden_shift['precedingShiftType']
-                for s2 in forbidden_shift['succeedingShiftTypes']:
-                    var1 = get_variable(f"o_{n}_{d}_{s1}")
-                    var2 = get_variable(f"o_{n}_{d+1}_{s2}")
-                    clauses.append(f"-{var1} -{var2} 0")
+            for s1, s2 in successions:
+                var1 = registry.o(n, d, s1)
+                var2 = registry.o(n, d + 1, s2)
+                formula.add_hard((-var1, -var2))
 
     # Apply constraints using last assigned shift type from history
-    if nurse_history:
-        for nurse in nurse_history:
-            nurse_id = nurse_name_to_index[nurse['nurse']]
-            last_shift_type = nurse['lastAssignedShiftType']
-            if last_shift_type in [fs['precedingShiftType'] for fs in forbidden_shifts]:
-                for forbidden_shift in forbidden_shifts:
-                    if forbidden_shift['precedingShiftType'] == last_shift_type:
-                        for s2 in forbidden_shift['succeedingShiftTypes']:
-                            var2 = get_variable(f"o_{nurse_id}_0_{s2}")
-                            hard_clauses.append(f"-{var2} 0")
+    for nurse_id, s2 in history_blocked_shifts(nurse_history, forbidden_shifts):
+        formula.add_hard((-registry.o(nurse_id, 0, s2),))
 
-    return clauses
 
+def succession_windows(forbidden_shifts):
+    """
+    Cover the forbidden shift successions by windows of the windowed
+    at-most-one over a nurse's (day, shift) sequence, in the order of S: the
+    window `offset` shifts before the end of a day forbids each of the last
+    `offset` shifts of the day followed by any of the first |S| - offset
+    shifts of the next day. Returns the offsets of the windows that only
+    forbid forbidden successions and the (s1, s2) pairs none of them covers.
+    """
+    width = registry.num_shifts
+    forbidden = {(registry.shift_index[rule['precedingShiftType']], registry.shift_index[s2])
+                 for rule in forbidden_shifts for s2 in rule['succeedingShiftTypes']}
 
-def constraint_H3_SC(N, D, S, forbidden_shifts, nurse_history, weekdays):
-    def encode_window(window, width, very_first_shift, n):
-        # First window
-        if window == 0:
-            lastVar = window * width + width + very_first_shift - 1
-
-            for i in range(width - 1, 0, -1):
-                var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{var}_{lastVar}')
-                hard_clauses.append(f"-{var} {var_R} 0")
-
-            for i in range(width, 1, -1):
-                var = window * width + i + very_first_shift - 1
-                var_R_1 = get_variable(f'auxvarsc_{var}_{lastVar}')
-                var_R_2 = get_variable(f'auxvarsc_{var - 1}_{lastVar}')
-                hard_clauses.append(f"-{var_R_1} {var_R_2} 0")
-
-            for i in range(1, width, 1):
-                var = window * width + i + very_first_shift - 1
-                main = get_variable(f'auxvarsc_{var}_{lastVar}')
-                sub = get_variable(f'auxvarsc_{var + 1}_{lastVar}')
-                hard_clauses.append(f"{var} {sub} -{main} 0")
-
-            for i in range(1, width, 1):
-                var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{var + 1}_{lastVar}')
-                hard_clauses.append(f"-{var} -{var_R} 0")
-        # Last window
-        elif window == ceil(float(n) / width) - 1:
-            if window == 3:
-                print("check")
-            firstVar = window * width + 1 + very_first_shift - 1
-
-            for i in range(2, width + 1, 1):
-                reverse_var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{firstVar}_{reverse_var}')
-                hard_clauses.append(f"-{reverse_var} {var_R} 0")
-
-            for i in range(width - 1, 0, -1):
-                reverse_var = window * width + width - i + very_first_shift - 1
-                var_R_1 = get_variable(f'auxvarsc_{firstVar}_{reverse_var}')
-                var_R_2 = get_variable(
-                    f'auxvarsc_{firstVar}_{reverse_var + 1}')
-                hard_clauses.append(f"-{var_R_1} {var_R_2} 0")
-
-            for i in range(0, width - 1, 1):
-                var = window * width + width - i + very_first_shift - 1
-                main = get_variable(f'auxvarsc_{firstVar}_{var}')
-                sub = get_variable(f'auxvarsc_{firstVar}_{var - 1}')
-                hard_clauses.append(f"{sub} {var} -{main} 0")
-
-            for i in range(width, 1, -1):
-                reverse_var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{firstVar}_{reverse_var - 1}')
-                hard_clauses.append(f"-{reverse_var} -{var_R} 0")
-        else:
-            # Middle windows
-            # Upper part
-            firstVar = window * width + 1 + very_first_shift - 1
-
-            for i in range(2, width + 1, 1):
-                reverse_var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{firstVar}_{reverse_var}')
-                hard_clauses.append(f"-{reverse_var} {var_R} 0")
-
-            for i in range(width - 1, 0, -1):
-                reverse_var = window * width + width - i + very_first_shift - 1
-                var_R_1 = get_variable(f'auxvarsc_{firstVar}_{reverse_var}')
-                var_R_2 = get_variable(
-                    f'auxvarsc_{firstVar}_{reverse_var + 1}')
-                hard_clauses.append(f"-{var_R_1} {var_R_2} 0")
-
-            for i in range(0, width - 1, 1):
-                var = window * width + width - i + very_first_shift - 1
-                main = get_variable(f'auxvarsc_{firstVar}_{var}')
-                sub = get_variable(f'auxvarsc_{firstVar}_{var - 1}')
-                hard_clauses.append(f"{sub} {var} -{main} 0")
-
-            for i in range(width, 1, -1):
-                reverse_var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{firstVar}_{reverse_var - 1}')
-                hard_clauses.append(f"-{reverse_var} -{var_R} 0")
-
-            # Lower part
-            lastVar = window * width + width + very_first_shift - 1
-
-            for i in range(width - 1, 0, -1):
-                var = window * width + i + very_first_shift - 1
-                var_R = get_variable(f'auxvarsc_{var}_{lastVar}')
-                hard_clauses.append(f"-{var} {var_R} 0")
-
-            for i in range(width, 1, -1):
-                var = window * width + i + very_first_shift - 1
-                var_R_1 = get_variable(f'auxvarsc_{var}_{lastVar}')
-                var_R_2 = get_variable(f'auxvarsc_{var - 1}_{lastVar}')
-                hard_clauses.append(f"-{var_R_1} {var_R_2} 0")
-
-            for i in range(1, width, 1):
-                var = window * width + i + very_first_shift - 1
-                main = get_variable(f'auxvarsc_{var}_{lastVar}')
-                sub = get_variable(f'auxvarsc_{var + 1}_{lastVar}')
-                hard_clauses.append(f"{var} {sub} -{main} 0")
-
-    def glue_window(window, isLack, very_first_shift):
-        for i in range(1, width, 1):
-            if isLack:
-                if width == 8 and (i == 1 or i == 2 or i == 3 or i == 5 or i == 7):
-                    continue
-                if width == 4 and i == 1:
-                    continue
-            first_reverse_var = (window + 1) * width + 1 + very_first_shift - 1
-            last_var = window * width + width + very_first_shift - 1
-            reverse_var = (window + 1) * width + i + very_first_shift - 1
-            var = window * width + i + 1 + very_first_shift - 1
+    def window(offset):
+        return {(s1, s2) for s1 in range(width - offset, width) for s2 in range(width - offset)}
+
+    offsets = [offset for offset in range(1, width) if window(offset) <= forbidden]
+    covered = set().union(*map(window, offsets))
+    return offsets, sorted(forbidden - covered)
+
+
+def history_blocked_shifts(nurse_history, forbidden_shifts):
+    """
+    Return the (nurse index, shift index) pairs the last shift of the history
+    forbids on the first day.
+    """
+    blocked = []
+    for nurse in nurse_history or []:
+        nurse_id = nurse_name_to_index[nurse['nurse']]
+        last_shift_type = nurse['lastAssignedShiftType']
+        for forbidden_shift in forbidden_shifts:
+            if forbidden_shift['precedingShiftType'] == last_shift_type:
+                for s2 in forbidden_shift['succeedingShiftTypes']:
+                    blocked.append((nurse_id, registry.shift_index[s2]))
+    return blocked
+
+
+def coverage_nurses(N, d, si, ki, bound=0):
+    """
+    Return the x variables of the nurses who can cover shift si with skill ki
+    on day d. The (nurse, day, shift) cells in excluded_x (fixed to off, see
+    --propagate) are left out, unless fewer than `bound` nurses would remain:
+    the full list then keeps the constraint as unsatisfiable as it is.
+    """
+    nurses = [n for n in range(N) if registry.has_skill(n, ki)]
+    if excluded_x:
+        available = [n for n in nurses if (n, d, si) not in excluded_x]
+        if len(available) >= bound:
+            nurses = available
+    return [registry.x(n, d, si, ki) for n in nurses]
 
-            var_R_1 = get_variable(f'auxvarsc_{var}_{last_var}')
-            var_R_2 = get_variable(
-                f'auxvarsc_{first_reverse_var}_{reverse_var}')
 
-            hard_clauses.append(f"-{var_R_1} -{var_R_2} 0")
+def constraint_symmetry_breaking(classes):
+    """
+    Lexicographic symmetry breaking: within each class of interchangeable
+    nurses (see symmetry.nurse_classes), the x vector of a nurse must be
+    lexicographically >= the one of the next nurse, comparing day by day,
+    shift by shift and skill by skill. The e variables follow from the x
+    ones, so the x vectors decide.
+
+    For vectors X, Y of length L, the auxiliary a_i means "X and Y are equal
+    up to position i" (a_-1 is true); the clauses are
+        a_(i-1) -> (Y_i -> X_i)
+        a_(i-1) -> (X_i or a_i),  a_(i-1) -> (not Y_i or a_i)
+    i.e. 3L - 2 clauses and L - 1 variables per pair of nurses.
+    """
+    for nurses in classes:
+        skills = sorted(registry.nurse_skill_ids[nurses[0]])
+        vectors = [np.array([registry.x(n, d, s, sk)
+                             for d in range(registry.D)
+                             for s in range(registry.num_shifts)
+                             for sk in skills], dtype=np.int64)
+                   for n in nurses]
+        length = len(vectors[0])
+        for first, second, X, Y in zip(nurses, nurses[1:], vectors, vectors[1:]):
+            formula.add_hard((-Y[0], X[0]))
+            if length == 1:
+                continue
+            a = registry.new_block(length - 1, "sym_{}_{}_{j}", (first, second)) + np.arange(length - 1)
+            formula.add_hard_rows(np.column_stack((X[:1], a[:1])))
+            formula.add_hard_rows(np.column_stack((-Y[:1], a[:1])))
+            formula.add_hard_rows(np.column_stack((-a, -Y[1:], X[1:])))
+            formula.add_hard_rows(np.column_stack((-a[:-1], X[1:-1], a[1:])))
+            formula.add_hard_rows(np.column_stack((-a[:-1], -Y[1:-1], a[1:])))
 
-    hard_clauses = []
-    width = len(S)
-    # isLack = False
-    isLack = True
 
+def constraint_H3_SC(N, D, S, forbidden_shifts, nurse_history, weekdays):
+    """
+    H1 and H3 as one staircase: a windowed at-most-one over each nurse's
+    (day, shift) sequence, whose day blocks give H1 and whose windows across
+    two days give the forbidden successions (see succession_windows). The
+    successions no window covers and the history's are added pairwise.
+    """
+    offsets, successions = succession_windows(forbidden_shifts)
+    shifts = np.array([[registry.o(n, d, s) for d in range(D) for s in range(len(S))]
+                       for n in range(N)])
+    LadderEncoder(registry, formula).windowed_at_most_one(shifts, len(S), offsets, label='H1_H3')
     for n in range(N):
-        shifts = [get_variable(f"o_{n}_{d}_{s}")
-                  for d in range(D) for s in S]
-        very_first_shift = shifts[0]
-
-        for gw in range(0, len(weekdays) * 7):
-            encode_window(gw, width, very_first_shift,
-                          width * len(weekdays) * 7)
-
-        for gw in range(0, len(weekdays) * 7 - 1):
-            glue_window(gw, isLack, very_first_shift)
-
-    if nurse_history:
-        for nurse in nurse_history:
-            nurse_id = nurse_name_to_index[nurse['nurse']]
-            last_shift_type = nurse['lastAssignedShiftType']
-            if last_shift_type in [fs['precedingShiftType'] for fs in forbidden_shifts]:
-                for forbidden_shift in forbidden_shifts:
-                    if forbidden_shift['precedingShiftType'] == last_shift_type:
-                        for s2 in forbidden_shift['succeedingShiftTypes']:
-                            #     for sk in nurse_skills.get(nurse_id, []):
-                            #         var2 = get_variable(
-                            #             f"x_{nurse_id}_0_{s2}_{sk}")
-                            #         hard_clauses.append(f"-{var2} 0")
-                            var2 = get_variable(
-                                f"o_{nurse_id}_0_{s2}")
-                            hard_clauses.append(f"-{var2} 0")
-    return hard_clauses
-
-
-def constraint_optilog_H2(N, D, S, SK, weekdays, nurse_skills):
-    clauses = []
+        for d in range(D - 1):
+            for s1, s2 in successions:
+                formula.add_hard((-registry.o(n, d, s1), -registry.o(n, d + 1, s2)))
+    for nurse_id, s2 in history_blocked_shifts(nurse_history, forbidden_shifts):
+        formula.add_hard((-registry.o(nurse_id, 0, s2),))
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Cmin = get_Cmin(weekdays, d, s, sk)
-                Copt = get_Copt(weekdays, d, s, sk)
-                nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}") for n in range(
-                    N) if sk in nurse_skills.get(n, [])]
 
-                # Ensure at least Cmin nurses are assigned (hard constraint)
-                if Cmin > 0 and len(nurses) >= Cmin:
+def constraint_optilog_H2(N, D, S, SK, coverage, nurse_skills):
 
-                    max_var_cmin, formula = Encoder.at_least_k(
-                        nurses, Cmin, max_var=len(variable_dict), encoding=optilog_encoding)
-                    for clause in formula:
-                        clauses.append(" ".join(map(str, clause)) + " 0")
+    for d, si, ki in coverage_cells(coverage[..., COV_MIN] > 0):
+        Cmin = int(coverage[d, si, ki, COV_MIN])
+        nurses = [registry.x(n, d, si, ki) for n in range(
+            N) if registry.has_skill(n, ki)]
 
-                    # Update variable_dict with new variables created by pb2.encode_at_least_k
-                    for var in range(len(variable_dict) + 1, max_var_cmin + 1):
-                        variable_dict[f"aux_cmin{var}"] = var
-                        reverse_variable_dict[var] = f"aux_cmin{var}"
+        # Ensure at least Cmin nurses are assigned (hard constraint)
+        if len(nurses) >= Cmin:
 
-                    global counter
-                    counter = max_var_cmin + 1
+            max_var_cmin, cnf = encoding_cache.at_least_k(
+                nurses, Cmin, max_var=registry.top, encoding=optilog_encoding)
+            formula.extend_hard(cnf)
 
-    return clauses
+            # Register the auxiliary variables created by the encoder
+            registry.claim(max_var_cmin, "aux_cmin{v}")
 
 
-def constraint_new_optilog_H2(N, D, S, SK, weekdays, nurse_skills):
-    clauses = []
+def constraint_new_optilog_H2(N, D, S, SK, coverage, nurse_skills):
+
+    # Cells with Cmin < Copt are encoded together with S1
+    cmin, copt = coverage[..., COV_MIN], coverage[..., COV_OPT]
+    for d, si, ki in coverage_cells((cmin > 0) & (cmin == copt)):
+        Cmin = int(cmin[d, si, ki])
+        nurses = coverage_nurses(N, d, si, ki, Cmin)
+
+        # Ensure at least Cmin nurses are assigned (hard constraint)
+        if len(nurses) >= Cmin:
+
+            max_var_cmin, cnf = encoding_cache.at_least_k(
+                nurses, Cmin, max_var=registry.top, encoding=optilog_encoding)
+            formula.extend_hard(cnf)
+
+            # Register the auxiliary variables created by the encoder
+            registry.claim(max_var_cmin, "aux_cmin{v}")
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Cmin = get_Cmin(weekdays, d, s, sk)
-                Copt = get_Copt(weekdays, d, s, sk)
-                nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}") for n in range(
-                    N) if sk in nurse_skills.get(n, [])]
-
-                # Ensure at least Cmin nurses are assigned (hard constraint)
-                if Cmin > 0 and len(nurses) >= Cmin and Cmin == Copt:
-
-                    max_var_cmin, formula = Encoder.at_least_k(
-                        nurses, Cmin, max_var=len(variable_dict), encoding=optilog_encoding)
-                    for clause in formula:
-                        clauses.append(" ".join(map(str, clause)) + " 0")
-
-                    # Update variable_dict with new variables created by pb2.encode_at_least_k
-                    for var in range(len(variable_dict) + 1, max_var_cmin + 1):
-                        variable_dict[f"aux_cmin{var}"] = var
-                        reverse_variable_dict[var] = f"aux_cmin{var}"
-
-                    global counter
-                    counter = max_var_cmin + 1
-
-    return clauses
 # S1. Optimal coverage
 
 
-def constraint_S1_pypblib(N, D, S, SK, weekdays, nurse_skills, penalty_weight):
+def constraint_S1_pypblib(N, D, S, SK, coverage, nurse_skills, penalty_weight):
     """
     Tạo các ràng buộc mềm S1 (phạt thiếu hụt so với Copt) sử dụng pypblib
     để mã hóa phần ràng buộc cứng liên quan đến biến phạt.
 
-    Thêm các mệnh đề CỨNG cần thiết vào danh sách global `hard_clauses`.
-    Trả về danh sách các mệnh đề MỀM.
+    Thêm các mệnh đề CỨNG và MỀM vào `formula` toàn cục.
     """
-    global counter, hard_clauses, variable_dict, reverse_variable_dict  # Khai báo để cập nhật biến toàn cục
 
-    soft_clauses_for_S1 = []  # Danh sách cục bộ cho mệnh đề mềm
 
     # Khởi tạo cấu hình và bộ mã hóa pypblib
     config = PBConfig()
@@ -434,253 +500,173 @@ def constraint_S1_pypblib(N, D, S, SK, weekdays, nurse_skills, penalty_weight):
     config.set_PB_Encoder(pypblib_encoding)
     pb2 = Pb2cnf(config)
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Copt = get_Copt(weekdays, d, s, sk)
-                Cmin = get_Cmin(weekdays, d, s, sk)
-
-                # Chỉ phạt khi Copt > Cmin (vì H2 đã đảm bảo >= Cmin)
-                if Copt <= Cmin:
-                    continue
-
-                # Lấy danh sách biến y tá có thể làm ca này
-                nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}")
-                          for n in range(N) if sk in nurse_skills.get(n, [])]
-
-                # Số lượng thiếu hụt tối đa có thể xảy ra so với Copt (đã đảm bảo >= Cmin)
-                # Nếu không có y tá nào, thiếu tối đa Copt - Cmin (nếu Copt > Cmin)
-                max_shortfall = Copt - Cmin
-
-                if max_shortfall <= 0:
-                    continue
-
-                # Tạo các biến phạt cho sự thiếu hụt
-                penalty_vars = []
-                for j in range(max_shortfall):
-                    # get_variable sẽ tự tăng counter và cập nhật dicts
-                    # Đặt tên rõ ràng hơn cho biến phạt liên quan đến pypblib
-                    p_var = get_variable(f"penalty_s1_pblib_{d}_{s}_{sk}_{j}")
-                    penalty_vars.append(p_var)
+    for d, si, ki in coverage_cells(coverage[..., COV_OPT] > coverage[..., COV_MIN]):
+        s, sk = S[si], SK[ki]
+        Copt = int(coverage[d, si, ki, COV_OPT])
+        Cmin = int(coverage[d, si, ki, COV_MIN])
 
-                # --- RÀNG BUỘC CỨNG: sum(nurses) + sum(penalty_vars) >= Copt ---
-                # Đây là phần chúng ta sẽ dùng pypblib để mã hóa
-                combined_vars = nurses + penalty_vars
+        # Lấy danh sách biến y tá có thể làm ca này
+        nurses = [registry.x(n, d, si, ki)
+                  for n in range(N) if registry.has_skill(n, ki)]
 
-                # Trường hợp không có biến nào nhưng Copt > Cmin (không thể thỏa mãn)
-                if not combined_vars and Copt > Cmin:
-                    print(
-                        f"CẢNH BÁO (S1 pypblib): Không thể đáp ứng Copt={Copt} cho d={d}, s={s}, sk={sk} vì không có y tá/biến phạt."
-                    )
-                    # Thêm ràng buộc cứng không thể thỏa mãn
-                    # Đảm bảo biến 1 tồn tại
-                    if 'dummy_unsat' not in variable_dict:
-                        # Gọi để thêm vào dict nếu cần
-                        get_variable('dummy_unsat')
-                    hard_clauses.append("1 0")
-                    hard_clauses.append("-1 0")
-                    continue  # Bỏ qua lần lặp này
-
-                elif combined_vars:
-                    formula_hard = []
-                    # Lấy ID biến lớn nhất hiện tại TRƯỚC khi gọi encode
-                    current_top_var = counter - 1
-
-                    # Mã hóa ràng buộc cứng Sum(combined_vars) >= Copt bằng pypblib
-                    # ID biến phụ trợ sẽ bắt đầu từ current_top_var + 1
-                    top_var_pblib = pb2.encode_at_least_k(
-                        combined_vars, Copt, formula_hard, current_top_var + 1
-                    )
-
-                    # Thêm các mệnh đề CNF được tạo ra vào danh sách hard_clauses TOÀN CỤC
-                    for clause in formula_hard:
-                        hard_clauses.append(" ".join(map(str, clause)) + " 0")
-
-                    # Cập nhật counter và dictionaries cho các biến phụ trợ MỚI
-                    # mà pypblib đã tạo ra (từ current_top_var + 1 đến top_var_pblib)
-                    for var_idx in range(current_top_var + 1, top_var_pblib + 1):
-                        # Tạo tên duy nhất cho biến phụ trợ của pypblib
-                        aux_pblib_name = f"aux_s1_pblib_{d}_{s}_{sk}_{var_idx}"
-                        if var_idx not in reverse_variable_dict:
-                            variable_dict[aux_pblib_name] = var_idx
-                            reverse_variable_dict[var_idx] = aux_pblib_name
-                        # else: # Nếu biến đã tồn tại, có thể có lỗi logic
-                        #    print(f"Cảnh báo: Biến phụ trợ pypblib {var_idx} đã tồn tại.")
-
-                    # Cập nhật counter toàn cục lên giá trị cao nhất mới được sử dụng
-                    # Đảm bảo counter luôn là ID tiếp theo chưa được dùng
-                    counter = max(counter, top_var_pblib + 1)
+        # Số lượng thiếu hụt tối đa có thể xảy ra so với Copt (đã đảm bảo >= Cmin)
+        # Nếu không có y tá nào, thiếu tối đa Copt - Cmin (nếu Copt > Cmin)
+        max_shortfall = Copt - Cmin
 
-                # --- RÀNG BUỘC MỀM: Phạt việc sử dụng các biến phạt ---
-                # Thêm vào danh sách soft_clauses_for_S1 CỤC BỘ của hàm này
-                for p_var in penalty_vars:
-                    soft_clauses_for_S1.append((penalty_weight, f"-{p_var} 0"))
-
-    # Trả về danh sách các mệnh đề mềm ĐÃ được tạo bởi logic S1 này
-    return soft_clauses_for_S1
-
-
-def constraint_S1(N, D, S, SK, weekdays, nurse_skills, penalty_weight):
-    global counter, variable_dict, reverse_variable_dict
+        if max_shortfall <= 0:
+            continue
 
-    soft_clauses = []
+        # Tạo các biến phạt cho sự thiếu hụt
+        # Đặt tên rõ ràng hơn cho biến phạt liên quan đến pypblib
+        first_p_var = registry.new_block(
+            max_shortfall, "penalty_s1_pblib_{}_{}_{}_{j}", (d, s, sk))
+        penalty_vars = list(
+            range(first_p_var, first_p_var + max_shortfall))
+
+        # --- RÀNG BUỘC CỨNG: sum(nurses) + sum(penalty_vars) >= Copt ---
+        # Đây là phần chúng ta sẽ dùng pypblib để mã hóa
+        combined_vars = nurses + penalty_vars
+
+        # Trường hợp không có biến nào nhưng Copt > Cmin (không thể thỏa mãn)
+        if not combined_vars and Copt > Cmin:
+            print(
+                f"CẢNH BÁO (S1 pypblib): Không thể đáp ứng Copt={Copt} cho d={d}, s={s}, sk={sk} vì không có y tá/biến phạt."
+            )
+            # Thêm ràng buộc cứng không thể thỏa mãn
+            formula.add_hard((1,))
+            formula.add_hard((-1,))
+            continue  # Bỏ qua lần lặp này
+
+        elif combined_vars:
+            formula_hard = []
+            # Lấy ID biến lớn nhất hiện tại TRƯỚC khi gọi encode
+            current_top_var = registry.top
+
+            # Mã hóa ràng buộc cứng Sum(combined_vars) >= Copt bằng pypblib
+            # ID biến phụ trợ sẽ bắt đầu từ current_top_var + 1
+            top_var_pblib = pb2.encode_at_least_k(
+                combined_vars, Copt, formula_hard, current_top_var + 1
+            )
+
+            # Thêm các mệnh đề CNF được tạo ra vào formula TOÀN CỤC
+            formula.extend_hard(formula_hard)
+
+            # Đăng ký các biến phụ trợ MỚI mà pypblib đã tạo ra
+            # (từ current_top_var + 1 đến top_var_pblib)
+            registry.claim(
+                top_var_pblib, "aux_s1_pblib_{}_{}_{}_{v}", (d, s, sk))
+
+        # --- RÀNG BUỘC MỀM: Phạt việc sử dụng các biến phạt ---
+        # Thêm vào formula TOÀN CỤC dưới dạng mệnh đề mềm
+        for p_var in penalty_vars:
+            formula.add_soft(penalty_weight, (-p_var,))
+
+
+def constraint_S1(N, D, S, SK, coverage, nurse_skills, penalty_weight):
     config = PBConfig()
     config.set_PB_Encoder(pypblib_encoding)
     # config.set_AMK_Encoder(pypblib_encoding)
     pb2 = Pb2cnf(config)
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Copt = get_Copt(weekdays, d, s, sk)
-                Cmin = get_Cmin(weekdays, d, s, sk)
-                if Copt - Cmin <= 0:
-                    continue
-
-                # Penalize each missing nurse below Copt (soft constraint)
-                if Copt > 0:
-                    nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}") for n in range(
-                        N) if sk in nurse_skills.get(n, [])]
-                    formula = []
-                    max_var_copt = pb2.encode_at_least_k(
-                        nurses, Copt, formula, len(variable_dict) + 1)
-                    for clause in formula:
-                        soft_clauses.append(
-                            (penalty_weight, " ".join(map(str, clause)) + " 0"))
+    for d, si, ki in coverage_cells(coverage[..., COV_OPT] > coverage[..., COV_MIN]):
+        Copt = int(coverage[d, si, ki, COV_OPT])
 
-                    for var in range(len(variable_dict) + 1, max_var_copt + 1):
-                        variable_dict[f"aux_cmax{var}"] = var
-                        reverse_variable_dict[var] = f"aux_cmax{var}"
+        # Penalize each missing nurse below Copt (soft constraint)
+        if Copt > 0:
+            nurses = [registry.x(n, d, si, ki) for n in range(
+                N) if registry.has_skill(n, ki)]
+            cnf = []
+            max_var_copt = pb2.encode_at_least_k(
+                nurses, Copt, cnf, registry.top + 1)
+            formula.extend_soft(penalty_weight, cnf)
 
-                    counter = max_var_copt + 1
-    return soft_clauses
+            registry.claim(max_var_copt, "aux_cmax{v}")
 
 
-def constraint_S1_new_optilog(N, D, S, SK, weekdays, nurse_skills, penalty_weight):
+def constraint_S1_new_optilog(N, D, S, SK, coverage, nurse_skills, penalty_weight):
     """
     Tạo các ràng buộc mềm để phạt việc không đáp ứng Copt, sử dụng biến phạt phụ trợ.
-    Đồng thời thêm các ràng buộc cứng cần thiết vào danh sách hard_clauses toàn cục.
+    Các ràng buộc cứng và mềm đều được thêm vào `formula` toàn cục.
     """
-    global counter, hard_clauses, variable_dict, reverse_variable_dict  # Khai báo các biến toàn cục sẽ sửa đổi
-
-    soft_clauses_for_S1 = []  # Danh sách cục bộ cho các mệnh đề mềm mà hàm này trả về
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Copt = get_Copt(weekdays, d, s, sk)
-                Cmin = get_Cmin(weekdays, d, s, sk)
-
-                # Chỉ phạt khi Copt lớn hơn Cmin một cách rõ ràng
-                # Nếu Copt <= Cmin, ràng buộc cứng H2 đã đảm bảo không cần phạt
-                if Copt <= Cmin:
-                    continue
 
-                # Lấy danh sách các biến y tá có thể làm ca này
-                nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}")
-                          for n in range(N) if sk in nurse_skills.get(n, [])]
+    # Chỉ phạt khi Copt lớn hơn Cmin một cách rõ ràng
+    # Nếu Copt <= Cmin, ràng buộc cứng H2 đã đảm bảo không cần phạt
+    for d, si, ki in coverage_cells(coverage[..., COV_OPT] > coverage[..., COV_MIN]):
+        s, sk = S[si], SK[ki]
+        Copt = int(coverage[d, si, ki, COV_OPT])
+        Cmin = int(coverage[d, si, ki, COV_MIN])
 
-                # Tính số lượng thiếu hụt tối đa có thể xảy ra so với Copt,
-                # giả sử Cmin đã được đáp ứng (do H2 là ràng buộc cứng)
-                # Nếu không có y tá nào, shortfall có thể lên tới Copt
-                # Nếu có y tá, shortfall tối đa là Copt - Cmin
-                max_shortfall = Copt if not nurses else Copt - Cmin
+        # Lấy danh sách các biến y tá có thể làm ca này
+        nurses = [registry.x(n, d, si, ki)
+                  for n in range(N) if registry.has_skill(n, ki)]
 
-                # Nếu không có khả năng thiếu hụt (ví dụ Cmin = Copt), bỏ qua
-                if max_shortfall <= 0:
-                    continue
+        # Tính số lượng thiếu hụt tối đa có thể xảy ra so với Copt,
+        # giả sử Cmin đã được đáp ứng (do H2 là ràng buộc cứng)
+        # Nếu không có y tá nào, shortfall có thể lên tới Copt
+        # Nếu có y tá, shortfall tối đa là Copt - Cmin
+        max_shortfall = Copt if not nurses else Copt - Cmin
 
-                # Tạo các biến phạt cho sự thiếu hụt tiềm năng
-                penalty_vars = []
-                for j in range(max_shortfall):
-                    # get_variable sẽ tự động tăng counter và cập nhật dicts
-                    p_var = get_variable(f"penalty_s1_{d}_{s}_{sk}_{j}")
-                    penalty_vars.append(p_var)
-
-                # --- RÀNG BUỘC CỨNG: sum(nurses) + sum(penalty_vars) >= Copt ---
-                combined_vars = nurses + penalty_vars
-
-                # Xử lý trường hợp không có biến nào cả nhưng Copt > 0 (không thể thỏa mãn)
-                if not combined_vars and Copt > 0:
-                    # Thêm một mệnh đề cứng không thể thỏa mãn để báo lỗi
-                    print(
-                        f"CẢNH BÁO: Không thể đáp ứng Copt={Copt} cho d={d}, s={s}, sk={sk} vì không có y tá/biến phạt.")
-                    hard_clauses.append("1 0")  # Thêm x và -x để tạo UNSAT
-                    # Nên thêm biến số 1 vào dict nếu chưa có
-                    hard_clauses.append("-1 0")
-                    if 'dummy_unsat' not in variable_dict:
-                        variable_dict['dummy_unsat'] = 1
-                        reverse_variable_dict[1] = 'dummy_unsat'
-                    continue  # Chuyển sang lần lặp tiếp theo
-
-                # Nếu có biến, sử dụng bộ mã hóa at_least_k
-                elif combined_vars:
-                    # Sử dụng optilog encoder cho ràng buộc cứng >= Copt
-                    # max_var nên là giá trị counter hiện tại TRỪ 1
-                    current_top_var = counter - 1
-                    top_var, formula = Encoder.at_least_k(
-                        combined_vars, Copt, max_var=current_top_var, encoding=optilog_encoding)
-
-                    # Thêm các mệnh đề được tạo ra vào danh sách hard_clauses TOÀN CỤC
-                    for clause in formula:
-                        hard_clauses.append(" ".join(map(str, clause)) + " 0")
-
-                    # Cập nhật counter và dictionaries cho các biến phụ trợ MỚI
-                    # được tạo ra BÊN TRONG bộ mã hóa at_least_k
-                    for var_idx in range(current_top_var + 1, top_var + 1):
-                        # Tạo tên duy nhất cho biến phụ trợ của encoder
-                        aux_encoder_name = f"aux_s1_enc_{d}_{s}_{sk}_{var_idx}"
-                        if var_idx not in reverse_variable_dict:  # Chỉ thêm nếu chưa tồn tại
-                            variable_dict[aux_encoder_name] = var_idx
-                            reverse_variable_dict[var_idx] = aux_encoder_name
-                        # else: # Nếu biến đã tồn tại, có thể có lỗi logic hoặc trùng lặp ID
-                        #     print(f"Cảnh báo: Biến phụ trợ {var_idx} đã tồn tại.")
-
-                    # Cập nhật counter toàn cục lên giá trị cao nhất mới được sử dụng bởi encoder
-                    counter = top_var + 1  # Rất quan trọng!
-
-                # --- RÀNG BUỘC MỀM: Phạt việc sử dụng các biến phạt ---
-                for p_var in penalty_vars:
-                    # Thêm (-p_var) như một mệnh đề mềm vào danh sách cục bộ của hàm này
-                    soft_clauses_for_S1.append((penalty_weight, f"-{p_var} 0"))
-
-    # Trả về danh sách các mệnh đề mềm ĐÃ được tạo bởi logic S1 này
-    return soft_clauses_for_S1
-
-
-def constraint_S1_old_optilog(N, D, S, SK, weekdays, nurse_skills, penalty_weight):
-    global counter, variable_dict, reverse_variable_dict
-    soft_clauses = []
-
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Copt = get_Copt(weekdays, d, s, sk)
-                Cmin = get_Cmin(weekdays, d, s, sk)
-                if Copt - Cmin <= 0:
-                    continue
+        # Nếu không có khả năng thiếu hụt (ví dụ Cmin = Copt), bỏ qua
+        if max_shortfall <= 0:
+            continue
 
-                # Penalize each missing nurse below Copt (soft constraint)
-                if Copt > 0:
-                    nurses = [get_variable(f"x_{n}_{d}_{s}_{sk}") for n in range(
-                        N) if sk in nurse_skills.get(n, [])]
-                    max_var_copt, formula = Encoder.at_least_k(
-                        nurses, Copt, max_var=len(variable_dict), encoding=optilog_encoding)
-                    for clause in formula:
-                        soft_clauses.append(
-                            (penalty_weight, " ".join(map(str, clause)) + " 0"))
-
-                    for var in range(len(variable_dict) + 1, max_var_copt + 1):
-                        variable_dict[f"aux_cmax{var}"] = var
-                        reverse_variable_dict[var] = f"aux_cmax{var}"
-
-                    counter = max_var_copt + 1
-    return soft_clauses
+        # Tạo các biến phạt cho sự thiếu hụt tiềm năng
+        first_p_var = registry.new_block(
+            max_shortfall, "penalty_s1_{}_{}_{}_{j}", (d, s, sk))
+        penalty_vars = list(
+            range(first_p_var, first_p_var + max_shortfall))
+
+        # --- RÀNG BUỘC CỨNG: sum(nurses) + sum(penalty_vars) >= Copt ---
+        if nurses and excluded_x:
+            nurses = coverage_nurses(N, d, si, ki, Cmin)
+        combined_vars = nurses + penalty_vars
+
+        # Xử lý trường hợp không có biến nào cả nhưng Copt > 0 (không thể thỏa mãn)
+        if not combined_vars and Copt > 0:
+            # Thêm một mệnh đề cứng không thể thỏa mãn để báo lỗi
+            print(
+                f"CẢNH BÁO: Không thể đáp ứng Copt={Copt} cho d={d}, s={s}, sk={sk} vì không có y tá/biến phạt.")
+            formula.add_hard((1,))  # Thêm x và -x để tạo UNSAT
+            formula.add_hard((-1,))
+            continue  # Chuyển sang lần lặp tiếp theo
+
+        # Nếu có biến, sử dụng bộ mã hóa at_least_k
+        elif combined_vars:
+            # Sử dụng optilog encoder cho ràng buộc cứng >= Copt
+            top_var, cnf = encoding_cache.at_least_k(
+                combined_vars, Copt, max_var=registry.top, encoding=optilog_encoding)
+
+            # Thêm các mệnh đề được tạo ra vào formula TOÀN CỤC
+            formula.extend_hard(cnf)
+
+            # Đăng ký các biến phụ trợ MỚI được tạo ra BÊN TRONG bộ mã hóa at_least_k
+            registry.claim(top_var, "aux_s1_enc_{}_{}_{}_{v}", (d, s, sk))
+
+        # --- RÀNG BUỘC MỀM: Phạt việc sử dụng các biến phạt ---
+        for p_var in penalty_vars:
+            # Thêm (-p_var) như một mệnh đề mềm vào formula
+            formula.add_soft(penalty_weight, (-p_var,))
+
+
+def constraint_S1_old_optilog(N, D, S, SK, coverage, nurse_skills, penalty_weight):
+
+    for d, si, ki in coverage_cells(coverage[..., COV_OPT] > coverage[..., COV_MIN]):
+        Copt = int(coverage[d, si, ki, COV_OPT])
+
+        # Penalize each missing nurse below Copt (soft constraint)
+        if Copt > 0:
+            nurses = [registry.x(n, d, si, ki) for n in range(
+                N) if registry.has_skill(n, ki)]
+            max_var_copt, cnf = encoding_cache.at_least_k(
+                nurses, Copt, max_var=registry.top, encoding=optilog_encoding)
+            formula.extend_soft(penalty_weight, cnf)
+
+            registry.claim(max_var_copt, "aux_cmax{v}")
 # S4. Preferences(10)
 
 
 def constraint_S4_SOR(weekdays, nurse_name_to_index, penalty_weight):
-    soft_clauses = []
     day_mapping = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday',
                    3: 'Thursday', 4: 'Friday', 5: 'Saturday', 6: 'Sunday'}
 
@@ -700,24 +686,22 @@ def constraint_S4_SOR(weekdays, nurse_name_to_index, penalty_weight):
                 (d for d, day_name in day_mapping.items() if day_name == day), None) + week_index * 7
 
             if shift_type == "Any":
-                var = get_variable(f"e_{nurse_index}_{day_index}")
-                soft_clauses.append((penalty_weight, f"-{var} 0"))
+                var = registry.e(nurse_index, day_index)
+                formula.add_soft(penalty_weight, (-var,))
             else:
-                # for sk in nurse_skills.get(nurse_index, []):
-                # var = get_variable(
-                #     f"x_{nurse_index}_{day_index}_{shift_type}_{sk}")
-                # soft_clauses.append((penalty_weight, f"-{var} 0"))
-                var = get_variable(
-                    f"o_{nurse_index}_{day_index}_{shift_type}")
-                soft_clauses.append((penalty_weight, f"-{var} 0"))
+                # for sk in registry.nurse_skill_ids[nurse_index]:
+                # var = registry.x(
+                #     nurse_index, day_index, registry.shift_index[shift_type], sk)
+                # formula.add_soft(penalty_weight, (-var,))
+                var = registry.o(
+                    nurse_index, day_index, registry.shift_index[shift_type])
+                formula.add_soft(penalty_weight, (-var,))
 
-    return soft_clauses
 
 # S5: Complete Weekend
 
 
-def constraint_S5(N, D, nurse_contracts, contracts, penalty_weight):
-    soft_clauses = []
+def constraint_S5(N, D, nurse_contracts, contracts, penalty_weight, nurses=None):
     weekends = []  # List to store weekend days
 
     # Determine weekends dynamically
@@ -727,7 +711,7 @@ def constraint_S5(N, D, nurse_contracts, contracts, penalty_weight):
         if day_of_week in [5, 6]:
             weekends.append(d)
 
-    for n in range(N):
+    for n in (range(N) if nurses is None else nurses):
         contract_id = nurse_contracts[n]
         contract = contracts[contract_id]
 
@@ -736,18 +720,135 @@ def constraint_S5(N, D, nurse_contracts, contracts, penalty_weight):
                 if i + 1 < len(weekends):
                     d1, d2 = weekends[i], weekends[i + 1]
                     # Create variables for working on both weekend days
-                    w1 = get_variable(f"e_{n}_{d1}")
-                    w2 = get_variable(f"e_{n}_{d2}")
+                    w1 = registry.e(n, d1)
+                    w2 = registry.e(n, d2)
 
                     # Add clauses to ensure the nurse works both days or none
-                    soft_clauses.append((penalty_weight, f"-{w1} {w2} 0"))
-                    soft_clauses.append((penalty_weight, f"{w1} -{w2} 0"))
+                    formula.add_soft(penalty_weight, (-w1, w2))
+                    formula.add_soft(penalty_weight, (w1, -w2))
+
+
+def family_modes(option, specs, families, choices):
+    """
+    Parse a per-family option such as --sequence-encoding: MODE for every
+    family, or FAMILY=MODE for one of them; later specs win. The first of
+    `choices` is the default.
+    """
+    modes = dict.fromkeys(families, choices[0])
+    for spec in specs or ():
+        family, _, mode = spec.rpartition('=')
+        if mode not in choices or (family and family not in families):
+            raise ValueError(f"invalid {option} {spec!r}: expected {', '.join(choices)} "
+                             f"or FAMILY=MODE with FAMILY in {', '.join(families)}")
+        for name in ([family] if family else families):
+            modes[name] = mode
+    return modes
+
+
+def sequence_encoding_modes(specs):
+    return family_modes('--sequence-encoding', specs, SEQUENCE_FAMILIES, ('window', 'counter'))
+
+
+def amo_encoding_modes(specs):
+    return family_modes('--amo-encoding', specs, AMO_FAMILIES, ('pairwise', 'ladder'))
 
-    return soft_clauses
+
+def encode_sequence_counter(active, run, min_len, max_len, penalty_weight, key):
+    """
+    Counter encoding of the min/max consecutive penalties of one nurse and one
+    kind of sequence (working days, one shift type, days off), with the
+    semantics of the validator (see roster.sequence_penalty): every day
+    beyond max_len costs penalty_weight, a sequence that ends inside the
+    horizon costs penalty_weight per day it is short of min_len, the sequence
+    still open at the end of the horizon costs nothing. `active` holds the
+    literal of every day, `run` the length of the sequence the history ends
+    with.
+
+    Maximum: the days are cut into blocks of max_len + 1. P_t means "active
+    from the start of t's block up to t" and S_t "active from t to the end of
+    its block"; the max_len + 1 days up to t are one block, or S of their
+    first day and P_t. Each day takes at most six hard clauses (P_t and S_t
+    chained to their neighbour) and one binary soft clause, whatever max_len.
+
+    Minimum: R_t^j means "active on the j days up to t", history included
+    (R_t^1 is the literal of t). A sequence ending at t (active at t, not at
+    t + 1) is short of min_len by the number of false R_(t-1)^j, j = 1 ..
+    min_len - 1: min_len - 1 ternary soft clauses and 3 (min_len - 2) hard
+    ones per day, so this part grows with min_len (one clause per missing
+    day is needed to charge the deficit exactly).
+
+    The auxiliary variables are defined both ways, so that every model costs
+    its validator penalty, not only the optimal ones; the incomplete solvers
+    rely on that. The window clauses of the constraint_S2/S3 functions do
+    not: their minimum clauses start at the first day of a sequence, so e.g.
+    on-off-on patterns are under-charged, and the sequence open at the end
+    of the horizon is charged. For the maximums of 4-7 days of the INRC-II
+    contracts the counter clauses take about twice the literals of the
+    window ones; from a maximum of about 20 they are of the same size.
+    """
+    horizon = len(active)
+    # Minimum: the history sequence ends on day 0 when the nurse is not active
+    if run and horizon and min_len > run:
+        formula.add_soft(penalty_weight * (min_len - run), (active[0],))
+    if min_len > 1 and horizon > 1:
+        levels = registry.new_block(max(horizon - 3, 0) * (min_len - 2), "seq_run_{}_{}_{j}", key)
+        # before[j]: R_(t-1)^j for j = 1 .. min_len - 1, True or None (false)
+        # when the history decides it
+        before = [None] + [True if run >= j else None for j in range(1, min_len)]
+        for t in range(horizon - 1):
+            ended = [-active[t], active[t + 1]]
+            short = sum(literal is None for literal in before[1:])
+            if short:
+                formula.add_soft(penalty_weight * short, ended)
+            for literal in before[1:]:
+                if literal is not None and literal is not True:
+                    formula.add_soft(penalty_weight, ended + [literal])
+            if t == horizon - 2:
+                break
+            current = [None, active[t]]
+            for j in range(2, min_len):
+                if before[j - 1] is None or before[j - 1] is True:
+                    current.append(active[t] if before[j - 1] else None)
+                    continue
+                var = levels + (t - 1) * (min_len - 2) + j - 2
+                formula.add_hard((-var, active[t]))
+                formula.add_hard((-var, before[j - 1]))
+                formula.add_hard((-active[t], -before[j - 1], var))
+                current.append(var)
+            before = current
+
+    # Maximum: windows of `width` days ending at t, or the first t + 1 days
+    # when the history sequence is long enough to fill the rest
+    width = max_len + 1
+    ends = [t for t in range(horizon) if t >= max_len or run >= max_len - t]
+    if not ends:
+        return
+    last = ends[-1]
+    P = list(active[:last + 1])
+    chained = [t for t in range(1, last + 1) if t % width]
+    for var, t in enumerate(chained, registry.new_block(len(chained), "seq_prefix_{}_{}_{j}", key)):
+        formula.add_hard((-active[t], -P[t - 1], var))
+        formula.add_hard((-var, active[t]))
+        formula.add_hard((-var, P[t - 1]))
+        P[t] = var
+    # S is only read inside blocks that end by the last window
+    S = list(active[:last + 1])
+    chained = [t for t in range(last - 1, 0, -1)
+               if 0 < t % width < width - 1 and t - t % width + width - 1 <= last]
+    for var, t in enumerate(chained, registry.new_block(len(chained), "seq_suffix_{}_{}_{j}", key)):
+        formula.add_hard((-active[t], -S[t + 1], var))
+        formula.add_hard((-var, active[t]))
+        formula.add_hard((-var, S[t + 1]))
+        S[t] = var
+    for t in ends:
+        start = t - max_len
+        if start <= 0 or start % width == 0:
+            formula.add_soft(penalty_weight, (-P[t],))
+        else:
+            formula.add_soft(penalty_weight, (-S[start], -P[t]))
 
 
 def constraint_S2_cons_work_day(weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight):
-    soft_clauses = []
     horizon_length = len(weekdays) * 7
 
     for nurse in nurse_history:
@@ -759,14 +860,20 @@ def constraint_S2_cons_work_day(weekdays, nurse_history, nurse_name_to_index, nu
         CW_max = contract.get('maximumNumberOfConsecutiveWorkingDays', 0)
         CW_min = contract.get('minimumNumberOfConsecutiveWorkingDays', 0)
 
+        if sequence_encoding['S2_day'] == 'counter':
+            encode_sequence_counter([registry.e(nurse_id, d) for d in range(horizon_length)],
+                                    cons_working_days, CW_min, CW_max, penalty_weight,
+                                    ('S2_day', nurse_id))
+            continue
+
         # CW_max
         if cons_working_days == 0:
             for d in range(horizon_length - CW_max):
                 clause = []
                 for j in range(CW_max + 1):
-                    var = get_variable(f"e_{nurse_id}_{d + j}")
-                    clause.append(f"-{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d + j)
+                    clause.append(-var)
+                formula.add_soft(penalty_weight, clause)
         else:
             if cons_working_days >= CW_max:
                 cons_working_days = CW_max
@@ -774,56 +881,53 @@ def constraint_S2_cons_work_day(weekdays, nurse_history, nurse_name_to_index, nu
             for d in range(horizon_length - 1, CW_max - 1, -1):
                 clause = []
                 for j in range(CW_max + 1):
-                    var = get_variable(f"e_{nurse_id}_{d - j}")
-                    clause.append(f"-{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d - j)
+                    clause.append(-var)
+                formula.add_soft(penalty_weight, clause)
 
-            for d in range(CW_max - 1, -1, -1):
+            for d in range(min(CW_max, horizon_length) - 1, -1, -1):
                 clause = []
                 if abs(d - CW_max) > cons_working_days:
                     break
                 for j in range(d + 1):
-                    var = get_variable(f"e_{nurse_id}_{d - j}")
-                    clause.append(f"-{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d - j)
+                    clause.append(-var)
+                formula.add_soft(penalty_weight, clause)
 
         # CW_min
         for d in range(horizon_length - CW_min + 1):
             clause = []
-            today = get_variable(f"e_{nurse_id}_{d}")
+            today = registry.e(nurse_id, d)
             if d == 0:
                 if cons_working_days == 0:
-                    clause.append(f"-{today}")
+                    clause.append(-today)
                 else:
                     continue
             else:
-                yesterday = get_variable(f"e_{nurse_id}_{d - 1}")
-                clause.append(f"-{today} {yesterday}")
+                yesterday = registry.e(nurse_id, d - 1)
+                clause.extend((-today, yesterday))
             for j in range(1, CW_min):
-                next_day = get_variable(f"e_{nurse_id}_{d + j}")
-                soft_clauses.append(
-                    (penalty_weight, " ".join(clause) + f" {next_day} 0"))
+                next_day = registry.e(nurse_id, d + j)
+                formula.add_soft(
+                    penalty_weight, clause + [next_day])
 
-        last_days = [get_variable(f"e_{nurse_id}_{d}") for d in range(
+        last_days = [registry.e(nurse_id, d) for d in range(
             horizon_length - CW_min + 1, horizon_length, 1)]
         for (e1, e2) in combinations(last_days, 2):
-            soft_clauses.append((penalty_weight, f"-{e1} {e2} 0"))
-            soft_clauses.append((penalty_weight, f"{e1} -{e2} 0"))
+            formula.add_soft(penalty_weight, (-e1, e2))
+            formula.add_soft(penalty_weight, (e1, -e2))
 
         if cons_working_days != 0:
             if cons_working_days >= CW_min:
                 continue
             else:
                 needed_days = CW_min - cons_working_days
-                for i in range(needed_days):
-                    var = get_variable(f"e_{nurse_id}_{i}")
-                    soft_clauses.append((penalty_weight, f"{var} 0"))
-
-    return soft_clauses
+                for i in range(min(needed_days, horizon_length)):
+                    var = registry.e(nurse_id, i)
+                    formula.add_soft(penalty_weight, (var,))
 
 
 def constraint_S2_cons_work_shift(weekdays, nurse_history, nurse_name_to_index, shift_types, penalty_weight):
-    soft_clauses = []
     horizon_length = len(weekdays) * 7
 
     for nurse in nurse_history:
@@ -833,6 +937,7 @@ def constraint_S2_cons_work_shift(weekdays, nurse_history, nurse_name_to_index,
         nurse_id = nurse_name_to_index[nurse['nurse']]
 
         for shift_id, shift_info in shift_types.items():
+            si = registry.shift_index[shift_id]
             CS_max = shift_info.get('maximumNumberOfConsecutiveAssignments', 0)
             CS_min = shift_info.get('minimumNumberOfConsecutiveAssignments', 0)
 
@@ -841,16 +946,21 @@ def constraint_S2_cons_work_shift(weekdays, nurse_history, nurse_name_to_index,
             else:
                 cons_working_shifts = last_cons_working_shifts
 
+            if sequence_encoding['S2_shift'] == 'counter':
+                encode_sequence_counter([registry.o(nurse_id, d, si) for d in range(horizon_length)],
+                                        cons_working_shifts, CS_min, CS_max, penalty_weight,
+                                        (f'S2_shift_{shift_id}', nurse_id))
+                continue
+
             # CS_max
             if cons_working_shifts == 0:
                 for d in range(horizon_length - CS_max):
                     clause = []
                     for j in range(CS_max + 1):
-                        var = get_variable(
-                            f"o_{nurse_id}_{d + j}_{shift_id}")
-                        clause.append(f"-{var}")
-                    soft_clauses.append(
-                        (penalty_weight, " ".join(clause) + " 0"))
+                        var = registry.o(nurse_id, d + j, si)
+                        clause.append(-var)
+                    formula.add_soft(
+                        penalty_weight, clause)
             else:
                 if cons_working_shifts >= CS_max:
                     cons_working_shifts = CS_max
@@ -858,61 +968,55 @@ def constraint_S2_cons_work_shift(weekdays, nurse_history, nurse_name_to_index,
                 for d in range(horizon_length - 1, CS_max - 1, -1):
                     clause = []
                     for j in range(CS_max + 1):
-                        var = get_variable(
-                            f"o_{nurse_id}_{d - j}_{shift_id}")
-                        clause.append(f"-{var}")
-                    soft_clauses.append(
-                        (penalty_weight, " ".join(clause) + " 0"))
+                        var = registry.o(nurse_id, d - j, si)
+                        clause.append(-var)
+                    formula.add_soft(
+                        penalty_weight, clause)
 
-                for d in range(CS_max - 1, -1, -1):
+                for d in range(min(CS_max, horizon_length) - 1, -1, -1):
                     clause = []
                     if abs(d - CS_max) > cons_working_shifts:
                         break
                     for j in range(d + 1):
-                        var = get_variable(
-                            f"o_{nurse_id}_{d - j}_{shift_id}")
-                        clause.append(f"-{var}")
-                    soft_clauses.append(
-                        (penalty_weight, " ".join(clause) + " 0"))
+                        var = registry.o(nurse_id, d - j, si)
+                        clause.append(-var)
+                    formula.add_soft(
+                        penalty_weight, clause)
 
             # CS_min
             for d in range(horizon_length - CS_min + 1):
                 clause = []
-                today = get_variable(f"o_{nurse_id}_{d}_{shift_id}")
+                today = registry.o(nurse_id, d, si)
                 if d == 0:
                     if cons_working_shifts == 0:
-                        clause.append(f"-{today}")
+                        clause.append(-today)
                     else:
                         continue
                 else:
-                    yesterday = get_variable(
-                        f"o_{nurse_id}_{d - 1}_{shift_id}")
-                    clause.append(f"-{today} {yesterday}")
+                    yesterday = registry.o(nurse_id, d - 1, si)
+                    clause.extend((-today, yesterday))
                 for j in range(1, CS_min):
-                    next_day = get_variable(f"o_{nurse_id}_{d + j}_{shift_id}")
-                    soft_clauses.append(
-                        (penalty_weight, " ".join(clause) + f" {next_day} 0"))
+                    next_day = registry.o(nurse_id, d + j, si)
+                    formula.add_soft(
+                        penalty_weight, clause + [next_day])
 
-            last_shifts = [get_variable(f"o_{nurse_id}_{d}_{shift_id}") for d in range(
+            last_shifts = [registry.o(nurse_id, d, si) for d in range(
                 horizon_length - CS_min + 1, horizon_length, 1)]
             for (o1, o2) in combinations(last_shifts, 2):
-                soft_clauses.append((penalty_weight, f"-{o1} {o2} 0"))
-                soft_clauses.append((penalty_weight, f"{o1} -{o2} 0"))
+                formula.add_soft(penalty_weight, (-o1, o2))
+                formula.add_soft(penalty_weight, (o1, -o2))
 
             if cons_working_shifts != 0:
                 if cons_working_shifts >= CS_min:
                     continue
                 else:
                     needed_days = CS_min - cons_working_shifts
-                    for i in range(needed_days):
-                        var = get_variable(f"o_{nurse_id}_{i}_{shift_id}")
-                        soft_clauses.append((penalty_weight, f"{var} 0"))
-
-    return soft_clauses
+                    for i in range(min(needed_days, horizon_length)):
+                        var = registry.o(nurse_id, i, si)
+                        formula.add_soft(penalty_weight, (var,))
 
 
 def constraint_S3(weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight):
-    soft_clauses = []
     horizon_length = len(weekdays) * 7
 
     for nurse in nurse_history:
@@ -924,14 +1028,20 @@ def constraint_S3(weekdays, nurse_history, nurse_name_to_index, nurse_contracts,
         CF_max = contract.get('maximumNumberOfConsecutiveDaysOff', 0)
         CF_min = contract.get('minimumNumberOfConsecutiveDaysOff', 0)
 
+        if sequence_encoding['S3'] == 'counter':
+            encode_sequence_counter([-registry.e(nurse_id, d) for d in range(horizon_length)],
+                                    cons_working_days_off, CF_min, CF_max, penalty_weight,
+                                    ('S3', nurse_id))
+            continue
+
         # CF_max
         if cons_working_days_off == 0:
             for d in range(horizon_length - CF_max):
                 clause = []
                 for j in range(CF_max + 1):
-                    var = get_variable(f"e_{nurse_id}_{d + j}")
-                    clause.append(f"{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d + j)
+                    clause.append(var)
+                formula.add_soft(penalty_weight, clause)
         else:
             if cons_working_days_off >= CF_max:
                 cons_working_days_off = CF_max
@@ -939,70 +1049,67 @@ def constraint_S3(weekdays, nurse_history, nurse_name_to_index, nurse_contracts,
             for d in range(horizon_length - 1, CF_max - 1, -1):
                 clause = []
                 for j in range(CF_max + 1):
-                    var = get_variable(f"e_{nurse_id}_{d - j}")
-                    clause.append(f"{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d - j)
+                    clause.append(var)
+                formula.add_soft(penalty_weight, clause)
 
-            for d in range(CF_max - 1, -1, -1):
+            for d in range(min(CF_max, horizon_length) - 1, -1, -1):
                 clause = []
                 if abs(d - CF_max) > cons_working_days_off:
                     break
                 for j in range(d + 1):
-                    var = get_variable(f"e_{nurse_id}_{d - j}")
-                    clause.append(f"{var}")
-                soft_clauses.append((penalty_weight, " ".join(clause) + " 0"))
+                    var = registry.e(nurse_id, d - j)
+                    clause.append(var)
+                formula.add_soft(penalty_weight, clause)
 
         # CF_min
         for d in range(horizon_length - CF_min + 1):
             clause = []
-            today = get_variable(f"e_{nurse_id}_{d}")
+            today = registry.e(nurse_id, d)
             if d == 0:
                 if cons_working_days_off == 0:
-                    clause.append(f"{today}")
+                    clause.append(today)
                 else:
                     continue
             else:
-                yesterday = get_variable(f"e_{nurse_id}_{d - 1}")
-                clause.append(f"{today} -{yesterday}")
+                yesterday = registry.e(nurse_id, d - 1)
+                clause.extend((today, -yesterday))
             for j in range(1, CF_min):
-                next_day = get_variable(f"e_{nurse_id}_{d + j}")
-                soft_clauses.append(
-                    (penalty_weight, " ".join(clause) + f" -{next_day} 0"))
+                next_day = registry.e(nurse_id, d + j)
+                formula.add_soft(
+                    penalty_weight, clause + [-next_day])
 
-        last_days = [get_variable(f"e_{nurse_id}_{d}") for d in range(
+        last_days = [registry.e(nurse_id, d) for d in range(
             horizon_length - CF_min + 1, horizon_length, 1)]
         for (e1, e2) in combinations(last_days, 2):
-            soft_clauses.append((penalty_weight, f"-{e1} {e2} 0"))
-            soft_clauses.append((penalty_weight, f"{e1} -{e2} 0"))
+            formula.add_soft(penalty_weight, (-e1, e2))
+            formula.add_soft(penalty_weight, (e1, -e2))
 
         if cons_working_days_off != 0:
             if cons_working_days_off >= CF_min:
                 continue
             else:
                 needed_days = CF_min - cons_working_days_off
-                for i in range(needed_days):
-                    var = get_variable(f"e_{nurse_id}_{i}")
-                    soft_clauses.append((penalty_weight, f"-{var} 0"))
-    return soft_clauses
+                for i in range(min(needed_days, horizon_length)):
+                    var = registry.e(nurse_id, i)
+                    formula.add_soft(penalty_weight, (-var,))
 
 # Constraint Total Weekends
-def constraint_total_weekends_new_optilog(N, W, nurse_contracts, contracts, penalty_weight):
+def constraint_total_weekends_new_optilog(N, W, nurse_contracts, contracts, penalty_weight, nurses=None):
     """
     Sửa đổi để sử dụng biến phạt phụ trợ cho ràng buộc maximumNumberOfWorkingWeekends.
     Sử dụng phép biến đổi sang at_least_k với biến phủ định phụ trợ.
-    Thêm các mệnh đề cứng cần thiết vào hard_clauses toàn cục.
+    Các mệnh đề cứng và mềm đều được thêm vào `formula` toàn cục.
     """
-    global counter, hard_clauses, variable_dict, reverse_variable_dict
 
-    soft_clauses_for_S7 = []
 
-    for n in range(N):
+    for n in (range(N) if nurses is None else nurses):
         contract_id = nurse_contracts[n]
         contract = contracts[contract_id]
         max_weekends = contract.get('maximumNumberOfWorkingWeekends', W + 1)
 
         if max_weekends < W:  # Chỉ mã hóa nếu có giới hạn thực sự
-            weekend_vars_q = [get_variable(f"q_{n}_{w}") for w in range(W)]
+            weekend_vars_q = [registry.q(n, w) for w in range(W)]
             num_weekend_vars = len(weekend_vars_q)
 
             if not weekend_vars_q or num_weekend_vars <= max_weekends:
@@ -1018,59 +1125,49 @@ def constraint_total_weekends_new_optilog(N, W, nurse_contracts, contracts, pena
             num_penalty = num_weekend_vars - max_weekends  # = target_atleast_k_prime
             penalty_vars_excess = []
             if num_penalty > 0:
-                for j in range(num_penalty):
-                    # Đặt tên rõ ràng là phạt cho việc vượt quá <= K
-                    p_var = get_variable(f"penalty_s7_excess_{n}_{j}")
-                    penalty_vars_excess.append(p_var)
+                # Đặt tên rõ ràng là phạt cho việc vượt quá <= K
+                first_p_var = registry.new_block(
+                    num_penalty, "penalty_s7_excess_{}_{j}", (n,))
+                penalty_vars_excess = list(
+                    range(first_p_var, first_p_var + num_penalty))
 
             # 2. Tạo biến phụ trợ cho phủ định (-q_n_w)
             negated_q_vars_helper = []
+            first_neg_q = registry.new_block(
+                num_weekend_vars, "neg_q_{}_{j}", (n,))
             # Cần thêm các mệnh đề cứng định nghĩa các biến phủ định này
             for w_idx, q_var in enumerate(weekend_vars_q):
-                q_var_name = reverse_variable_dict[q_var]  # Lấy tên gốc
-                neg_q_helper_name = f"neg_{q_var_name}"
-                neg_q_helper_var = get_variable(neg_q_helper_name)
+                neg_q_helper_var = first_neg_q + w_idx
                 negated_q_vars_helper.append(neg_q_helper_var)
 
                 # Thêm mệnh đề cứng: neg_q <=> NOT q
                 # (-neg_q V -q) AND (neg_q V q)
-                hard_clauses.append(f"-{neg_q_helper_var} -{q_var} 0")
-                hard_clauses.append(f"{neg_q_helper_var} {q_var} 0")
+                formula.add_hard((-neg_q_helper_var, -q_var))
+                formula.add_hard((neg_q_helper_var, q_var))
 
             # 3. Ràng buộc CỨNG: sum(neg_q_helpers) + sum(penalty_vars_excess) >= target_atleast_k_prime
             combined_vars_for_atleast = negated_q_vars_helper + penalty_vars_excess
 
             # Đảm bảo target_atleast_k_prime >= 0 (luôn đúng do cách tính)
             if target_atleast_k_prime >= 0 and combined_vars_for_atleast:
-                current_top_var = counter - 1
-                top_var, formula_hard = Encoder.at_least_k(
+                top_var, formula_hard = encoding_cache.at_least_k(
                     combined_vars_for_atleast,
                     target_atleast_k_prime,
-                    max_var=current_top_var,
+                    max_var=registry.top,
                     encoding=optilog_encoding
                 )
 
-                for clause in formula_hard:
-                    hard_clauses.append(" ".join(map(str, clause)) + " 0")
+                formula.extend_hard(formula_hard)
 
                 # Cập nhật biến phụ trợ của encoder
-                for var_idx in range(current_top_var + 1, top_var + 1):
-                    aux_encoder_name = f"aux_s7_enc_{n}_{var_idx}"
-                    if var_idx not in reverse_variable_dict:
-                        variable_dict[aux_encoder_name] = var_idx
-                        reverse_variable_dict[var_idx] = aux_encoder_name
-                counter = max(counter, top_var + 1)  # Cập nhật counter
+                registry.claim(top_var, "aux_s7_enc_{}_{v}", (n,))
 
             # 4. Ràng buộc MỀM cho biến phạt
             for p_var in penalty_vars_excess:
-                soft_clauses_for_S7.append((penalty_weight, f"-{p_var} 0"))
-
-    return soft_clauses_for_S7
+                formula.add_soft(penalty_weight, (-p_var,))
 
 
 def constraint_total_weekends_old_optilog(N, W, nurse_contracts, contracts, penalty_weight):
-    global counter, variable_dict, reverse_variable_dict
-    soft_clauses = []
 
     for n in range(N):
         contract_id = nurse_contracts[n]
@@ -1078,40 +1175,31 @@ def constraint_total_weekends_old_optilog(N, W, nurse_contracts, contracts, pena
         max_weekends = contract.get('maximumNumberOfWorkingWeekends', 0)
 
         if max_weekends > 0:
-            weekend_vars = [get_variable(f"q_{n}_{w}") for w in range(W)]
-            max_var, formula = Encoder.at_most_k(
-                weekend_vars, max_weekends, max_var=len(variable_dict), encoding=optilog_encoding)
-
-            for clause in formula:
-                soft_clauses.append(
-                    (penalty_weight, " ".join(map(str, clause)) + " 0"))
+            weekend_vars = [registry.q(n, w) for w in range(W)]
+            max_var, cnf = encoding_cache.at_most_k(
+                weekend_vars, max_weekends, max_var=registry.top, encoding=optilog_encoding)
 
-            for var in range(len(variable_dict) + 1, max_var + 1):
-                variable_dict[f"aux_cwmax{var}"] = var
-                reverse_variable_dict[var] = f"aux_cwmax{var}"
+            formula.extend_soft(penalty_weight, cnf)
 
-            counter = max_var + 1
+            registry.claim(max_var, "aux_cwmax{v}")
 
-    return soft_clauses
 
 # Constraint Total Assignments
-def constraint_total_assignments_new_optilog(N, D, nurse_contracts, contracts, penalty_weight):
+def constraint_total_assignments_new_optilog(N, D, nurse_contracts, contracts, penalty_weight, nurses=None):
     """
     Sửa đổi để sử dụng biến phạt phụ trợ cho min/max total assignments.
     Sử dụng phép biến đổi sang at_least_k cho phần max.
-    Thêm các mệnh đề cứng cần thiết vào hard_clauses toàn cục.
+    Các mệnh đề cứng và mềm đều được thêm vào `formula` toàn cục.
     """
-    global counter, hard_clauses, variable_dict, reverse_variable_dict
 
-    soft_clauses_for_S6 = []
 
-    for n in range(N):
+    for n in (range(N) if nurses is None else nurses):
         contract_id = nurse_contracts[n]
         contract = contracts[contract_id]
         max_assign = contract.get('maximumNumberOfAssignments', D + 1)
         min_assign = contract.get('minimumNumberOfAssignments', 0)
 
-        assignment_vars_e = [get_variable(f"e_{n}_{d}") for d in range(D)]
+        assignment_vars_e = [registry.e(n, d) for d in range(D)]
         num_assign_vars = len(assignment_vars_e)
 
         if not assignment_vars_e:
@@ -1125,44 +1213,38 @@ def constraint_total_assignments_new_optilog(N, D, nurse_contracts, contracts, p
             num_penalty_max = num_assign_vars - max_assign  # = target_atleast_k_prime_max
             penalty_vars_max = []
             if num_penalty_max > 0:
-                for j in range(num_penalty_max):
-                    p_var = get_variable(f"penalty_s6_max_{n}_{j}")
-                    penalty_vars_max.append(p_var)
+                first_p_var = registry.new_block(
+                    num_penalty_max, "penalty_s6_max_{}_{j}", (n,))
+                penalty_vars_max = list(
+                    range(first_p_var, first_p_var + num_penalty_max))
 
             # 2. Tạo biến phụ trợ phủ định (-e_n_d)
             negated_e_vars_helper = []
+            first_neg_e = registry.new_block(
+                num_assign_vars, "neg_e_{}_{j}", (n,))
             for d_idx, e_var in enumerate(assignment_vars_e):
-                e_var_name = reverse_variable_dict[e_var]
-                neg_e_helper_name = f"neg_{e_var_name}"
-                neg_e_helper_var = get_variable(neg_e_helper_name)
+                neg_e_helper_var = first_neg_e + d_idx
                 negated_e_vars_helper.append(neg_e_helper_var)
                 # Định nghĩa cứng: neg_e <=> NOT e
-                hard_clauses.append(f"-{neg_e_helper_var} -{e_var} 0")
-                hard_clauses.append(f"{neg_e_helper_var} {e_var} 0")
+                formula.add_hard((-neg_e_helper_var, -e_var))
+                formula.add_hard((neg_e_helper_var, e_var))
 
             # 3. Ràng buộc CỨNG: sum(neg_e_helpers) + sum(penalty_vars_max) >= target_atleast_k_prime_max
             combined_vars_max = negated_e_vars_helper + penalty_vars_max
             if target_atleast_k_prime_max >= 0 and combined_vars_max:
-                current_top_var = counter - 1
-                top_var, formula_max_hard = Encoder.at_least_k(
+                top_var, formula_max_hard = encoding_cache.at_least_k(
                     combined_vars_max,
                     target_atleast_k_prime_max,
-                    max_var=current_top_var,
+                    max_var=registry.top,
                     encoding=optilog_encoding
                 )
-                for clause in formula_max_hard:
-                    hard_clauses.append(" ".join(map(str, clause)) + " 0")
+                formula.extend_hard(formula_max_hard)
                 # Cập nhật biến encoder
-                for var_idx in range(current_top_var + 1, top_var + 1):
-                    aux_encoder_name = f"aux_s6_max_enc_{n}_{var_idx}"
-                    if var_idx not in reverse_variable_dict:
-                        variable_dict[aux_encoder_name] = var_idx
-                        reverse_variable_dict[var_idx] = aux_encoder_name
-                counter = max(counter, top_var + 1)
+                registry.claim(top_var, "aux_s6_max_enc_{}_{v}", (n,))
 
             # 4. Ràng buộc MỀM cho biến phạt max
             for p_var in penalty_vars_max:
-                soft_clauses_for_S6.append((penalty_weight, f"-{p_var} 0"))
+                formula.add_soft(penalty_weight, (-p_var,))
 
         # --- Phần Min assignments: sum(e_n_d) >= min_assign ---
         # (Phần này giữ nguyên logic từ lần sửa trước, đã đúng)
@@ -1170,41 +1252,30 @@ def constraint_total_assignments_new_optilog(N, D, nurse_contracts, contracts, p
             max_shortfall = min_assign  # Thiếu tối đa là min_assign
             if max_shortfall > 0:
                 # 1. Tạo biến phạt thiếu hụt
-                penalty_vars_min = []
-                for j in range(max_shortfall):
-                    p_var = get_variable(f"penalty_s6_min_{n}_{j}")
-                    penalty_vars_min.append(p_var)
+                first_p_var = registry.new_block(
+                    max_shortfall, "penalty_s6_min_{}_{j}", (n,))
+                penalty_vars_min = list(
+                    range(first_p_var, first_p_var + max_shortfall))
 
                 # 2. Ràng buộc CỨNG: sum(e_n_d) + sum(penalty_vars_min) >= min_assign
                 combined_vars_min = assignment_vars_e + penalty_vars_min
                 if combined_vars_min:  # Chỉ mã hóa nếu có biến
-                    current_top_var = counter - 1
-                    top_var, formula_min_hard = Encoder.at_least_k(
+                    top_var, formula_min_hard = encoding_cache.at_least_k(
                         combined_vars_min,
                         min_assign,
-                        max_var=current_top_var,
+                        max_var=registry.top,
                         encoding=optilog_encoding
                     )
-                    for clause in formula_min_hard:
-                        hard_clauses.append(" ".join(map(str, clause)) + " 0")
+                    formula.extend_hard(formula_min_hard)
                     # Cập nhật biến encoder
-                    for var_idx in range(current_top_var + 1, top_var + 1):
-                        aux_encoder_name = f"aux_s6_min_enc_{n}_{var_idx}"
-                        if var_idx not in reverse_variable_dict:
-                            variable_dict[aux_encoder_name] = var_idx
-                            reverse_variable_dict[var_idx] = aux_encoder_name
-                    counter = max(counter, top_var + 1)
+                    registry.claim(top_var, "aux_s6_min_enc_{}_{v}", (n,))
 
                 # 3. Ràng buộc MỀM cho biến phạt min
                 for p_var in penalty_vars_min:
-                    soft_clauses_for_S6.append((penalty_weight, f"-{p_var} 0"))
-
-    return soft_clauses_for_S6
+                    formula.add_soft(penalty_weight, (-p_var,))
 
 
 def constraint_total_assignments_old_optilog(N, D, nurse_contracts, contract, penalty_weight):
-    global counter, variable_dict, reverse_variable_dict
-    soft_clauses = []
 
     for n in range(N):
         contract_id = nurse_contracts[n]
@@ -1214,144 +1285,527 @@ def constraint_total_assignments_old_optilog(N, D, nurse_contracts, contract, pe
 
         # Max assignments:
         if max_assign > 0:
-            assignment_vars = [get_variable(
-                f"e_{n}_{d}") for d in range(D)]
-            max_var, formula = Encoder.at_most_k(
-                assignment_vars, max_assign, max_var=len(variable_dict), encoding=optilog_encoding)
-            for clause in formula:
-                soft_clauses.append(
-                    (penalty_weight, " ".join(map(str, clause)) + " 0"))
-
-            for var in range(len(variable_dict) + 1, max_var + 1):
-                variable_dict[f"aux_max_assign{var}"] = var
-                reverse_variable_dict[var] = f"aux_max_assign{var}"
+            assignment_vars = [registry.e(n, d) for d in range(D)]
+            max_var, cnf = encoding_cache.at_most_k(
+                assignment_vars, max_assign, max_var=registry.top, encoding=optilog_encoding)
+            formula.extend_soft(penalty_weight, cnf)
 
-            counter = max_var + 1
+            registry.claim(max_var, "aux_max_assign{v}")
 
         # Min assignments:
         if min_assign > 0:
-            assignment_vars = [get_variable(
-                f"e_{n}_{d}") for d in range(D)]
-            min_var, formula = Encoder.at_least_k(
-                assignment_vars, min_assign, max_var=len(variable_dict), encoding=optilog_encoding)
+            assignment_vars = [registry.e(n, d) for d in range(D)]
+            min_var, cnf = encoding_cache.at_least_k(
+                assignment_vars, min_assign, max_var=registry.top, encoding=optilog_encoding)
+
+            formula.extend_soft(penalty_weight, cnf)
+
+            registry.claim(min_var, "aux_min_assign{v}")
+
 
-            for clause in formula:
-                soft_clauses.append(
-                    (penalty_weight, " ".join(map(str, clause)) + " 0"))
+# tt-open-wbo-inc builds usable in a portfolio
+TT_OPEN_WBO_INC_BINARIES = {
+    'intel': "./tt-open-wbo-inc-IntelSATSolver_static",
+    'glucose': "./tt-open-wbo-inc-Glucose4_1_static",
+}
 
-            for var in range(len(variable_dict) + 1, min_var + 1):
-                variable_dict[f"aux_min_assign{var}"] = var
-                reverse_variable_dict[var] = f"aux_min_assign{var}"
 
-            counter = min_var + 1
+def trajectory_path(log_path):
+    """
+    Return the trajectory file that goes with a solver log:
+    log.txt -> trajectory.csv, log-intel.txt -> trajectory-intel.csv.
+    """
+    folder, name = os.path.split(log_path)
+    stem = os.path.splitext(name)[0]
+    if stem.startswith("log"):
+        stem = "trajectory" + stem[len("log"):]
+    else:
+        stem += "-trajectory"
+    return os.path.join(folder, stem + ".csv")
 
-    return soft_clauses
 
-def run_tt_open_wbo_inc(wcnf_path, timeout, output_file):
+def write_trajectory(filename, trajectory):
+    """
+    Save the (seconds, cost) pairs of every improving solution as CSV.
+    """
+    with open(filename, 'w') as f:
+        f.write("seconds,cost\n")
+        for seconds, cost in trajectory:
+            f.write(f"{seconds:.3f},{cost}\n")
+
+
+class SolverOutputReader:
+    """
+    Read the stdout of a running MaxSAT solver line by line in a background
+    thread and copy it to `log_file`.
+
+    While reading, the 'o <cost>' lines are recorded with the time since start
+    in `trajectory`, the last complete 'v' model is kept in `model_lines` and
+    the 's' status line in `status`. Whatever the solver managed to print is
+    therefore kept even if it has to be stopped or killed.
+    """
+
+    def __init__(self, process, log_file):
+        self.process = process
+        self.start_time = time.time()
+        self.trajectory = []
+        self.model_lines = []
+        self.status = None
+        self._thread = threading.Thread(
+            target=self._read, args=(log_file,), daemon=True)
+        self._thread.start()
+
+    def _read(self, log_file):
+        with open(log_file, 'w') as log:
+            model_lines = []
+            for line in self.process.stdout:
+                log.write(line)
+                if line.startswith("v "):
+                    model_lines.append(line)
+                    continue
+                if model_lines:
+                    self.model_lines, model_lines = model_lines, []
+                if line.startswith("o "):
+                    try:
+                        cost = int(line.split()[1])
+                    except (IndexError, ValueError):
+                        continue
+                    self.trajectory.append((time.time() - self.start_time, cost))
+                    log.flush()
+                elif line.startswith("s "):
+                    self.status = line[2:].strip()
+            if model_lines:
+                self.model_lines = model_lines
+
+    def stop(self, grace=30):
+        """
+        Ask the solver to stop with SIGTERM, which makes tt-open-wbo-inc print
+        its best model, and kill it if it is still running after `grace` seconds.
+        """
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def join(self):
+        self.process.wait()
+        self._thread.join()
+
+    def output(self):
+        """
+        Return the last model and the status as solver output text.
+        """
+        output = "".join(self.model_lines)
+        if self.status:
+            output += f"s {self.status}\n"
+        return output
+
+
+def run_tt_open_wbo_inc(wcnf_path, timeout, output_file, binary=TT_OPEN_WBO_INC_BINARIES['intel']):
     """
     Run the tt-open-wbo-inc solver on the given WCNF file.
 
+    The output is read while the solver runs: every improving cost goes to the
+    trajectory file next to `output_file` (see trajectory_path) and the last
+    model is kept. At the timeout the solver is stopped with SIGTERM so that it
+    prints its best model.
+
     Args:
         wcnf_path (str): Path to the WCNF file.
         timeout (int): Timeout in seconds.
         output_file (str): Path to save the solver output.
+        binary (str): Solver executable, see TT_OPEN_WBO_INC_BINARIES.
 
     Returns:
-        list: A list of solution variables if a solution is found, otherwise None.
+        list: The IDs of the variables set to true if a solution is found, otherwise None.
     """
-    global reverse_variable_dict
     try:
-        # cmd = ["timeout", str(timeout),
-        #        "./tt-open-wbo-inc-Glucose4_1_static", wcnf_path]
-        cmd = ["timeout", str(timeout),
-               "./tt-open-wbo-inc-IntelSATSolver_static", wcnf_path]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-
-        # Save the solver output to the specified file
-        with open(output_file, 'w') as f:
-            f.write(result.stdout)
-            if result.stderr:
-                f.write(result.stderr)
-
-        output = result.stdout
-        with open("log.txt", 'w') as f:
-            f.write(output)
-
-        # Check the solver output for a solution
-        if "v " in output:  # Look for the binary solution line
-            solution_lines = [
-                line.strip() for line in output.splitlines() if line.startswith("v ")
-            ]
-            binary_solution = "".join(solution_lines).replace(
-                "v ", "")  # Concatenate and remove 'v '
-            decimal_solution = []
-            for index, char in enumerate(binary_solution, start=1):
-                if char == "1":
-                    decimal_solution.append(index)  # Positive number
-                elif char == "0":
-                    decimal_solution.append(-index)  # Negative number
-
-            # Map only positive integers using reverse_variable_dict
-            mapped_solution = [
-                reverse_variable_dict[var] for var in decimal_solution if var > 0 and var in reverse_variable_dict
-            ]
-            return mapped_solution
-        elif "s UNSATISFIABLE" in output:
-            print("The problem is unsatisfiable.")
-            return None
-        else:
-            print("No valid solution found in the output.")
-            return None
+        process = subprocess.Popen([binary, wcnf_path], stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True)
+        reader = SolverOutputReader(process, output_file)
+        try:
+            process.wait(timeout=timeout or None)
+        except subprocess.TimeoutExpired:
+            reader.stop()
+        except KeyboardInterrupt:
+            # Keep the best model found so far
+            reader.stop()
+        reader.join()
+
+        write_trajectory(trajectory_path(output_file), reader.trajectory)
+        if reader.trajectory:
+            seconds, cost = reader.trajectory[-1]
+            print(f"tt-open-wbo-inc: {len(reader.trajectory)} improvements, "
+                  f"last cost {cost} after {seconds:.1f}s")
+
+        return parse_tt_open_wbo_inc_output(reader.output())
 
     except Exception as e:
         print(f"An error occurred while running tt-open-wbo-inc: {e}")
         return None
 
 
-def decode_solution(solution, nurse_name_to_index, start_day, end_day):
+def parse_tt_open_wbo_inc_output(output):
+    """
+    Return the IDs of the variables set to true in the 'v' line of the
+    tt-open-wbo-inc output, or None if there is no model.
+    """
+    # Check the solver output for a solution
+    if "v " in output:  # Look for the binary solution line
+        values = model_values(output)
+        # Keep only the variables set to true
+        return (np.flatnonzero(values) + 1).tolist()
+    elif "s UNSATISFIABLE" in output:
+        print("The problem is unsatisfiable.")
+        return None
+    else:
+        print("No valid solution found in the output.")
+        return None
+
+
+def model_values(output):
+    """
+    Return the 'v' lines of the tt-open-wbo-inc output as a boolean array:
+    entry i is the value of variable i + 1.
+    """
+    payload = b"".join(
+        line[2:].strip().encode() for line in output.splitlines() if line.startswith("v "))
+    bits = np.frombuffer(payload, dtype=np.uint8)
+    # Anything other than the 0/1 characters (e.g. spaces) is skipped
+    bits = bits[(bits == ord("0")) | (bits == ord("1"))]
+    return bits == ord("1")
+
+
+class IncumbentRC2Stratified(RC2Stratified):
+    """
+    RC2Stratified that reports the model it reaches at the end of every
+    stratification level. Those models satisfy all hard clauses, so they are
+    valid (not necessarily optimal) rosters.
+    """
+
+    def __init__(self, formula, on_model, **kwargs):
+        self.on_model = on_model
+        super().__init__(formula, **kwargs)
+
+    def compute_(self):
+        res = super().compute_()
+        if res:
+            model = self.oracle.get_model()
+            self.on_model([self.vmap.i2e[lit] for lit in model
+                           if lit > 0 and lit in self.vmap.i2e])
+        return res
+
+
+def solve_rc2(formula, timeout, output_file, stratified=True, sat_solver='g3', stop=None, phases=None, incumbent=None, wcnf=None, fixed=None):
+    """
+    Solve the formula in-process with pysat's RC2 (or RC2Stratified), without
+    writing a WCNF file.
+
+    The time budget, or setting the `stop` event (e.g. by a portfolio), is
+    enforced by interrupting the SAT oracle. A first
+    roster is taken from the hard clauses alone, then improved by every
+    model the solver reaches, so on timeout the best roster found so far is
+    returned. The progress is written to `output_file` in the MaxSAT solver
+    output format ('o' cost lines and a final 's' status line) and the
+    improvements to the trajectory file next to it; pass None to skip both.
+
+    For a warm start, `incumbent` is the first roster (the hard-clause-only
+    call is then skipped) and `phases` (see warm_start_phases) are the
+    preferred polarities of the SAT oracles.
+
+    `wcnf` is formula.to_wcnf() when the caller already has it, and `fixed`
+    are literals added as unit hard clauses, e.g. by the LNS driver.
+
+    Returns:
+        list: The IDs of the variables set to true in the best model, or None.
+    """
+    best = {'cost': None, 'vars': None}
+    trajectory = []
+    start_time = time.time()
+    lock = threading.Lock()
+    state = {'target': None, 'expired': False}
+
+    with open(output_file or os.devnull, 'w') as log:
+        def on_model(true_vars):
+            violated, cost = formula.evaluate(true_vars)
+            if violated == 0 and (best['cost'] is None or cost < best['cost']):
+                best['cost'], best['vars'] = cost, true_vars
+                trajectory.append((time.time() - start_time, cost))
+                log.write(f"o {cost}\n")
+                log.flush()
+
+        def start(target):
+            # Register the object the timer should interrupt
+            with lock:
+                state['target'] = target
+                return not state['expired']
+
+        def expire():
+            with lock:
+                state['expired'] = True
+                if state['target'] is not None:
+                    state['target'].interrupt()
+
+        finished = threading.Event()
+
+        def watch():
+            deadline = time.time() + timeout if timeout else None
+            while not finished.wait(0.1):
+                if (stop is not None and stop.is_set()) or \
+                        (deadline is not None and time.time() >= deadline):
+                    expire()
+                    return
+
+        threading.Thread(target=watch, daemon=True).start()
+        if incumbent is not None:
+            on_model(incumbent)
+
+        status = "UNKNOWN"
+        try:
+            if wcnf is None:
+                wcnf = formula.to_wcnf()
+            fixed = [] if fixed is None else fixed
+
+            # A feasible roster from the hard clauses only
+            if incumbent is None:
+                with Solver(name=sat_solver, bootstrap_with=wcnf.hard) as oracle:
+                    oracle.append_formula([lit] for lit in fixed)
+                    if phases is not None:
+                        oracle.set_phases(phases)
+                    if start(oracle):
+                        feasible = oracle.solve_limited(expect_interrupt=True)
+                        if feasible is False:
+                            status = "UNSATISFIABLE"
+                        elif feasible:
+                            on_model([lit for lit in oracle.get_model() if lit > 0])
+
+            if status != "UNSATISFIABLE":
+                if stratified:
+                    rc2 = IncumbentRC2Stratified(wcnf, on_model, solver=sat_solver)
+                else:
+                    rc2 = RC2(wcnf, solver=sat_solver)
+                for lit in fixed:
+                    rc2.add_clause([lit])
+                if phases is not None:
+                    rc2.oracle.set_phases(phases)
+                try:
+                    if start(rc2):
+                        model = rc2.compute(expect_interrupt=True)
+                        if model is not None:
+                            on_model([lit for lit in model if lit > 0])
+                            status = "OPTIMUM FOUND"
+                        elif not rc2.interrupted:
+                            status = "UNSATISFIABLE"
+                finally:
+                    start(None)
+                    rc2.delete()
+        finally:
+            finished.set()
+
+        if status == "UNKNOWN" and best['vars'] is not None:
+            status = "SATISFIABLE"
+        log.write(f"s {status}\n")
+    if output_file:
+        write_trajectory(trajectory_path(output_file), trajectory)
+
+    print(f"RC2 status: {status}, cost: {best['cost']}")
+    if status == "UNSATISFIABLE":
+        print("The problem is unsatisfiable.")
+    return best['vars']
+
+
+def portfolio_rc2_member(formula, timeout, output_file, stratified, stop, results, phases=None):
+    """
+    Process target of run_portfolio for the in-process RC2 members.
+    """
+    solution = solve_rc2(formula, timeout, output_file,
+                         stratified=stratified, stop=stop, phases=phases)
+    results.put((output_file, solution))
+
+
+def run_portfolio(formula, members, timeout, sol_dir, phases=None, incumbent=None):
+    """
+    Run several solver configurations on the formula at the same time and keep
+    the lowest-cost model.
+
+    Members are 'intel' / 'glucose' (tt-open-wbo-inc builds) and 'rc2' /
+    'rc2-stratified' (pysat, each in its own process). A tt-open-wbo-inc member
+    can have a ':<seed>' suffix to run on a copy of the formula with shuffled
+    clause order, e.g. 'intel:1'. Every member logs to log-<member>.txt in
+    `sol_dir` and records its trajectory in trajectory-<member>.csv; the log
+    and trajectory of the winner are copied to log.txt and trajectory.csv.
+
+    All members are stopped once one of them reports 's OPTIMUM FOUND' or the
+    shared timeout expires. tt-open-wbo-inc prints its best model on SIGTERM.
+
+    With a warm start, the RC2 members get its `phases` and its `incumbent`
+    model competes with the members' results.
+
+    Returns:
+        list: The IDs of the variables set to true in the best model, or None.
+    """
+    stop = Event()
+    results = Queue()
+    wcnf_paths = {}
+    runs = []
+
+    for member in members:
+        name, _, seed = member.partition(':')
+        log_path = os.path.join(sol_dir, f"log-{member.replace(':', '-')}.txt")
+
+        if name in TT_OPEN_WBO_INC_BINARIES:
+            if seed not in wcnf_paths:
+                wcnf_paths[seed] = os.path.join(
+                    sol_dir, f"formular-{seed}.wcnf" if seed else "formular.wcnf")
+                order = (np.random.default_rng(int(seed)).permutation(len(formula))
+                         if seed else None)
+                with open(wcnf_paths[seed], "w") as f:
+                    formula.write_wcnf(f, order)
+            try:
+                process = subprocess.Popen(
+                    [TT_OPEN_WBO_INC_BINARIES[name], wcnf_paths[seed]],
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            except OSError as e:
+                print(f"Portfolio member {member} could not start: {e}")
+                continue
+            runs.append((member, log_path, SolverOutputReader(process, log_path)))
+
+        elif name in ('rc2', 'rc2-stratified') and not seed:
+            process = Process(target=portfolio_rc2_member, args=(
+                formula, timeout, log_path, name == 'rc2-stratified', stop, results, phases))
+            process.start()
+            runs.append((member, log_path, process))
+
+        else:
+            raise ValueError(f"Unknown portfolio member: {member}")
+
+    def running(process):
+        if isinstance(process, Process):
+            return process.is_alive()
+        return process.process.poll() is None
+
+    def proved_optimum(log_path, process):
+        if isinstance(process, Process):
+            with open(log_path) as f:
+                return any(line.startswith("s OPTIMUM FOUND") for line in f)
+        return process.status == "OPTIMUM FOUND"
+
+    deadline = time.time() + timeout if timeout else None
+    stopped_at = None
+    rc2_solutions = {}
+    while True:
+        # Drain the queue first: a process with pending results cannot exit
+        while not results.empty():
+            log_path, solution = results.get()
+            rc2_solutions[log_path] = solution
+        active = [run for run in runs if running(run[2])]
+        if not active:
+            break
+
+        if stopped_at is None and (
+                (deadline is not None and time.time() >= deadline)
+                or any(proved_optimum(log_path, process) for _, log_path, process in runs
+                       if not running(process))):
+            stopped_at = time.time()
+            stop.set()
+            for _, _, process in active:
+                if not isinstance(process, Process):
+                    process.process.send_signal(signal.SIGTERM)
+        elif stopped_at is not None and time.time() - stopped_at > 30:
+            # Grace period for printing the model is over
+            for _, _, process in active:
+                if isinstance(process, Process):
+                    process.kill()
+                else:
+                    process.process.kill()
+        time.sleep(0.2)
+
+    best_member, best_cost, best_solution = None, None, None
+    for member, log_path, process in runs:
+        if isinstance(process, Process):
+            solution = rc2_solutions.get(log_path)
+        else:
+            process.join()
+            write_trajectory(trajectory_path(log_path), process.trajectory)
+            solution = parse_tt_open_wbo_inc_output(process.output())
+        if not solution:
+            print(f"Portfolio member {member}: no solution")
+            continue
+        violated, cost = formula.evaluate(solution)
+        if violated:
+            print(f"Portfolio member {member}: {violated} hard clauses violated")
+            continue
+        print(f"Portfolio member {member}: cost {cost}")
+        if best_cost is None or cost < best_cost:
+            best_member, best_cost, best_solution = (member, log_path), cost, solution
+
+    if incumbent is not None:
+        cost = formula.evaluate(incumbent)[1]
+        if best_cost is None or cost <= best_cost:
+            print(f"Portfolio: no member improved on the warm start (cost {cost})")
+            return incumbent
+
+    if best_member is None:
+        return None
+    print(f"Portfolio winner: {best_member[0]} with cost {best_cost}")
+    shutil.copyfile(best_member[1], os.path.join(sol_dir, "log.txt"))
+    shutil.copyfile(trajectory_path(best_member[1]), os.path.join(sol_dir, "trajectory.csv"))
+    return best_solution
+
+
+def decode_solution(solution, nurse_name_to_index, start_day, end_day, roster=None):
+    """
+    Return the assignments of days start_day..end_day - 1 in the solution file
+    format. `roster` is the (N, D) matrix of registry.roster_matrix(solution);
+    pass it when decoding several weeks of the same solution.
+    """
+    if roster is None:
+        roster = registry.roster_matrix(solution)
     assignments = []
     index_to_nurse_name = {v: k for k, v in nurse_name_to_index.items()}
     day_mapping = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-
-    for var in solution:
-        parts = var.split("_")
-        if parts[0] == 'x':
-            nurse_id, day, shift, skill = parts[1], parts[2], parts[3], parts[4]
-            day = int(day)
-            if start_day <= day < end_day:
-                nurse_name = index_to_nurse_name[int(nurse_id)]
-                day_name = day_mapping[day % 7]
-                assignments.append({
-                    "nurse": nurse_name,
-                    "day": day_name,
-                    "shiftType": shift,
-                    "skill": skill
-                })
+    num_skills = len(registry.SK)
+
+    nurse_ids, days = np.nonzero(roster[:, start_day:end_day] >= 0)
+    for nurse_id, day in zip(nurse_ids.tolist(), (days + start_day).tolist()):
+        shift, skill = divmod(int(roster[nurse_id, day]), num_skills)
+        assignments.append({
+            "nurse": index_to_nurse_name[nurse_id],
+            "day": day_mapping[day % 7],
+            "shiftType": registry.S[shift],
+            "skill": registry.SK[skill]
+        })
     return assignments
 
 
-def export_cnf(filename="output.cnf", hard_clauses=[], soft_clauses=[], weight_hard=60):
+def export_cnf(filename="output.cnf", formula=None, weight_hard=60):
+    if formula is None:
+        formula = globals()['formula']
     with open(filename, "w") as f:
-        f.write(
-            f"p wcnf {counter - 1} {len(hard_clauses) + len(soft_clauses)} {weight_hard}\n")
-        for clause in hard_clauses:
-            f.write(f"{weight_hard} {clause}\n")
-        for weight, clause in soft_clauses:
-            f.write(f"{weight} {clause}\n")
+        formula.write_wcnf_header(f, registry.top, weight_hard)
 
 
-def export_cnf_custom_format(filename="output.cnf", hard_clauses=[], soft_clauses=[]):
+def export_cnf_custom_format(filename="output.cnf", formula=None):
     """
     Export CNF in a custom format where hard clauses are prefixed with 'h'.
     """
+    if formula is None:
+        formula = globals()['formula']
     with open(filename, "w") as f:
-        # Write hard clauses with 'h' prefix
-        for clause in hard_clauses:
-            f.write(f"h {clause}\n")
+        formula.write_wcnf(f)
 
-        # Write soft clauses without 'h' prefix
-        for weight, clause in soft_clauses:
-            f.write(f"{weight} {clause}\n")
+
+def export_formula_stats(filename, formula):
+    """
+    Write the formula size and the per-family clause counts next to the WCNF,
+    since the tt-open-wbo-inc format has no header to hold them.
+    """
+    stats = {"variables": registry.top, **formula.stats(),
+             "encoding_cache": encoding_cache.stats()}
+    with open(filename, "w") as f:
+        json.dump(stats, f, indent=4)
 
 
 def process_log_file(log_file_path, output_file_path):
@@ -1399,38 +1853,13 @@ def save_solution(assignments, scenario_id, week_index, solution_file):
 
 def export_variable_mapping(filename="variable_mapping.txt"):
     with open(filename, "w") as f:
-        for var_id, var_name in reverse_variable_dict.items():
+        for var_id, var_name in registry.mapping():
             f.write(f"{var_id}: {var_name}\n")
 
 
 def print_variable_counts():
-    x_count = sum(1 for var in variable_dict if var.startswith('x_'))
-    o_count = sum(1 for var in variable_dict if var.startswith('o_'))
-    e_count = sum(1 for var in variable_dict if var.startswith('e_'))
-    q_count = sum(1 for var in variable_dict if var.startswith('q_'))
-    aux_cmax_count = sum(
-        1 for var in variable_dict if var.startswith('aux_cmax'))
-    aux_cmin_count = sum(
-        1 for var in variable_dict if var.startswith('aux_cmin'))
-    aux_min_assign_count = sum(
-        1 for var in variable_dict if var.startswith('aux_min_assign'))
-    aux_max_assign_count = sum(
-        1 for var in variable_dict if var.startswith('aux_max_assign'))
-    aux_cwmax_count = sum(
-        1 for var in variable_dict if var.startswith('aux_cwmax'))
-    auxvarsc_count = sum(
-        1 for var in variable_dict if var.startswith('auxvarsc'))
-
-    print(f"Number of x variables: {x_count}")
-    print(f"Number of o variables: {o_count}")
-    print(f"Number of e variables: {e_count}")
-    print(f"Number of q variables: {q_count}")
-    print(f"Number of aux_cmax variables: {aux_cmax_count}")
-    print(f"Number of aux_cmin variables: {aux_cmin_count}")
-    print(f"Number of aux_max_assign variables: {aux_max_assign_count}")
-    print(f"Number of aux_min_assign variables: {aux_min_assign_count}")
-    print(f"Number of aux_cwmax variables: {aux_cwmax_count}")
-    print(f"Number of auxvarsc variables: {auxvarsc_count}")
+    for family, count in registry.family_counts().items():
+        print(f"Number of {family} variables: {count}")
 
 
 def read_solution_file(file_path):
@@ -1451,141 +1880,346 @@ def parse_arguments():
                         nargs='+', help='Weeks Data Files')
     parser.add_argument('--sol', required=True, help='Solution Folder')
     parser.add_argument('--timeout', type=float, help='Timeout in Seconds')
-    return parser.parse_args()
+    parser.add_argument('--stream', action='store_true',
+                        help='Write clauses to the WCNF file while they are generated')
+    parser.add_argument('--stream-buffer', type=int, default=1 << 20,
+                        help='Literals buffered in memory before a flush in --stream mode')
+    parser.add_argument('--encoding-cache',
+                        help='File to load/save the cardinality encoding templates')
+    parser.add_argument('--formula-cache', metavar='DIR',
+                        help='Reuse encoded formulas of identical inputs, settings and code '
+                             'from DIR (not with --stream or --rolling)')
+    parser.add_argument('--formula-cache-size', type=int, default=2048, metavar='MB',
+                        help='Size of --formula-cache beyond which the least recently used '
+                             'formulas are removed (default 2048)')
+    parser.add_argument('--simplify', action='store_true',
+                        help='Remove tautologies, clauses satisfied by hard units and duplicate '
+                             'clauses (merging soft duplicates) before solving')
+    parser.add_argument('--propagate', action='store_true',
+                        help='Leave the x variables the history rules out of the coverage '
+                             'encodings and run unit propagation over the hard clauses before '
+                             'solving; the fixed variables are put back into the model')
+    parser.add_argument('--symmetry-breaking', action='store_true',
+                        help='Order the rosters of interchangeable nurses (same contract, '
+                             'skills, history and requests) lexicographically')
+    parser.add_argument('--sequence-encoding', nargs='+', metavar='[FAMILY=]MODE',
+                        help="Encoding of the consecutive days/shifts penalties: 'window' (one "
+                             "clause per window, the default; smaller but mispricing some "
+                             "sequences) or 'counter' (prefix/suffix and run-length counters "
+                             "charging exactly the validator's penalties), for all of S2_day, "
+                             "S2_shift and S3 or per family, e.g. S2_shift=counter")
+    parser.add_argument('--amo-encoding', nargs='+', metavar='[FAMILY=]MODE',
+                        help="Encoding of the at-most-one constraints H1 (one shift a day), aux "
+                             "(one skill per shift) and H3 (forbidden successions): 'pairwise' "
+                             "(the default) or 'ladder', for all three or per family, e.g. "
+                             "H3=ladder. The ladder only pays off from about six literals per "
+                             "constraint; with the four INRC-II shifts it is larger")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for clause generation (1 = serial)')
+    parser.add_argument('--solver', default='tt-open-wbo-inc',
+                        choices=['tt-open-wbo-inc', 'rc2', 'rc2-stratified', 'portfolio'],
+                        help='MaxSAT backend; rc2 and rc2-stratified run in-process through pysat')
+    parser.add_argument('--portfolio', nargs='+', default=['intel', 'glucose', 'rc2-stratified'],
+                        help="Members of --solver portfolio: intel, glucose, rc2, rc2-stratified; "
+                             "tt-open-wbo-inc members take a ':<seed>' clause shuffle, e.g. intel:1")
+    parser.add_argument('--warm-start', nargs='+',
+                        help='Previous roster to start from: sol-week*.json files, a folder '
+                             'holding them, or a roster.npy matrix')
+    parser.add_argument('--lns', action='store_true',
+                        help='Improve the first solution (a quarter of --timeout, --solver) by '
+                             'large-neighbourhood search for the rest of the timeout')
+    parser.add_argument('--lns-budget', type=float, default=10,
+                        help='Seconds per LNS sub-solve')
+    parser.add_argument('--lns-size', type=int,
+                        help='Nurses freed by the skill/penalty LNS neighbourhoods (default N/10)')
+    parser.add_argument('--rolling', type=int, default=0, metavar='K',
+                        help='Solve week by week, each stage encoding a window of K weeks '
+                             '(0 = whole horizon at once)')
+    parser.add_argument('--rolling-compare', action='store_true',
+                        help='With --rolling, also solve the whole horizon and report the cost gap')
+    parser.add_argument('--validator', action='store_true',
+                        help='Also check the solution with validator.jar (needs java); the '
+                             'native evaluator always runs')
+    parser.add_argument('--results-db',
+                        help='SQLite results store to record the run in (default: not recorded)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write per constraint family wall/CPU time, variables, clauses '
+                             'and encoder calls to this JSON file')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='With --profile, also trace the bytes allocated per family '
+                             '(tracemalloc; makes the encoding several times slower)')
+    parser.add_argument('--profile-cprofile', metavar='DIR',
+                        help='With --profile, also dump a cProfile file per family to DIR')
+    parser.add_argument('--instance',
+                        help='Instance name in the results store (default: the --sol folder name)')
+    parser.add_argument('--job-id',
+                        help='Id stored with the run in the results store (set by batch_runner.py '
+                             'to find the run of each job)')
+    args = parser.parse_args()
+    if args.stream and args.solver != 'tt-open-wbo-inc':
+        parser.error("--stream writes the formula to disk; use it with tt-open-wbo-inc")
+    if args.stream and (args.simplify or args.propagate):
+        parser.error("--simplify/--propagate need the formula in memory; drop --stream")
+    if args.stream and args.warm_start:
+        parser.error("--warm-start needs the formula in memory; drop --stream")
+    if args.lns and (args.stream or args.rolling):
+        parser.error("--lns works on the whole in-memory formula; drop --stream/--rolling")
+    if args.lns and not args.timeout:
+        parser.error("--lns runs until --timeout; set one")
+    try:
+        sequence_encoding_modes(args.sequence_encoding)
+        amo_encoding_modes(args.amo_encoding)
+    except ValueError as error:
+        parser.error(str(error))
+    return args
 
 
-def generate_hard_clauses(N, D, S, SK, weekdays, nurse_skills, forbidden_shifts, nurse_history):
+def generate_hard_clauses(N, D, S, SK, weekdays, coverage, nurse_skills, forbidden_shifts, nurse_history):
     """
     Generate hard clauses for the problem based on constraints.
     """
-    global hard_clauses
-
     # Constraint H1: No overlapping shifts
-    hard_clauses_H1 = constraint_H1(N, D, S)
-    hard_clauses += hard_clauses_H1
-    print(f"Number of clauses for H1: {len(hard_clauses_H1)}")
+    with profiler.family('H1'):
+        constraint_H1(N, D, S)
+    print(f"Number of clauses for H1: {formula.mark('H1')[0]}")
 
     # # Constraint H3: Forbidden shift successions
-    hard_clauses_H3 = constraint_H3(N, D, forbidden_shifts, nurse_history)
-    hard_clauses += hard_clauses_H3
-    print(f"Number of clauses for H3: {len(hard_clauses_H3)}")
+    with profiler.family('H3'):
+        constraint_H3(N, D, forbidden_shifts, nurse_history)
+    print(f"Number of clauses for H3: {formula.mark('H3')[0]}")
 
     # Constraint H1&H3 (using SC)
-    # hard_clauses_H1_H3 = constraint_H3_SC(
+    # constraint_H3_SC(
     #     N, D, S, forbidden_shifts, nurse_history, weekdays)
-    # hard_clauses += hard_clauses_H1_H3
-    # print(f"Number of clauses for H1_H3: {len(hard_clauses_H1_H3)}")
+    # print(f"Number of clauses for H1_H3: {formula.mark('H1_H3')[0]}")
 
     # Auxiliary constraints
-    hard_clauses_aux = constraint_aux(N, D, S, nurse_skills)
-    hard_clauses += hard_clauses_aux
-    print(f"Number of clauses for aux: {len(hard_clauses_aux)}")
+    with profiler.family('aux'):
+        constraint_aux(N, D, S, nurse_skills)
+    print(f"Number of clauses for aux: {formula.mark('aux')[0]}")
 
 
     # Constraint H2: Minimum coverage (optilog)
-    # hard_clauses_H2 = constraint_optilog_H2(
-    #     N, D, S, SK, weekdays, nurse_skills)
-    # hard_clauses += hard_clauses_H2
-    # print(f"Number of clauses for H2 old optilog: {len(hard_clauses_H2)}")
+    # constraint_optilog_H2(
+    #     N, D, S, SK, coverage, nurse_skills)
+    # print(f"Number of clauses for H2 old optilog: {formula.mark('H2')[0]}")
+
+    with profiler.family('H2'):
+        constraint_new_optilog_H2(
+            N, D, S, SK, coverage, nurse_skills)
+    print(f"Number of clauses for H2 new optilog: {formula.mark('H2')[0]}")
 
-    hard_clauses_H2 = constraint_new_optilog_H2(
-        N, D, S, SK, weekdays, nurse_skills)
-    hard_clauses += hard_clauses_H2
-    print(f"Number of clauses for H2 new optilog: {len(hard_clauses_H2)}")
+    # Symmetry breaking between interchangeable nurses (--symmetry-breaking)
+    if symmetric_classes:
+        with profiler.family('symmetry'):
+            constraint_symmetry_breaking(symmetric_classes)
+        print(f"Number of clauses for symmetry: {formula.mark('symmetry')[0]}")
 
-    return hard_clauses
+    return formula
 
 
-def generate_soft_clauses(N, D, S, SK, W, weekdays, nurse_skills, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types):
+def generate_soft_clauses(N, D, S, SK, W, weekdays, coverage, nurse_skills, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types):
     """
     Generate soft clauses for the problem based on preferences and penalties.
+    Hard clauses needed by the soft encodings (penalty definitions) are added
+    to the same formula.
     """
-    soft_clauses = []
-
     # # Soft constraint S1 (using old optilog): Optimal coverage
-    # soft_clauses_S1 = constraint_S1_old_optilog(
-    #     N, D, S, SK, weekdays, nurse_skills, penalty_weight=30)
-    # soft_clauses += soft_clauses_S1
+    # constraint_S1_old_optilog(
+    #     N, D, S, SK, coverage, nurse_skills, penalty_weight=30)
     # print(
-    #     f"Number of soft clauses for S1_old_optilog : {len(soft_clauses_S1)}")
+    #     f"Number of soft clauses for S1_old_optilog : {formula.mark('S1')[1]}")
 
     # Soft constraint S1 (using new optilog): Optimal coverage
-    soft_clauses_S1 = constraint_S1_new_optilog(
-        N, D, S, SK, weekdays, nurse_skills, penalty_weight=30)
-    soft_clauses += soft_clauses_S1
+    with profiler.family('S1'):
+        constraint_S1_new_optilog(
+            N, D, S, SK, coverage, nurse_skills, penalty_weight=30)
     print(
-        f"Number of soft clauses for S1_new_optilog : {len(soft_clauses_S1)}")
+        f"Number of soft clauses for S1_new_optilog : {formula.mark('S1')[1]}")
 
     # Soft constraint S5: Complete weekends
-    soft_clauses_S5 = constraint_S5(
-        N, D, nurse_contracts, contracts, penalty_weight=30)
-    soft_clauses += soft_clauses_S5
-    print(f"Number of soft clauses for S5: {len(soft_clauses_S5)}")
+    with profiler.family('S5'):
+        constraint_S5(
+            N, D, nurse_contracts, contracts, penalty_weight=30)
+    print(f"Number of soft clauses for S5: {formula.mark('S5')[1]}")
 
     # Soft constraint S4: Shift-off requests
-    soft_clauses_S4_SOR = constraint_S4_SOR(
-        weekdays, nurse_name_to_index, penalty_weight=10)
-    soft_clauses += soft_clauses_S4_SOR
-    print(f"Number of soft clauses for S4_SOR: {len(soft_clauses_S4_SOR)}")
+    with profiler.family('S4'):
+        constraint_S4_SOR(
+            weekdays, nurse_name_to_index, penalty_weight=10)
+    print(f"Number of soft clauses for S4_SOR: {formula.mark('S4')[1]}")
 
     # Soft constraint S2: Consecutive working days
-    soft_clauses_S2_cons_work_day = constraint_S2_cons_work_day(
-        weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight=30)
-    soft_clauses += soft_clauses_S2_cons_work_day
+    with profiler.family('S2_day'):
+        constraint_S2_cons_work_day(
+            weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight=30)
     print(
-        f"Number of soft clauses for S2_cons_work_day: {len(soft_clauses_S2_cons_work_day)}")
+        f"Number of soft clauses for S2_cons_work_day: {formula.mark('S2_day')[1]}")
 
     # Soft constraint S2: Consecutive working shifts
-    soft_clauses_S2_cons_work_shift = constraint_S2_cons_work_shift(
-        weekdays, nurse_history, nurse_name_to_index, shift_types, penalty_weight=15)
-    soft_clauses += soft_clauses_S2_cons_work_shift
+    with profiler.family('S2_shift'):
+        constraint_S2_cons_work_shift(
+            weekdays, nurse_history, nurse_name_to_index, shift_types, penalty_weight=15)
     print(
-        f"Number of soft clauses for S2_cons_work_shift: {len(soft_clauses_S2_cons_work_shift)}")
+        f"Number of soft clauses for S2_cons_work_shift: {formula.mark('S2_shift')[1]}")
 
     # Soft constraint S3: Consecutive days off
-    soft_clauses_S3 = constraint_S3(
-        weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight=30)
-    soft_clauses += soft_clauses_S3
-    print(f"Number of soft clauses for S3: {len(soft_clauses_S3)}")
+    with profiler.family('S3'):
+        constraint_S3(
+            weekdays, nurse_history, nurse_name_to_index, nurse_contracts, contracts, penalty_weight=30)
+    print(f"Number of soft clauses for S3: {formula.mark('S3')[1]}")
 
     # # Soft constraint S7 (using old optilog): Total working weekends
-    # soft_clauses_optilog_total_weekends = constraint_total_weekends_old_optilog(
+    # constraint_total_weekends_old_optilog(
     #     N, W, nurse_contracts, contracts, penalty_weight=30)
-    # soft_clauses += soft_clauses_optilog_total_weekends
     # print(
-    #     f"Number of soft clauses for old_optilog_total_weekends: {len(soft_clauses_optilog_total_weekends)}")
+    #     f"Number of soft clauses for old_optilog_total_weekends: {formula.mark('S7')[1]}")
 
     # # Soft constraint S6 (using old optilog): Total assignments
-    # soft_clauses_optilog_total_assignments = constraint_total_assignments_old_optilog(
+    # constraint_total_assignments_old_optilog(
     #     N, D, nurse_contracts, contracts, penalty_weight=20)
-    # soft_clauses += soft_clauses_optilog_total_assignments
     # print(
-    #     f"Number of soft clauses for old_optilog_total_assignments: {len(soft_clauses_optilog_total_assignments)}")
+    #     f"Number of soft clauses for old_optilog_total_assignments: {formula.mark('S6')[1]}")
 
     # Soft constraint S7 (using new optilog): Total working weekends
-    soft_clauses_optilog_total_weekends = constraint_total_weekends_new_optilog(
-        N, W, nurse_contracts, contracts, penalty_weight=30)
-    soft_clauses += soft_clauses_optilog_total_weekends
+    with profiler.family('S7'):
+        constraint_total_weekends_new_optilog(
+            N, W, nurse_contracts, contracts, penalty_weight=30)
     print(
-        f"Number of soft clauses for new_optilog_total_weekends: {len(soft_clauses_optilog_total_weekends)}")
+        f"Number of soft clauses for new_optilog_total_weekends: {formula.mark('S7')[1]}")
 
     # Soft constraint S6 (using new optilog): Total assignments
-    soft_clauses_optilog_total_assignments = constraint_total_assignments_new_optilog(
-        N, D, nurse_contracts, contracts, penalty_weight=20)
-    soft_clauses += soft_clauses_optilog_total_assignments
+    with profiler.family('S6'):
+        constraint_total_assignments_new_optilog(
+            N, D, nurse_contracts, contracts, penalty_weight=20)
     print(
-        f"Number of soft clauses for new_optilog_total_assignments: {len(soft_clauses_optilog_total_assignments)}")
+        f"Number of soft clauses for new_optilog_total_assignments: {formula.mark('S6')[1]}")
+
+    return formula
+
+
+def init_encode_worker(base_registry, encoding_cache_path, instance_globals, profiling=(False, None, False)):
+    """
+    Pool initializer of generate_clauses_parallel. `instance_globals` are the
+    module globals some constraints read (set by __main__ in a normal run,
+    which spawned workers do not execute). `profiling` is the (enabled,
+    cprofile_dir, memory) of the parent's profiler.
+    """
+    global encode_base_registry
+    encode_base_registry = base_registry
+    init_encoding_cache(encoding_cache_path)
+    init_profiler(*profiling)
+    globals().update(instance_globals)
+
+
+def encode_task(task):
+    """
+    Run one constraint function (or one nurse shard of it) in a worker
+    process, against a fresh copy of the registry and an empty formula.
+
+    Returns the registry, the formula, the encoding cache hits and misses and
+    the profiler record of the task (None when profiling is off); the
+    auxiliary variables are numbered from aux_base and are remapped by the
+    parent when merging.
+    """
+    global registry, formula
+    family, function, args, kwargs = task
+    registry = copy.deepcopy(encode_base_registry)
+    formula = ClauseStore()
+    hits, misses = encoding_cache.hits, encoding_cache.misses
+    with profiler.family(family):
+        function(*args, **kwargs)
+    return (registry, formula,
+            encoding_cache.hits - hits, encoding_cache.misses - misses,
+            profiler.pop(family))
+
+
+def merge_encoded(part_registry, part_formula):
+    """
+    Append a formula encoded by encode_task to the global formula, moving its
+    auxiliary variables above the ones allocated so far.
+    """
+    offset = registry.absorb(part_registry)
+    literals = np.frombuffer(part_formula.literals, dtype=np.int32)
+    literals = np.where(np.abs(literals) >= registry.aux_base,
+                        literals + np.sign(literals) * offset, literals)
+    formula.add_flat(np.frombuffer(part_formula.weights, dtype=np.int64),
+                     literals, np.frombuffer(part_formula.offsets, dtype=np.int64)[1:])
 
-    return soft_clauses
 
+def generate_clauses_parallel(N, D, S, SK, W, weekdays, coverage, nurse_skills, forbidden_shifts, nurse_history, nurse_name_to_index, nurse_contracts, contracts, shift_types, workers):
+    """
+    Parallel version of generate_hard_clauses + generate_soft_clauses.
 
-def debug_s1_penalty(solution_vars, N, D, S, SK, weekdays, nurse_skills):
+    Each constraint family runs in a worker process; the per-nurse families
+    (S5, S2, S3, S7, S6) are further split into one contiguous nurse shard per
+    worker. The results are merged in the serial order, so the formula is the
+    one the serial path builds. Keep the family list in sync with
+    generate_hard_clauses / generate_soft_clauses.
+    """
+    shards = [nurses.tolist() for nurses in np.array_split(np.arange(N), workers)
+              if len(nurses)]
+    history_shards = [nurse_history[part[0]:part[-1] + 1]
+                      for part in np.array_split(np.arange(len(nurse_history)), workers)
+                      if len(part)]
+
+    families = [
+        ('H1', [(constraint_H1, (N, D, S), {})]),
+        ('H3', [(constraint_H3, (N, D, forbidden_shifts, nurse_history), {})]),
+        ('aux', [(constraint_aux, (N, D, S, nurse_skills), {})]),
+        ('H2', [(constraint_new_optilog_H2,
+                 (N, D, S, SK, coverage, nurse_skills), {})]),
+        *([('symmetry', [(constraint_symmetry_breaking, (symmetric_classes,), {})])]
+          if symmetric_classes else []),
+        ('S1', [(constraint_S1_new_optilog,
+                 (N, D, S, SK, coverage, nurse_skills), {'penalty_weight': 30})]),
+        ('S5', [(constraint_S5, (N, D, nurse_contracts, contracts),
+                 {'penalty_weight': 30, 'nurses': nurses}) for nurses in shards]),
+        ('S4', [(constraint_S4_SOR, (weekdays, nurse_name_to_index),
+                 {'penalty_weight': 10})]),
+        ('S2_day', [(constraint_S2_cons_work_day,
+                     (weekdays, history, nurse_name_to_index, nurse_contracts, contracts),
+                     {'penalty_weight': 30}) for history in history_shards]),
+        ('S2_shift', [(constraint_S2_cons_work_shift,
+                       (weekdays, history, nurse_name_to_index, shift_types),
+                       {'penalty_weight': 15}) for history in history_shards]),
+        ('S3', [(constraint_S3,
+                 (weekdays, history, nurse_name_to_index, nurse_contracts, contracts),
+                 {'penalty_weight': 30}) for history in history_shards]),
+        ('S7', [(constraint_total_weekends_new_optilog, (N, W, nurse_contracts, contracts),
+                 {'penalty_weight': 30, 'nurses': nurses}) for nurses in shards]),
+        ('S6', [(constraint_total_assignments_new_optilog, (N, D, nurse_contracts, contracts),
+                 {'penalty_weight': 20, 'nurses': nurses}) for nurses in shards]),
+    ]
+    tasks = [(family, *task) for family, family_tasks in families for task in family_tasks]
+
+    with Pool(workers, initializer=init_encode_worker,
+              initargs=(registry, encoding_cache.path,
+                        {'nurse_name_to_index': nurse_name_to_index, 'excluded_x': excluded_x,
+                         'sequence_encoding': sequence_encoding, 'amo_encoding': amo_encoding},
+                        (profiler.enabled, profiler.cprofile_dir, profiler.memory))) as pool:
+        results = pool.imap(encode_task, tasks)
+        for family, family_tasks in families:
+            for _ in family_tasks:
+                part_registry, part_formula, hits, misses, record = next(results)
+                merge_encoded(part_registry, part_formula)
+                encoding_cache.hits += hits
+                encoding_cache.misses += misses
+                if record is not None:
+                    profiler.add(family, record)
+            hard, soft = formula.mark(family)
+            print(f"Number of clauses for {family}: {hard} hard, {soft} soft")
+
+    return formula
+
+
+def debug_s1_penalty(solution_vars, N, D, S, SK, coverage, nurse_skills):
     """
     Kiểm tra và in thông tin debug cho các biến phạt của ràng buộc S1.
 
     Args:
         solution_vars (set): Tập hợp các tên biến dương trong lời giải cuối cùng.
-        N, D, S, SK, weekdays, nurse_skills: Dữ liệu cần thiết để tính Copt.
+        N, D, S, SK, coverage, nurse_skills: Dữ liệu cần thiết để tính Copt.
     """
     print("\n--- DEBUGGING S1 PENALTY VARIABLES ---")
     total_s1_mismatches = 0
@@ -1595,67 +2229,63 @@ def debug_s1_penalty(solution_vars, N, D, S, SK, weekdays, nurse_skills):
     # Tạo một bản đồ nhanh để tra cứu biến nào có trong lời giải
     # solution_set = set(solution_vars) # Giả sử solution_vars đã là set rồi
 
-    for d in range(D):
-        for s in S:
-            for sk in SK:
-                Copt = get_Copt(weekdays, d, s, sk)
-                Cmin = get_Cmin(weekdays, d, s, sk)
-
-                # Chỉ kiểm tra các trường hợp mà S1 có thể áp dụng (Copt > Cmin)
-                if Copt <= Cmin:
-                    continue
-
-                # Lấy các biến y tá và đếm số y tá thực tế được phân công
-                actual_nurses = 0
-                relevant_nurse_vars = []
-                for n in range(N):
-                    if sk in nurse_skills.get(n, []):
-                        nurse_var_name = f"x_{n}_{d}_{s}_{sk}"
-                        relevant_nurse_vars.append(nurse_var_name)
-                        # Kiểm tra xem biến y tá có trong lời giải không
-                        if nurse_var_name in solution_vars:
-                            actual_nurses += 1
-
-                # Tính toán thiếu hụt dự kiến
-                expected_shortfall = 0
-                if actual_nurses < Copt:
-                    expected_shortfall = Copt - actual_nurses
-
-                # Tính toán số lượng biến phạt tối đa có thể có cho yêu cầu này
-                max_possible_shortfall = Copt if not relevant_nurse_vars else Copt - Cmin
-                if max_possible_shortfall < 0:
-                    max_possible_shortfall = 0  # Đảm bảo không âm
-
-                # Đếm số biến phạt thực tế được bật trong lời giải
-                actual_penalty_vars_on = 0
-                relevant_penalty_vars = []
-                for j in range(max_possible_shortfall):
-                    # Lấy tên biến phạt đã dùng trong constraint_optilog_S1
-                    penalty_var_name = f"penalty_s1_{d}_{s}_{sk}_{j}"
-                    relevant_penalty_vars.append(penalty_var_name)
-                    # Kiểm tra xem biến phạt có trong lời giải không
-                    if penalty_var_name in solution_vars:
-                        actual_penalty_vars_on += 1
-
-                # So sánh và báo cáo nếu có sự không khớp
-                # Chỉ báo cáo nếu có sự thiếu hụt dự kiến HOẶC có biến phạt được bật (để bắt lỗi thừa)
-                if expected_shortfall > 0 or actual_penalty_vars_on > 0:
-                    is_match = (expected_shortfall == actual_penalty_vars_on)
-                    status = "OK" if is_match else "MISMATCH"
-                    total_expected_penalty_vars += expected_shortfall
-                    total_actual_penalty_vars += actual_penalty_vars_on
-
-                    if not is_match:
-                        total_s1_mismatches += 1
-                        print(f"[{status}] Day={d}, Shift={s}, Skill={sk}: "
-                              f"Copt={Copt}, ActualNurses={actual_nurses}, "
-                              f"ExpectedShortfall={expected_shortfall}, "
-                              f"ActualPenaltyVarsON={actual_penalty_vars_on}")
-                        # Tùy chọn: In ra các biến y tá và biến phạt liên quan để debug sâu hơn
-                        print(f"   Relevant Nurses: {relevant_nurse_vars}")
-                        print(f"   Relevant Penalty: {relevant_penalty_vars}")
-                        print(
-                            f"   Solution Vars Subset (Penalty): {[p for p in relevant_penalty_vars if p in solution_vars]}")
+    # Chỉ kiểm tra các trường hợp mà S1 có thể áp dụng (Copt > Cmin)
+    for d, si, ki in coverage_cells(coverage[..., COV_OPT] > coverage[..., COV_MIN]):
+        s, sk = S[si], SK[ki]
+        Copt = int(coverage[d, si, ki, COV_OPT])
+        Cmin = int(coverage[d, si, ki, COV_MIN])
+
+        # Lấy các biến y tá và đếm số y tá thực tế được phân công
+        actual_nurses = 0
+        relevant_nurse_vars = []
+        for n in range(N):
+            if sk in nurse_skills.get(n, []):
+                nurse_var_name = f"x_{n}_{d}_{s}_{sk}"
+                relevant_nurse_vars.append(nurse_var_name)
+                # Kiểm tra xem biến y tá có trong lời giải không
+                if nurse_var_name in solution_vars:
+                    actual_nurses += 1
+
+        # Tính toán thiếu hụt dự kiến
+        expected_shortfall = 0
+        if actual_nurses < Copt:
+            expected_shortfall = Copt - actual_nurses
+
+        # Tính toán số lượng biến phạt tối đa có thể có cho yêu cầu này
+        max_possible_shortfall = Copt if not relevant_nurse_vars else Copt - Cmin
+        if max_possible_shortfall < 0:
+            max_possible_shortfall = 0  # Đảm bảo không âm
+
+        # Đếm số biến phạt thực tế được bật trong lời giải
+        actual_penalty_vars_on = 0
+        relevant_penalty_vars = []
+        for j in range(max_possible_shortfall):
+            # Lấy tên biến phạt đã dùng trong constraint_optilog_S1
+            penalty_var_name = f"penalty_s1_{d}_{s}_{sk}_{j}"
+            relevant_penalty_vars.append(penalty_var_name)
+            # Kiểm tra xem biến phạt có trong lời giải không
+            if penalty_var_name in solution_vars:
+                actual_penalty_vars_on += 1
+
+        # So sánh và báo cáo nếu có sự không khớp
+        # Chỉ báo cáo nếu có sự thiếu hụt dự kiến HOẶC có biến phạt được bật (để bắt lỗi thừa)
+        if expected_shortfall > 0 or actual_penalty_vars_on > 0:
+            is_match = (expected_shortfall == actual_penalty_vars_on)
+            status = "OK" if is_match else "MISMATCH"
+            total_expected_penalty_vars += expected_shortfall
+            total_actual_penalty_vars += actual_penalty_vars_on
+
+            if not is_match:
+                total_s1_mismatches += 1
+                print(f"[{status}] Day={d}, Shift={s}, Skill={sk}: "
+                      f"Copt={Copt}, ActualNurses={actual_nurses}, "
+                      f"ExpectedShortfall={expected_shortfall}, "
+                      f"ActualPenaltyVarsON={actual_penalty_vars_on}")
+                # Tùy chọn: In ra các biến y tá và biến phạt liên quan để debug sâu hơn
+                print(f"   Relevant Nurses: {relevant_nurse_vars}")
+                print(f"   Relevant Penalty: {relevant_penalty_vars}")
+                print(
+                    f"   Solution Vars Subset (Penalty): {[p for p in relevant_penalty_vars if p in solution_vars]}")
 
     print("--- S1 DEBUG SUMMARY ---")
     print(f"Total Mismatches Found: {total_s1_mismatches}")
@@ -1854,50 +2484,556 @@ def debug_s6_penalty(solution_vars, N, D, nurse_contracts, contracts):
     print("------------------------------------")
 
 
-def export_and_solve(args, hard_clauses, soft_clauses, nurse_name_to_index, weekdays, scenario, N, D, S, SK, W, nurse_skills, nurse_contracts, contracts):
+def export_and_solve(args, formula, nurse_name_to_index, weekdays, coverage, scenario, N, D, S, SK, W, nurse_skills, nurse_contracts, contracts, warm_roster=None, nurse_history=None):
     """
     Export the CNF file and solve the problem using the specified solver.
+
+    Returns:
+        list: The IDs of the variables set to true in the solution, or None.
     """
     if not os.path.exists(args.sol):
         os.makedirs(args.sol)
     export_variable_mapping(filename=f"{args.sol}/variable_mapping.txt")
 
-    print(f"Number of hard clauses: {len(hard_clauses)}")
-    print(f"Number of soft clauses: {len(soft_clauses)}")
-    print(f"Total number of variables: {counter - 1}")
+    print(f"Number of hard clauses: {formula.num_hard}")
+    print(f"Number of soft clauses: {formula.num_soft}")
+    print(f"Number of literals: {formula.num_literals()}")
+    print(f"Clause store size (bytes): {formula.nbytes()}")
+    print(f"Total number of variables: {registry.top}")
 
     print_variable_counts()
 
-    # Export CNF in tt-open-wbo-inc format
-    export_cnf_custom_format(
-        filename=f"{args.sol}/formular.wcnf", hard_clauses=hard_clauses, soft_clauses=soft_clauses)
-    # Run tt-open-wbo-inc
-    solution = run_tt_open_wbo_inc(
-        f"{args.sol}/formular.wcnf", args.timeout, f"{args.sol}/log.txt")
+    cache_stats = encoding_cache.stats()
+    print(f"Encoding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"(hit rate {cache_stats['hit_rate']:.1%})")
+    encoding_cache.save()
+
+    export_formula_stats(f"{args.sol}/formular.stats.json", formula)
+    with timed('solve'):
+        if args.lns:
+            started = time.time()
+            solution = solve_formula(args, formula, args.sol, args.timeout / 4, warm_roster)
+            if solution:
+                solution = run_lns(args, formula, args.sol, args.timeout - (time.time() - started),
+                                   solution, RosterContext(scenario), nurse_history, weekdays)
+        else:
+            solution = solve_formula(args, formula, args.sol, args.timeout, warm_roster)
 
     if solution:
-        # solution_vars_set = set(solution)
+        # solution_vars_set = {registry.name_of(var) for var in solution}
         # debug_s1_penalty(solution_vars_set, N, D, S,
-        #                  SK, weekdays, nurse_skills)
+        #                  SK, coverage, nurse_skills)
         # debug_s7_penalty(solution_vars_set, N, W, nurse_contracts, contracts)
         # debug_s6_penalty(solution_vars_set, N, D, nurse_contracts, contracts)
-        save_solutions(args, solution, nurse_name_to_index, weekdays, scenario)
+        with timed('save'):
+            save_solutions(args, solution, nurse_name_to_index, weekdays, scenario, nurse_history)
     else:
         print("No solutions.")
+    return solution
+
+
+def solve_formula(args, formula, sol_dir, timeout, warm_roster=None):
+    """
+    Solve the formula with the backend selected by --solver, writing the WCNF
+    file (if any) and the solver log to `sol_dir`.
+
+    `warm_roster` (e.g. a previous solution, see roster.load_roster) is
+    completed into a model up front. RC2 starts from that incumbent and gets
+    the roster as phases of its oracle. tt-open-wbo-inc takes no initial
+    model, so its WCNF gets the hard bound cost < incumbent cost instead (see
+    export_cost_bound), and the incumbent is kept unless the solver finds a
+    cheaper model.
 
+    Returns:
+        list: The IDs of the variables set to true in the best model, or None.
+    """
+    phases = incumbent = None
+    if warm_roster is not None:
+        # Swap interchangeable nurses into the order the symmetry breaking asks for
+        warm_roster = lex_leader_roster(warm_roster, symmetric_classes)
+        phases = warm_start_phases(formula, warm_roster)
+        incumbent = warm_start_model(formula, phases)
+
+    if args.solver in ('rc2', 'rc2-stratified'):
+        # In-process: no WCNF file, no subprocess
+        return formula.complete_model(solve_rc2(
+            formula, timeout, f"{sol_dir}/log.txt",
+            stratified=args.solver == 'rc2-stratified', phases=phases, incumbent=incumbent))
+    if args.solver == 'portfolio':
+        return formula.complete_model(run_portfolio(
+            formula, args.portfolio, timeout, sol_dir, phases=phases, incumbent=incumbent))
+
+    # Export CNF in tt-open-wbo-inc format
+    if isinstance(formula, StreamingClauseStore):
+        # Already written while generating, only the tail is left
+        formula.close()
+    else:
+        export_cnf_custom_format(
+            filename=f"{sol_dir}/formular.wcnf", formula=formula)
+    if incumbent is not None:
+        incumbent_cost = formula.evaluate(incumbent)[1]
+        if incumbent_cost == 0:
+            print("Warm start has cost 0, nothing to improve.")
+            return formula.complete_model(incumbent)
+        export_cost_bound(f"{sol_dir}/formular.wcnf", formula, incumbent_cost - 1, registry.top)
+    # Run tt-open-wbo-inc
+    solution = run_tt_open_wbo_inc(
+        f"{sol_dir}/formular.wcnf", timeout, f"{sol_dir}/log.txt")
+    if solution and incumbent is not None:
+        # Drop the relaxation and PB auxiliary variables of the cost bound
+        solution = [var for var in solution if var <= registry.top]
+    if incumbent is not None and (
+            not solution or formula.evaluate(incumbent)[1] <= formula.evaluate(solution)[1]):
+        print("tt-open-wbo-inc did not improve on the warm start.")
+        return formula.complete_model(incumbent)
+    return formula.complete_model(solution)
+
+
+def export_cost_bound(filename, formula, bound, num_vars, max_literals=None):
+    """
+    Append the hard constraint "total weight of the violated soft clauses <=
+    `bound`" to the WCNF file of `formula`, for solvers that take no initial
+    model or upper bound.
+
+    Every soft clause C with weight w gets a relaxation literal r: the negated
+    literal of a unit clause, else a new variable with the hard clause C v r.
+    The pseudo-Boolean constraint sum(w * r) <= bound, weights divided by
+    their gcd, is encoded with the pypblib adder network, whose size does not
+    depend on the bound: about 40 clauses per relaxation literal, i.e. 4-5
+    times the formula on the INRC-II instances. With more than
+    `max_literals` (default COST_BOUND_MAX_LITERALS) relaxation literals the
+    bound is not written. The new variables lie above `num_vars` and are not
+    registered.
+
+    Returns:
+        bool: Whether the bound was written.
+    """
+    if max_literals is None:
+        max_literals = COST_BOUND_MAX_LITERALS
+    relax = defaultdict(int)
+    relaxed = []
+    next_var = num_vars + 1
+    for weight, clause in formula.soft_clauses():
+        if len(clause) == 1:
+            literal = -int(clause[0])
+        else:
+            literal = next_var
+            next_var += 1
+            relaxed.append(clause.tolist() + [literal])
+        relax[literal] += weight
+    if len(relax) > max_literals:
+        print(f"Cost bound skipped: {len(relax)} relaxation literals, more than {max_literals}")
+        return False
+
+    weights = list(relax.values())
+    scale = math.gcd(*weights) or 1
+    config = PBConfig()
+    config.set_PB_Encoder(pblib.PB_ADDER)
+    pb2 = Pb2cnf(config)
+    bound_clauses = []
+    pb2.encode_leq([w // scale for w in weights], list(relax.keys()), bound // scale,
+                   bound_clauses, next_var)
+    with open(filename, "a") as f:
+        for clause in relaxed + bound_clauses:
+            f.write(f"h {' '.join(map(str, clause))} 0\n")
+    print(f"Cost bound: at most {bound}, {len(relaxed) + len(bound_clauses)} hard clauses")
+    return True
+
+
+def warm_start_phases(formula, roster):
+    """
+    Return solver phases for a warm start: the x, o, e and q literals of the
+    roster, and for the auxiliary variables in unit soft clauses (penalty
+    variables) the polarity that satisfies the clause.
+    """
+    literals = np.frombuffer(formula.literals, dtype=np.int32)
+    offsets = np.frombuffer(formula.offsets, dtype=np.int64)
+    weights = np.frombuffer(formula.weights, dtype=np.int64)
+    unit = (np.diff(offsets) == 1) & (weights != formula.HARD)
+    penalties = literals[offsets[:-1][unit]]
+    penalties = penalties[np.abs(penalties) >= registry.aux_base]
+    return np.concatenate((registry.roster_literals(roster), penalties)).tolist()
+
+
+def warm_start_model(formula, phases, sat_solver='g3'):
+    """
+    Complete a warm start into a model of the hard clauses.
+
+    The x literals among `phases` (see warm_start_phases) are assumed, so the
+    model has exactly the warm roster; if the hard clauses do not allow that
+    roster (e.g. the coverage changed), the model only follows the phases.
+
+    Returns:
+        list: The IDs of the variables set to true, or None if the hard
+        clauses are unsatisfiable.
+    """
+    assumptions = [lit for lit in phases if abs(lit) < registry.o_base]
+    with Solver(name=sat_solver) as oracle:
+        for clause in formula.hard_clauses():
+            oracle.add_clause(clause.tolist())
+        oracle.set_phases(phases)
+        if not oracle.solve(assumptions=assumptions):
+            print("Warm start roster violates hard constraints; using it as phases only.")
+            if not oracle.solve():
+                return None
+        true_vars = [lit for lit in oracle.get_model() if lit > 0]
+    print(f"Warm start: cost {formula.evaluate(true_vars)[1]}")
+    return true_vars
+
+
+def lns_neighbourhood(kind, roster, rng, size, penalties):
+    """
+    Pick the (N, D) bool mask of the roster cells an LNS iteration frees:
+        'days':    a block of consecutive days, for every nurse
+        'skill':   up to `size` random nurses sharing a random skill
+        'penalty': `size` nurses drawn from the 2 * size with the highest
+                   penalty (`penalties`, one entry per nurse)
+    """
+    N, D = roster.shape
+    free = np.zeros((N, D), dtype=bool)
+    if kind == 'days':
+        length = min(max(2, D // 8), D)
+        first = rng.integers(0, D - length + 1)
+        free[:, first:first + length] = True
+    elif kind == 'skill':
+        sk = rng.integers(0, len(registry.SK))
+        nurses = [n for n in range(N) if registry.has_skill(n, sk)]
+        free[rng.permutation(nurses)[:size]] = True
+    elif kind == 'penalty':
+        worst = np.argsort(-penalties, kind='stable')[:2 * size]
+        free[rng.permutation(worst)[:size]] = True
+    else:
+        raise ValueError(f"Unknown LNS neighbourhood: {kind}")
+    return free
+
+
+def run_lns(args, formula, sol_dir, timeout, initial, context, nurse_history, weekdays, seed=0):
+    """
+    Large-neighbourhood search around the encoded formula.
+
+    Starting from the `initial` model, every iteration frees one
+    neighbourhood (see lns_neighbourhood; the kinds take turns), fixes the x
+    variable of every other roster cell to its incumbent value with unit hard
+    clauses and re-solves with RC2Stratified for at most args.lns_budget
+    seconds, starting from the incumbent. A cheaper model becomes the new
+    incumbent. The formula is converted to a pysat WCNF once and reused by
+    every iteration.
+
+    The iterations go to `sol_dir`/log.txt as 'c' comment lines, with an 'o'
+    line for every improvement, and the improvements to trajectory.csv.
+
+    Returns:
+        list: The IDs of the variables set to true in the best model.
+    """
+    rng = np.random.default_rng(seed)
+    size = args.lns_size or max(2, registry.N // 10)
+    deadline = time.time() + timeout
+    start_time = time.time()
+    wcnf = formula.to_wcnf()
+
+    best = initial
+    best_cost = formula.evaluate(best)[1]
+    trajectory = [(0.0, best_cost)]
+    with open(os.path.join(sol_dir, "log.txt"), 'w') as log:
+        log.write(f"o {best_cost}\n")
+        iteration = 0
+        while time.time() < deadline:
+            kind = ('days', 'skill', 'penalty')[iteration % 3]
+            iteration += 1
+            roster = registry.roster_matrix(best)
+            penalties = sum(nurse_costs(roster, context, nurse_history, weekdays).values())
+            free = lns_neighbourhood(kind, roster, rng, size, penalties)
+            fixed = registry.roster_literals(roster, ~free)
+
+            budget = min(args.lns_budget, deadline - time.time())
+            solution = formula.complete_model(solve_rc2(
+                formula, budget, None, incumbent=best, wcnf=wcnf, fixed=fixed.tolist()))
+            cost = formula.evaluate(solution)[1]
+            log.write(f"c lns {iteration} {kind} free={int(free.sum())} cost={cost}\n")
+            if cost < best_cost:
+                best, best_cost = solution, cost
+                trajectory.append((time.time() - start_time, cost))
+                log.write(f"o {cost}\n")
+                print(f"LNS iteration {iteration} ({kind}): cost {cost}")
+            log.flush()
+        log.write("s SATISFIABLE\n")
+    write_trajectory(os.path.join(sol_dir, "trajectory.csv"), trajectory)
+    print(f"LNS: {iteration} iterations, best cost {best_cost}")
+    return best
+
+
+def encode_instance(args, N, D, S, SK, W, weekdays, coverage, nurse_skills, forbidden_shifts, nurse_history, nurse_name_to_index, nurse_contracts, contracts, shift_types, sol_dir):
+    """
+    Build the registry and the formula of one horizon (all weeks, or one
+    rolling-horizon stage) into the globals, streaming it to
+    `sol_dir`/formular.wcnf with --stream. --propagate and --simplify
+    simplify the formula afterwards, see simplify_instance().
+    """
+    global excluded_x, symmetric_classes, sequence_encoding, amo_encoding
+    init_registry(N, D, W, S, SK, nurse_skills)
+    sequence_encoding = sequence_encoding_modes(args.sequence_encoding)
+    amo_encoding = amo_encoding_modes(args.amo_encoding)
+    excluded_x = set()
+    if args.propagate:
+        excluded_x = {(n, 0, s) for n, s in history_blocked_shifts(nurse_history, forbidden_shifts)}
+    symmetric_classes = []
+    if args.symmetry_breaking:
+        symmetric_classes = nurse_classes(N, nurse_skills, nurse_contracts, contracts,
+                                          nurse_history, nurse_name_to_index, weekdays)
+        print(f"Symmetry breaking: {len(symmetric_classes)} classes of interchangeable nurses, "
+              f"{sum(map(len, symmetric_classes))} nurses")
+    if args.stream:
+        os.makedirs(sol_dir, exist_ok=True)
+        init_formula(f"{sol_dir}/formular.wcnf", args.stream_buffer)
+    else:
+        init_formula()
+
+    # Generate hard and soft clauses
+    if args.workers > 1:
+        generate_clauses_parallel(N, D, S, SK, W, weekdays, coverage, nurse_skills, forbidden_shifts,
+                                  nurse_history, nurse_name_to_index, nurse_contracts, contracts, shift_types, args.workers)
+    else:
+        generate_hard_clauses(
+            N, D, S, SK, weekdays, coverage, nurse_skills, forbidden_shifts, nurse_history)
+        generate_soft_clauses(N, D, S, SK, W, weekdays, coverage, nurse_skills,
+                              nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types)
+
+    # Map variables
+    with profiler.family('channeling'):
+        map_to_x_variables()
+    formula.mark('channeling')
 
-def save_solutions(args, solution, nurse_name_to_index, weekdays, scenario):
+    if args.propagate or args.simplify:
+        simplify_instance(args.propagate, args.simplify)
+    return formula
+
+
+def simplify_instance(propagate=False, deduplicate=True):
+    """
+    Replace the global formula by its simplified version and print what was
+    removed per family: unit propagation over the hard clauses (see
+    simplify.propagate_units) and/or duplicate removal (see
+    simplify.simplify_formula). The reports go to formula.simplification.
+    """
+    global formula
+    hard, soft = formula.num_hard, formula.num_soft
+    reports, fixed = {}, None
+    if propagate:
+        simplified, fixed, report = propagate_units(formula)
+        reports['propagate'] = report
+        if report['conflict']:
+            print("Unit propagation: the hard clauses are unsatisfiable, formula left as is")
+        else:
+            formula = simplified
+            print(f"Unit propagation: {report['fixed_variables']} variables fixed "
+                  f"in {report['rounds']} rounds")
+            print_simplification(report['families'], ('satisfied', 'stripped_literals', 'violated_soft'))
+    if deduplicate:
+        formula, report = simplify_formula(formula)
+        reports['deduplicate'] = report
+        print_simplification(report, REMOVALS)
+    formula.fixed = fixed
+    formula.simplification = reports
+    print(f"Simplified formula: {hard} -> {formula.num_hard} hard, {soft} -> {formula.num_soft} soft clauses")
+    return formula
+
+
+def print_simplification(report, reasons):
+    for family, counts in report.items():
+        removed = [f"{counts[reason]} {reason}" for reason in reasons if counts[reason]]
+        if removed:
+            print(f"Simplify {family}: " + ", ".join(removed))
+
+
+def encoding_settings(args):
+    """
+    The options that change the encoded formula, part of the formula cache
+    key. Which constraints are encoded is decided by the code of
+    generate_hard_clauses/generate_soft_clauses, covered by the code version.
+    """
+    return {
+        "pypblib_encoding": pypblib_encoding,
+        "optilog_encoding": optilog_encoding,
+        # Nurse shards are numbered differently from the serial encoding
+        "workers": args.workers,
+        "simplify": args.simplify,
+        "propagate": args.propagate,
+        "symmetry_breaking": args.symmetry_breaking,
+        "sequence_encoding": sequence_encoding_modes(args.sequence_encoding),
+        "amo_encoding": amo_encoding_modes(args.amo_encoding),
+    }
+
+
+def formula_cache_key(args):
+    return FormulaCache.key([args.sce, args.his, *args.weeks], encoding_settings(args),
+                            code_version(ENCODER_SOURCES, ('pypblib', 'optilog')))
+
+
+def encode_instance_cached(args, *encode_args):
+    """
+    encode_instance for the whole horizon, restoring the registry and the
+    formula from the formula cache instead when the same inputs were encoded
+    with the same settings and code before. Streamed formulas are never
+    cached.
+
+    The globals encode_instance sets besides the registry and the formula
+    (ENCODING_STATE: the symmetry classes, the x variables left out by
+    --propagate and the encoding modes) are stored with the entry and
+    restored on a hit, since the solve reads them too.
+    """
+    global registry, formula
+    if formula_cache is None or args.stream:
+        return encode_instance(args, *encode_args)
+    key = formula_cache_key(args)
+    cached = formula_cache.load(key)
+    if cached is not None:
+        registry, formula, state = cached
+        globals().update(state)
+        print(f"Formula cache hit: {key[:16]}, encoding skipped")
+        return formula
+    encode_instance(args, *encode_args)
+    state = {name: globals()[name] for name in ENCODING_STATE}
+    size = formula_cache.save(key, registry, formula, state)
+    print(f"Formula cache miss: {key[:16]} stored ({size / (1 << 20):.1f} MB)")
+    return formula
+
+
+def stage_contracts(nurse_contracts, contracts, nurse_history, nurse_name_to_index, end_week, total_weeks):
+    """
+    Per-nurse copies of the contracts for a rolling-horizon stage whose window
+    ends after week `end_week` (exclusive) of `total_weeks`.
+
+    The totals of a contract hold for the whole horizon, so a stage gets the
+    share of them up to the end of its window, minus the assignments and
+    working weekends the history already counts.
+
+    Returns:
+        tuple: (nurse index -> contract ID, contract ID -> contract)
+    """
+    share = end_week / total_weeks
+    stage_nurse_contracts, stage_contract_map = {}, {}
+    for nurse in nurse_history:
+        n = nurse_name_to_index[nurse['nurse']]
+        contract = dict(contracts[nurse_contracts[n]])
+        for key, done_key in (('minimumNumberOfAssignments', 'numberOfAssignments'),
+                              ('maximumNumberOfAssignments', 'numberOfAssignments'),
+                              ('maximumNumberOfWorkingWeekends', 'numberOfWorkingWeekends')):
+            if key in contract:
+                contract[key] = max(round(contract[key] * share) - nurse.get(done_key, 0), 0)
+        contract_id = f"{nurse_contracts[n]}/{n}"
+        stage_nurse_contracts[n] = contract_id
+        stage_contract_map[contract_id] = contract
+    return stage_nurse_contracts, stage_contract_map
+
+
+def solve_rolling_horizon(args, scenario, history, weekdays, N, S, SK, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, shift_types, warm_roster=None):
+    """
+    Solve the weeks one at a time, each stage encoding a window of
+    args.rolling weeks and keeping only the first one.
+
+    The history of the next stage is computed from the kept week, and the
+    timeout is split evenly over the stages. The INRC-II cost of the combined
+    roster is reported, and with --rolling-compare also the cost of the
+    monolithic solve under the same total timeout and the gap between the two.
+    A summary goes to rolling.json. Each stage is warm-started from its days
+    of `warm_roster`, if given.
+
+    Returns:
+        numpy.ndarray: The (N, D) roster, or None if a stage has no solution.
     """
-    Save the solution for each week and validate it.
+    context = RosterContext(scenario)
+    num_weeks = len(weekdays)
+    stage_timeout = args.timeout / num_weeks if args.timeout else args.timeout
+    roster = np.full((N, num_weeks * 7), -1, dtype=np.int32)
+    nurse_history = history['nurseHistory']
+    stages = []
+
+    for week in range(num_weeks):
+        window = weekdays[week:week + args.rolling]
+        stage_dir = os.path.join(args.sol, f"stage{week}")
+        os.makedirs(stage_dir, exist_ok=True)
+        started = time.time()
+
+        stage_nurse_contracts, stage_contract_map = stage_contracts(
+            nurse_contracts, contracts, nurse_history, nurse_name_to_index,
+            week + len(window), num_weeks)
+        encode_instance(args, N, len(window) * 7, S, SK, len(window), window,
+                        build_coverage(window, S, SK), nurse_skills, forbidden_shifts,
+                        nurse_history, nurse_name_to_index, stage_nurse_contracts,
+                        stage_contract_map, shift_types, stage_dir)
+        solution = solve_formula(
+            args, formula, stage_dir, stage_timeout,
+            None if warm_roster is None else warm_roster[:, week * 7:(week + len(window)) * 7])
+        if not solution:
+            print(f"Rolling horizon: no solution for week {week}.")
+            return None
+
+        roster[:, week * 7:(week + 1) * 7] = registry.roster_matrix(solution)[:, :7]
+        next_stage = next_history(roster[:, week * 7:(week + 1) * 7], context,
+                                  nurse_history, week + 1)
+        with open(os.path.join(stage_dir, "history-next.json"), 'w') as f:
+            json.dump(next_stage, f, indent=4)
+        nurse_history = next_stage['nurseHistory']
+
+        stages.append({
+            "week": week,
+            "window": len(window),
+            "seconds": time.time() - started,
+            # Objective of the stage formula; not available once streamed to disk
+            "formula_cost": None if args.stream else formula.evaluate(solution)[1],
+        })
+        print(f"Rolling horizon: week {week} solved in {stages[-1]['seconds']:.1f}s")
+
+    summary = {"window": args.rolling, "stages": stages,
+               "rolling": roster_cost(roster, context, history['nurseHistory'], weekdays)}
+    print(f"Rolling horizon cost: {summary['rolling']['total']}")
+
+    if args.rolling_compare:
+        mono_dir = os.path.join(args.sol, "monolithic")
+        os.makedirs(mono_dir, exist_ok=True)
+        started = time.time()
+        encode_instance(args, N, num_weeks * 7, S, SK, scenario['numberOfWeeks'], weekdays,
+                        build_coverage(weekdays, S, SK), nurse_skills, forbidden_shifts,
+                        history['nurseHistory'], nurse_name_to_index, nurse_contracts,
+                        contracts, shift_types, mono_dir)
+        solution = solve_formula(args, formula, mono_dir, args.timeout, warm_roster)
+        if solution:
+            summary["monolithic"] = roster_cost(
+                registry.roster_matrix(solution), context, history['nurseHistory'], weekdays)
+            summary["monolithic_seconds"] = time.time() - started
+            gap = summary['rolling']['total'] - summary['monolithic']['total']
+            summary["gap"] = gap
+            print(f"Monolithic cost: {summary['monolithic']['total']}, "
+                  f"rolling horizon gap: {gap:+d}")
+        else:
+            print("Monolithic solve found no solution.")
+
+    with open(os.path.join(args.sol, "rolling.json"), 'w') as f:
+        json.dump(summary, f, indent=4)
+    return roster
+
+
+def save_solutions(args, solution, nurse_name_to_index, weekdays, scenario, nurse_history, roster=None):
+    """
+    Save the solution for each week and validate it. `roster` can be given
+    instead of the solution, see VariableRegistry.roster_matrix.
+
+    The roster is checked by the native evaluator of roster.py (hard
+    constraints H1-H4 and the soft penalties, per nurse in
+    evaluation.json); with --validator, validator.jar runs as well.
     """
     scenario_id = scenario['id']
     solution_files = []
+    if roster is None:
+        roster = registry.roster_matrix(solution)
+    # For --warm-start of later runs
+    np.save(os.path.join(args.sol, "roster.npy"), roster)
 
     for week_index in range(0, len(weekdays)):
         start_day = week_index * 7
         end_day = (week_index + 1) * 7
         assignments = decode_solution(
-            solution, nurse_name_to_index, start_day, end_day)
+            solution, nurse_name_to_index, start_day, end_day, roster)
 
         solution_file = os.path.join(args.sol, f"sol-week{week_index}.json")
         solution_files.append(solution_file)
@@ -1905,31 +3041,122 @@ def save_solutions(args, solution, nurse_name_to_index, weekdays, scenario):
         save_solution(assignments, scenario_id, week_index, solution_file)
         print(f"Solution for week {week_index} saved in {solution_file}")
 
-    # Run the validator
-    solution_files_str = " ".join(solution_files)
-    validator_command = f"java -jar validator.jar --sce {args.sce} --his {args.his} --weeks {' '.join(args.weeks)} --sols {solution_files_str}"
-    print(f"Validator command: {validator_command}")
-    subprocess.run(validator_command, shell=True)
+    evaluation = evaluate_roster(roster, RosterContext(scenario), nurse_history, weekdays)
+    with open(os.path.join(args.sol, "evaluation.json"), 'w') as f:
+        json.dump(evaluation, f, indent=4)
+    print("Hard constraint violations: " + ", ".join(
+        f"{key} {value}" for key, value in evaluation['hard'].items()))
+    print("Soft constraint penalties: " + ", ".join(
+        f"{key} {value}" for key, value in evaluation['soft'].items()))
+    print(f"Feasible: {evaluation['feasible']}")
+    print(f"Total cost: {evaluation['total']}")
+
+    if args.validator:
+        solution_files_str = " ".join(solution_files)
+        validator_command = f"java -jar validator.jar --sce {args.sce} --his {args.his} --weeks {' '.join(args.weeks)} --sols {solution_files_str}"
+        print(f"Validator command: {validator_command}")
+        subprocess.run(validator_command, shell=True)
+    return evaluation
+
+
+def record_run(args, scenario, history, weekdays, started, solution=None, roster=None):
+    """
+    Write the record of this run to the --results-db store: the instance and
+    options, the formula size per family, the phase timings, the peak memory,
+    the MaxSAT objective and INRC-II costs of the solution, the solver status
+    and the cost trajectory.
+
+    In rolling-horizon mode the formula globals hold the last stage only, so
+    the formula size is left out; the costs are those of `roster`.
+    """
+    if not args.results_db:
+        return None
+    if roster is None and solution:
+        roster = registry.roster_matrix(solution)
+    log_path = f"{args.sol}/log.txt"
+    trajectory = read_trajectory(trajectory_path(log_path))
+    costs = None
+    if roster is not None:
+        costs = roster_cost(roster, RosterContext(scenario), history['nurseHistory'], weekdays)
+    status = solution_status(log_path)
+    if roster is not None and status == 'UNKNOWN':
+        status = 'SATISFIABLE'
+    self_mb, children_mb = peak_memory_mb()
+
+    record = {
+        "instance": args.instance or os.path.basename(os.path.normpath(args.sol)),
+        "solution_folder": args.sol,
+        "job_id": args.job_id,
+        "started": started,
+        "config": vars(args),
+        "timings": run_timings,
+        "peak_memory_mb": self_mb,
+        "solver_peak_memory_mb": children_mb,
+        "best_cost": None if costs is None else costs['total'],
+        "costs": costs,
+        "status": status,
+    }
+    if not args.rolling:
+        record.update({
+            "variables": registry.top,
+            "hard_clauses": formula.num_hard,
+            "soft_clauses": formula.num_soft,
+            "literals": formula.num_literals(),
+            "clause_families": formula.family_counts,
+            "variable_families": registry.family_counts(),
+        })
+        if solution and not isinstance(formula, StreamingClauseStore):
+            record["objective"] = formula.evaluate(solution)[1]
+        elif solution and trajectory:
+            # Streamed formula: the solver's last reported cost
+            record["objective"] = trajectory[-1][1]
+    with ResultsStore(args.results_db) as store:
+        run_id = store.add_run(record, trajectory)
+    print(f"Run {run_id} recorded in {args.results_db}")
+    return run_id
 
 
 if __name__ == "__main__":
     # Parse arguments
     args = parse_arguments()
+    started = time.time()
 
     # Load data
-    scenario, history, weekdays, N, D, S, SK, W, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types = load_data(
-        args.sce, args.his, args.weeks)
-
-    # Generate hard and soft clauses
-    hard_clauses = generate_hard_clauses(
-        N, D, S, SK, weekdays, nurse_skills, forbidden_shifts, nurse_history)
-    soft_clauses = generate_soft_clauses(N, D, S, SK, W, weekdays, nurse_skills,
-                                         nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types)
-
-    # Map variables
-    map_to_x_variables()
-
-    # Export and solve
-    export_and_solve(args, hard_clauses, soft_clauses,
-                     nurse_name_to_index, weekdays, scenario,
-                     N, D, S, SK, W, nurse_skills, nurse_contracts, contracts)
+    with timed('load'):
+        scenario, history, weekdays, N, D, S, SK, W, nurse_skills, forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, nurse_history, shift_types, coverage = load_data(
+            args.sce, args.his, args.weeks)
+
+    init_encoding_cache(args.encoding_cache)
+    init_formula_cache(args.formula_cache, args.formula_cache_size)
+    init_profiler(bool(args.profile), args.profile_cprofile, args.profile_memory)
+    warm_roster = None
+    if args.warm_start:
+        warm_roster = load_roster(args.warm_start, RosterContext(scenario))
+
+    if args.rolling:
+        # Rolling horizon: one formula per stage
+        os.makedirs(args.sol, exist_ok=True)
+        with timed('solve'):
+            roster = solve_rolling_horizon(args, scenario, history, weekdays, N, S, SK, nurse_skills,
+                                           forbidden_shifts, nurse_name_to_index, nurse_contracts, contracts, shift_types,
+                                           warm_roster)
+        encoding_cache.save()
+        if args.profile:
+            profiler.save(args.profile)
+        if roster is not None:
+            with timed('save'):
+                save_solutions(args, None, nurse_name_to_index, weekdays, scenario, nurse_history, roster)
+        record_run(args, scenario, history, weekdays, started, roster=roster)
+    else:
+        with timed('encode'):
+            encode_instance_cached(args, N, D, S, SK, W, weekdays, coverage, nurse_skills, forbidden_shifts,
+                                   nurse_history, nurse_name_to_index, nurse_contracts, contracts, shift_types, args.sol)
+        if args.profile:
+            profiler.save(args.profile)
+
+        # Export and solve
+        solution = export_and_solve(args, formula,
+                                    nurse_name_to_index, weekdays, coverage, scenario,
+                                    N, D, S, SK, W, nurse_skills, nurse_contracts, contracts, warm_roster,
+                                    nurse_history)
+        record_run(args, scenario, history, weekdays, started, solution=solution)
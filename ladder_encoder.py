@@ -1,8 +1,134 @@
-from pysat.solvers import Glucose3
+import warnings
 from math import ceil
 
+import numpy as np
+
 
 class LadderEncoder:
+    """
+    Ladder encodings of at-most-one constraints, with the auxiliary variables
+    allocated from a VariableRegistry and the clauses added to a ClauseStore.
+
+    Every method takes its literals as a 2-D integer array with one
+    constraint per row (a 1-D array is a single constraint), so a whole
+    family is encoded with a few array operations; the auxiliary IDs are
+    computed from the start of the block reserved for the call.
+
+    For literals x_0 .. x_(n-1), the ladder variable y_i stands for "one of
+    x_0 .. x_i is true" and only gets the implications x_i -> y_i and
+    y_(i-1) -> y_i (y_0 is x_0 itself). At most one x is true when
+    x_i -> not y_(i-1): 3n - 5 clauses and n - 2 variables instead of the
+    n(n - 1)/2 clauses of the pairwise encoding.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        # LadderEncoder(n, width) is the API of LegacyLadderEncoder
+        if cls is LadderEncoder and args and isinstance(args[0], int):
+            warnings.warn("LadderEncoder(n, width) is deprecated; use LadderEncoder(registry, "
+                          "formula).windowed_at_most_one, or LegacyLadderEncoder for the old "
+                          "clauses", DeprecationWarning, stacklevel=2)
+            return LegacyLadderEncoder(*args, **kwargs)
+        return super().__new__(cls)
+
+    def __init__(self, registry, formula, name="ladder"):
+        self.registry = registry
+        self.formula = formula
+        self.name = name
+
+    def prefixes(self, literals, length=None, label=''):
+        """
+        Return the ladder variables y_0 .. y_(length-1) of every row (default
+        length n - 1, all an at-most-one constraint needs).
+        """
+        literals = np.atleast_2d(np.asarray(literals, dtype=np.int64))
+        rows, n = literals.shape
+        length = n - 1 if length is None else length
+        if length <= 1 or rows == 0:
+            return literals[:, :max(length, 0)].copy()
+        first = self.registry.new_block(rows * (length - 1), self.name + "_{}_{j}", (label,))
+        ladder = np.empty((rows, length), dtype=np.int64)
+        ladder[:, 0] = literals[:, 0]
+        ladder[:, 1:] = first + np.arange(rows * (length - 1)).reshape(rows, length - 1)
+        self.formula.add_hard_rows(
+            np.column_stack((-literals[:, 1:length].ravel(), ladder[:, 1:].ravel())))
+        self.formula.add_hard_rows(
+            np.column_stack((-ladder[:, :-1].ravel(), ladder[:, 1:].ravel())))
+        return ladder
+
+    def at_most_one(self, literals, label=''):
+        literals = np.atleast_2d(np.asarray(literals, dtype=np.int64))
+        if literals.shape[1] < 2:
+            return
+        ladder = self.prefixes(literals, label=label)
+        self.formula.add_hard_rows(
+            np.column_stack((-literals[:, 1:].ravel(), -ladder.ravel())))
+
+    def exactly_one(self, literals, label=''):
+        literals = np.atleast_2d(np.asarray(literals, dtype=np.int64))
+        self.at_most_one(literals, label)
+        self.formula.add_hard_rows(literals)
+
+    def windowed_at_most_one(self, literals, width, offsets=None, aligned=True, label=''):
+        """
+        At most one true literal in every window of `width` consecutive
+        literals of each row.
+
+        The row is cut into blocks of `width`. A window starting inside block
+        b ends inside block b + 1; the one starting `offset` literals before
+        the end of b is "one of the last `offset` literals of b" (a ladder
+        over b reversed) against "one of the first width - offset literals
+        of b + 1" (a ladder over b + 1), so each window takes one binary
+        clause. `offsets` selects these windows (default: all, 1 .. width -
+        1); with `aligned`, each block gets its at-most-one constraint as
+        well, otherwise only the windows across blocks are encoded.
+        """
+        literals = np.atleast_2d(np.asarray(literals, dtype=np.int64))
+        rows, n = literals.shape
+        offsets = range(1, width) if offsets is None else offsets
+        blocks = [literals[:, start:start + width] for start in range(0, n, width)]
+        if aligned:
+            for block in blocks:
+                self.at_most_one(block, label)
+        if not offsets or len(blocks) < 2 or width < 2:
+            return
+        # suffix[b][:, i]: one of the last i + 1 literals of block b
+        # prefix[b][:, i]: one of the first i + 1 literals of block b
+        suffixes = [self.prefixes(block[:, ::-1], max(offsets), label) for block in blocks[:-1]]
+        prefixes = [self.prefixes(block, min(width - min(offsets), block.shape[1]), label)
+                    for block in blocks[1:]]
+        for suffix, prefix in zip(suffixes, prefixes):
+            pairs = [(offset - 1, width - offset - 1) for offset in offsets
+                     if width - offset - 1 < prefix.shape[1]]
+            if pairs:
+                last, first = np.array(pairs).T
+                self.formula.add_hard_rows(
+                    np.column_stack((-suffix[:, last].ravel(), -prefix[:, first].ravel())))
+
+
+def pairwise_at_most_one(formula, literals, width=None):
+    """
+    The pairwise encoding of at-most-one for every row of `literals`, or of
+    the windowed at-most-one with `width` (one clause per pair less than
+    `width` apart): the reference LadderEncoder is compared with.
+    """
+    literals = np.atleast_2d(np.asarray(literals, dtype=np.int64))
+    first, second = np.triu_indices(literals.shape[1], 1)
+    if width is not None:
+        first, second = first[second - first < width], second[second - first < width]
+    if len(first):
+        formula.add_hard_rows(
+            np.column_stack((-literals[:, first].ravel(), -literals[:, second].ravel())))
+
+
+class LegacyLadderEncoder:
+    """
+    The original ladder encoder of the windowed at-most-one over the shifts
+    1 .. n of one nurse, `width` shifts a day, numbering its auxiliary
+    variables from n + 1. Kept for the LadderEncoder(n, width) calls written
+    against it; new code should use LadderEncoder(registry, formula) and
+    windowed_at_most_one.
+    """
+
     def __init__(self, n, width):
         self.n = n
         self.width = width
@@ -155,6 +281,8 @@ class LadderEncoder:
 
     def solve(self, isLack):
         clauses = self.generate_clauses(isLack)
+        from pysat.solvers import Glucose3
+
         solver = Glucose3()
 
         for clause in clauses:
@@ -167,13 +295,25 @@ class LadderEncoder:
 if __name__ == "__main__":
     import argparse
 
-    parser = argparse.ArgumentParser(description='Ladder Encoder')
-    parser.add_argument('n', type=int, help='Number of shifts in the horizon')
-    parser.add_argument('width', type=int, help='Width of a window or the number of shifts in a day')
-    parser.add_argument('--lack', type=int, default=0,
-                        help='')
+    from clause_store import ClauseStore
+    from variable_registry import VariableRegistry
 
+    parser = argparse.ArgumentParser(
+        description='Clauses and variables of the ladder encodings against pairwise')
+    parser.add_argument('n', type=int, help='Number of literals (e.g. shifts in the horizon)')
+    parser.add_argument('width', type=int, help='Width of a window (e.g. shifts in a day)')
     args = parser.parse_args()
 
-    encoder = LadderEncoder(args.n, args.width)
-    encoder.solve(args.lack)
+    literals = np.arange(1, args.n + 1)
+    for title, encode in (
+            ('at-most-one, ladder', lambda encoder: encoder.at_most_one(literals)),
+            ('at-most-one, pairwise', lambda encoder: pairwise_at_most_one(encoder.formula, literals)),
+            ('windowed at-most-one, ladder',
+             lambda encoder: encoder.windowed_at_most_one(literals, args.width)),
+            ('windowed at-most-one, pairwise',
+             lambda encoder: pairwise_at_most_one(encoder.formula, literals, args.width))):
+        registry = VariableRegistry(0, 0, 0, [], [], {})
+        registry.claim(args.n, "x_{j}")
+        encoder = LadderEncoder(registry, ClauseStore())
+        encode(encoder)
+        print(f"{title}: {len(encoder.formula)} clauses, {registry.top - args.n} auxiliary variables")
@@ -0,0 +1,163 @@
+import itertools
+import random
+import unittest
+import warnings
+
+import numpy as np
+from pysat.solvers import Solver
+
+import global_nurse_rostering_sat as nrs
+from clause_store import ClauseStore
+from ladder_encoder import LadderEncoder, LegacyLadderEncoder, pairwise_at_most_one
+from variable_registry import VariableRegistry
+
+
+def encoder_for(num_literals):
+    registry = VariableRegistry(0, 0, 0, [], [], {})
+    registry.claim(num_literals, "x_{j}")
+    return LadderEncoder(registry, ClauseStore())
+
+
+def allowed(row, kind, width=None, offsets=None, aligned=True):
+    """
+    Whether one row of truth values satisfies the intended constraint.
+    """
+    if kind == 'at_most_one':
+        return row.sum() <= 1
+    if kind == 'exactly_one':
+        return row.sum() == 1
+    # Windowed: pairs within a block with `aligned`, and pairs inside the
+    # window starting `offset` literals before the end of a block
+    offsets = range(1, width) if offsets is None else offsets
+    n = len(row)
+    for i, j in itertools.combinations(np.flatnonzero(row), 2):
+        if j - i >= width:
+            continue
+        if i // width == j // width:
+            if aligned:
+                return False
+            continue
+        for offset in offsets:
+            start = (i // width + 1) * width - offset
+            if start <= i and j < start + width and start + width <= n:
+                return False
+    return True
+
+
+class LadderEncoderTest(unittest.TestCase):
+    def test_accepts_exactly_the_intended_assignments(self):
+        rng = random.Random(3)
+        for trial in range(300):
+            n, width = rng.randint(1, 9), rng.randint(1, 5)
+            rows = rng.randint(1, 2) if n <= 6 else 1
+            kind = rng.choice(('at_most_one', 'exactly_one', 'windowed'))
+            offsets = None
+            if width > 1 and rng.random() < 0.5:
+                offsets = sorted(rng.sample(range(1, width), rng.randint(0, width - 1)))
+            aligned = rng.random() < 0.7
+
+            encoder = encoder_for(rows * n)
+            literals = np.arange(1, rows * n + 1).reshape(rows, n)
+            if kind == 'windowed':
+                encoder.windowed_at_most_one(literals, width, offsets, aligned)
+            else:
+                getattr(encoder, kind)(literals)
+
+            with Solver(bootstrap_with=[list(map(int, clause)) for _, clause in encoder.formula]) as solver:
+                for bits in itertools.product((False, True), repeat=rows * n):
+                    values = np.array(bits).reshape(rows, n)
+                    expected = all(allowed(row, kind, width, offsets, aligned) for row in values)
+                    assumptions = [v if bit else -v for v, bit in zip(range(1, rows * n + 1), bits)]
+                    self.assertEqual(solver.solve(assumptions=assumptions), expected,
+                                     (kind, rows, n, width, offsets, aligned, bits))
+
+    def test_windowed_matches_pairwise(self):
+        for n, width in ((8, 4), (9, 3), (7, 2)):
+            ladder = encoder_for(n)
+            ladder.windowed_at_most_one(np.arange(1, n + 1), width)
+            pairwise = ClauseStore()
+            pairwise_at_most_one(pairwise, np.arange(1, n + 1), width)
+            with Solver(bootstrap_with=[list(map(int, c)) for _, c in ladder.formula]) as first, \
+                    Solver(bootstrap_with=[list(map(int, c)) for _, c in pairwise]) as second:
+                for bits in itertools.product((False, True), repeat=n):
+                    assumptions = [v if bit else -v for v, bit in zip(range(1, n + 1), bits)]
+                    self.assertEqual(first.solve(assumptions=assumptions),
+                                     second.solve(assumptions=assumptions), (n, width, bits))
+
+    def test_clause_counts(self):
+        encoder = encoder_for(10)
+        encoder.at_most_one(np.arange(1, 11))
+        self.assertEqual(len(encoder.formula), 3 * 10 - 5)
+        self.assertEqual(encoder.registry.top - 10, 10 - 2)
+
+    def test_old_constructor_is_deprecated(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            encoder = LadderEncoder(8, 4)
+        self.assertIsInstance(encoder, LegacyLadderEncoder)
+        self.assertTrue(any(issubclass(w.category, DeprecationWarning) for w in caught))
+        self.assertEqual(encoder.generate_clauses(False),
+                         LegacyLadderEncoder(8, 4).generate_clauses(False))
+
+
+class AmoEncodingTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, nrs, 'amo_encoding', nrs.amo_encoding)
+
+    def encode(self, mode, constraints, S, D):
+        nrs.amo_encoding = dict.fromkeys(nrs.AMO_FAMILIES, mode)
+        nrs.init_registry(1, D, 1, S, ['k'], {0: ['k']})
+        nrs.init_formula()
+        constraints(S, D)
+        return [list(map(int, clause)) for _, clause in nrs.formula]
+
+    def assert_modes_agree(self, constraints):
+        # Every assignment of the o variables is allowed by the pairwise
+        # clauses iff the ladder clauses allow it
+        for S, D in ((['E', 'D', 'L', 'N'], 2), (['E', 'D', 'L'], 3), (['D'], 2)):
+            pairwise = self.encode('pairwise', constraints, S, D)
+            ladder = self.encode('ladder', constraints, S, D)
+            shifts = [nrs.registry.o(0, d, s) for d in range(D) for s in range(len(S))]
+            with Solver(bootstrap_with=pairwise) as first, Solver(bootstrap_with=ladder) as second:
+                for bits in itertools.product((False, True), repeat=len(shifts)):
+                    assumptions = [v if bit else -v for v, bit in zip(shifts, bits)]
+                    self.assertEqual(first.solve(assumptions=assumptions),
+                                     second.solve(assumptions=assumptions), (S, D, bits))
+
+    def test_h1(self):
+        self.assert_modes_agree(lambda S, D: nrs.constraint_H1(1, D, S))
+
+    def test_h3_and_staircase(self):
+        # Random succession rules and last shifts; the H1 + H3 staircase of
+        # constraint_H3_SC is compared with pairwise H1 and H3
+        rng = random.Random(5)
+        self.addCleanup(setattr, nrs, 'nurse_name_to_index', getattr(nrs, 'nurse_name_to_index', None))
+        nrs.nurse_name_to_index = {'A': 0}
+        for _ in range(60):
+            S = ['E', 'D', 'L', 'N'][:rng.randint(1, 4)]
+            rules = [{'precedingShiftType': s1, 'succeedingShiftTypes': [s2 for s2 in S if rng.random() < 0.5]}
+                     for s1 in S]
+            history = [{'nurse': 'A', 'lastAssignedShiftType': rng.choice(S + ['None'])}]
+            D = rng.randint(1, 3)
+
+            def h1_h3(S, D):
+                nrs.constraint_H1(1, D, S)
+                nrs.constraint_H3(1, D, rules, history)
+
+            encodings = [self.encode('pairwise', h1_h3, S, D), self.encode('ladder', h1_h3, S, D),
+                         self.encode('pairwise', lambda S, D: nrs.constraint_H3_SC(1, D, S, rules, history, None),
+                                     S, D)]
+            shifts = [nrs.registry.o(0, d, s) for d in range(D) for s in range(len(S))]
+            solvers = [Solver(bootstrap_with=clauses) for clauses in encodings]
+            try:
+                for bits in itertools.product((False, True), repeat=len(shifts)):
+                    assumptions = [v if bit else -v for v, bit in zip(shifts, bits)]
+                    results = [solver.solve(assumptions=assumptions) for solver in solvers]
+                    self.assertEqual(results, [results[0]] * 3, (S, rules, D, bits))
+            finally:
+                for solver in solvers:
+                    solver.delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
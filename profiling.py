@@ -0,0 +1,112 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class FamilyProfiler:
+    """
+    Per constraint family resource accounting for the encoder.
+
+    Every `with profiler.family(name):` block adds its wall time, CPU time and
+    the change of the `counters()` values (variables, clauses, encoder calls,
+    ...) to the entry of `name`. Blocks of the same family add up, e.g. nurse
+    shards or rolling-horizon stages.
+
+    When disabled, family() does nothing besides one attribute check, so the
+    encoder keeps its speed. With `memory`, the allocated bytes are traced with
+    tracemalloc as well (peak above the start of the block and the bytes still
+    held at its end); tracing slows the encoder several times over, so the
+    times of such a profile are not representative. With `cprofile_dir`, each
+    family also runs under cProfile, dumped to <cprofile_dir>/<family>.prof.
+    """
+
+    def __init__(self, enabled=False, cprofile_dir=None, counters=None, memory=False):
+        self.enabled = enabled
+        self.cprofile_dir = cprofile_dir
+        self.counters = counters or dict
+        self.memory = enabled and memory
+        self.families = {}
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if cprofile_dir:
+            os.makedirs(cprofile_dir, exist_ok=True)
+
+    @contextmanager
+    def family(self, name):
+        if not self.enabled:
+            yield
+            return
+        before = self.counters()
+        if self.memory:
+            memory_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.cprofile_dir else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            after = self.counters()
+            record = {"wall_seconds": wall, "cpu_seconds": cpu, "blocks": 1}
+            if self.memory:
+                memory_after, memory_peak = tracemalloc.get_traced_memory()
+                record["alloc_peak_bytes"] = memory_peak - memory_before
+                record["alloc_net_bytes"] = memory_after - memory_before
+            record.update({key: after[key] - before[key] for key in after})
+            self.add(name, record)
+            if profile is not None:
+                self.dump_profile(name, profile)
+
+    def dump_profile(self, name, profile):
+        # Blocks of a family after the first (shards in other worker
+        # processes included) get their own numbered file; creating the file
+        # with 'x' reserves the name
+        number = 1
+        while True:
+            suffix = "" if number == 1 else f"-{number}"
+            path = os.path.join(self.cprofile_dir, f"{name}{suffix}.prof")
+            try:
+                open(path, "x").close()
+                break
+            except FileExistsError:
+                number += 1
+        profile.dump_stats(path)
+
+    def add(self, name, record):
+        """
+        Add a record (e.g. one measured in a worker process) to a family:
+        the allocation peak is the largest one, the other values add up.
+        """
+        entry = self.families.setdefault(name, {})
+        for key, value in record.items():
+            if key == "alloc_peak_bytes":
+                entry[key] = max(entry.get(key, 0), value)
+            else:
+                entry[key] = entry.get(key, 0) + value
+
+    def pop(self, name):
+        return self.families.pop(name, None)
+
+    def report(self):
+        """
+        Return {"families": {family: record}, "total": summed record}.
+        """
+        total = {}
+        for record in self.families.values():
+            for key, value in record.items():
+                if key == "alloc_peak_bytes":
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = total.get(key, 0) + value
+        return {"families": self.families, "total": total}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
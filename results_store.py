@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+
+try:
+    import resource
+except ImportError:  # Windows: no peak memory
+    resource = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    instance TEXT NOT NULL,
+    solution_folder TEXT,
+    job_id TEXT,
+    started REAL,
+    config TEXT,
+    variables INTEGER,
+    hard_clauses INTEGER,
+    soft_clauses INTEGER,
+    literals INTEGER,
+    clause_families TEXT,
+    variable_families TEXT,
+    timings TEXT,
+    peak_memory_mb REAL,
+    solver_peak_memory_mb REAL,
+    objective INTEGER,
+    best_cost INTEGER,
+    costs TEXT,
+    status TEXT,
+    source TEXT UNIQUE,
+    source_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS runs_instance ON runs (instance);
+CREATE TABLE IF NOT EXISTS trajectory (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    seconds REAL NOT NULL,
+    cost INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trajectory_run ON trajectory (run_id);
+"""
+
+# Columns holding JSON documents, decoded by ResultsStore.runs()
+JSON_COLUMNS = ('config', 'clause_families', 'variable_families', 'timings', 'costs')
+
+
+def solution_status(log_path):
+    """
+    Return the status of a solver log from its 's' line: OPTIMUM,
+    UNSATISFIABLE, SATISFIABLE, TIMEOUT (s UNKNOWN) or UNKNOWN when there is
+    no log or no 's' line.
+    """
+    if not os.path.exists(log_path):
+        return 'UNKNOWN'
+    with open(log_path, 'r') as file:
+        for line in file:
+            if line.startswith('s'):
+                if 'OPTIMUM' in line:
+                    return 'OPTIMUM'
+                elif 'UNSATISFIABLE' in line:
+                    return 'UNSATISFIABLE'
+                elif 'SATISFIABLE' in line:
+                    return 'SATISFIABLE'
+                elif 'UNKNOWN' in line:
+                    return 'TIMEOUT'
+    return 'UNKNOWN'
+
+
+def read_trajectory(path):
+    """
+    Read a trajectory.csv written by write_trajectory as (seconds, cost) pairs.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        next(f, None)
+        return [(float(seconds), int(cost))
+                for seconds, cost in (line.strip().split(',') for line in f if line.strip())]
+
+
+def peak_memory_mb():
+    """
+    Return (this process, its finished children) peak resident set size in
+    MB, or (None, None) where the resource module is missing.
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+class ResultsStore:
+    """
+    SQLite database of solver runs: one row in `runs` per solve plus its cost
+    trajectory in `trajectory`.
+
+    Several processes may write to the same file (e.g. batch_runner jobs): the
+    database uses WAL journaling and waits up to `timeout` seconds for a lock.
+    Dict-valued fields (config, per-family counts, timings, costs) are stored
+    as JSON text and decoded again by runs().
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        # Stores created before runs had a job id
+        columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(runs)")}
+        if 'job_id' not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE runs ADD COLUMN job_id TEXT")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS runs_job_id ON runs (job_id)")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_run(self, record, trajectory=()):
+        """
+        Insert a run. `record` maps column names to values (dicts for the JSON
+        columns); missing columns stay NULL. A record with the `source` of an
+        existing row replaces it. Returns the run id.
+        """
+        record = {key: json.dumps(value) if key in JSON_COLUMNS and value is not None else value
+                  for key, value in record.items()}
+        columns = ', '.join(record)
+        placeholders = ', '.join('?' * len(record))
+        with self.connection:
+            if record.get('source') is not None:
+                self.connection.execute("DELETE FROM runs WHERE source = ?", (record['source'],))
+            cursor = self.connection.execute(
+                f"INSERT INTO runs ({columns}) VALUES ({placeholders})", tuple(record.values()))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO trajectory (run_id, seconds, cost) VALUES (?, ?, ?)",
+                [(run_id, seconds, cost) for seconds, cost in trajectory])
+        return run_id
+
+    def runs(self, where='', params=()):
+        """
+        Return the runs matching an SQL `where` clause (without the keyword)
+        as dicts, oldest first.
+        """
+        sql = "SELECT * FROM runs" + (f" WHERE {where}" if where else "") + " ORDER BY id"
+        rows = []
+        for row in self.connection.execute(sql, params):
+            row = dict(row)
+            for key in JSON_COLUMNS:
+                if row[key] is not None:
+                    row[key] = json.loads(row[key])
+            rows.append(row)
+        return rows
+
+    def latest(self, where='', params=()):
+        runs = self.runs(where, params)
+        return runs[-1] if runs else None
+
+    def trajectory(self, run_id):
+        return [tuple(row) for row in self.connection.execute(
+            "SELECT seconds, cost FROM trajectory WHERE run_id = ? ORDER BY seconds", (run_id,))]
+
+    def source_mtimes(self):
+        """
+        Return {source: mtime} of the imported rows, see extract_to_xlsx.
+        """
+        return {source: mtime for source, mtime in self.connection.execute(
+            "SELECT source, source_mtime FROM runs WHERE source IS NOT NULL")}
@@ -0,0 +1,417 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from coverage_tensor import DAY_NAMES, COV_MIN, COV_OPT, build_coverage
+
+# INRC-II weights of the soft constraints, per unit of violation
+WEIGHTS = {
+    'S1': 30,        # optimal coverage, per missing nurse
+    'S2_day': 30,    # consecutive working days, per day
+    'S2_shift': 15,  # consecutive assignments to one shift type, per day
+    'S3': 30,        # consecutive days off, per day
+    'S4': 10,        # shift-off requests, per request not granted
+    'S5': 30,        # complete weekends, per incomplete weekend
+    'S6': 20,        # total assignments, per assignment over/under
+    'S7': 30,        # total working weekends, per weekend over
+}
+
+
+class RosterContext:
+    """
+    Scenario data needed to evaluate roster matrices, in index form.
+
+    A roster is an (N, D) int array as returned by
+    VariableRegistry.roster_matrix: entry [n, d] is s * |SK| + sk when nurse n
+    works shift S[s] with skill SK[sk] on day d, and -1 when the nurse is off.
+    Nurses, shifts and skills are numbered in scenario order.
+    """
+
+    def __init__(self, scenario):
+        self.scenario_id = scenario['id']
+        self.nurses = [nurse['id'] for nurse in scenario['nurses']]
+        self.nurse_index = {name: n for n, name in enumerate(self.nurses)}
+        self.S = [shift['id'] for shift in scenario['shiftTypes']]
+        self.SK = scenario['skills']
+        self.shift_index = {s: i for i, s in enumerate(self.S)}
+
+        contracts = {contract['id']: contract for contract in scenario['contracts']}
+        nurse_contracts = [contracts[nurse['contract']] for nurse in scenario['nurses']]
+
+        def per_nurse(key, default):
+            return np.array([c.get(key, default) for c in nurse_contracts], dtype=np.int64)
+
+        self.min_assignments = per_nurse('minimumNumberOfAssignments', 0)
+        self.max_assignments = per_nurse('maximumNumberOfAssignments', 1 << 30)
+        self.min_cons_work = per_nurse('minimumNumberOfConsecutiveWorkingDays', 0)
+        self.max_cons_work = per_nurse('maximumNumberOfConsecutiveWorkingDays', 1 << 30)
+        self.min_cons_off = per_nurse('minimumNumberOfConsecutiveDaysOff', 0)
+        self.max_cons_off = per_nurse('maximumNumberOfConsecutiveDaysOff', 1 << 30)
+        self.max_weekends = per_nurse('maximumNumberOfWorkingWeekends', 1 << 30)
+        self.complete_weekends = per_nurse('completeWeekends', 0).astype(bool)
+
+        skill_index = {sk: i for i, sk in enumerate(self.SK)}
+        self.nurse_skill_mask = np.zeros((len(self.nurses), len(self.SK)), dtype=bool)
+        for n, nurse in enumerate(scenario['nurses']):
+            self.nurse_skill_mask[n, [skill_index[sk] for sk in nurse['skills']]] = True
+
+        # forbidden[s1, s2]: shift S[s2] may not follow S[s1] on the next day
+        self.forbidden = np.zeros((len(self.S), len(self.S)), dtype=bool)
+        for succession in scenario['forbiddenShiftTypeSuccessions']:
+            s1 = self.shift_index[succession['precedingShiftType']]
+            for s2 in succession['succeedingShiftTypes']:
+                self.forbidden[s1, self.shift_index[s2]] = True
+
+        shift_types = scenario['shiftTypes']
+        self.min_cons_shift = np.array(
+            [s.get('minimumNumberOfConsecutiveAssignments', 0) for s in shift_types], dtype=np.int64)
+        self.max_cons_shift = np.array(
+            [s.get('maximumNumberOfConsecutiveAssignments', 1 << 30) for s in shift_types], dtype=np.int64)
+
+    def history_arrays(self, nurse_history):
+        """
+        Return the nurseHistory entries as per-nurse arrays: assignments,
+        working weekends, last shift index (-1 for None), consecutive
+        assignments, consecutive working days and consecutive days off.
+        """
+        N = len(self.nurses)
+        arrays = np.zeros((6, N), dtype=np.int64)
+        arrays[2] = -1
+        for entry in nurse_history:
+            n = self.nurse_index[entry['nurse']]
+            arrays[:, n] = (
+                entry.get('numberOfAssignments', 0),
+                entry.get('numberOfWorkingWeekends', 0),
+                self.shift_index.get(entry.get('lastAssignedShiftType'), -1),
+                entry.get('numberOfConsecutiveAssignments', 0),
+                entry.get('numberOfConsecutiveWorkingDays', 0),
+                entry.get('numberOfConsecutiveDaysOff', 0),
+            )
+        return arrays
+
+
+def sequence_penalty(active, run, min_len, max_len):
+    """
+    Count the INRC-II violations of min/max sequence lengths, per row.
+
+    `active` is a (..., D) bool array, `run` the length of the active sequence
+    the history ends with (0 if it does not end active) and min_len / max_len
+    the bounds per row, all broadcast against active[..., 0]. A sequence is
+    short by min_len - length when it ends, so the sequence still open at the
+    end of the horizon is not charged; every day beyond max_len counts one,
+    days already in the history excluded.
+    """
+    run = np.broadcast_to(run, active.shape[:-1]).astype(np.int32)
+    min_len = np.minimum(min_len, 1 << 30).astype(np.int32)
+    max_len = np.minimum(max_len, 1 << 30).astype(np.int32)
+    if run.size <= 4096:
+        return _sequence_penalty_runs(active, run, min_len, max_len)
+
+    # Large batches: step through the days of a day-major copy, so that every
+    # step reads one contiguous slice
+    days = np.ascontiguousarray(np.moveaxis(active, -1, 0))
+    short = np.zeros(days.shape[1:], dtype=np.int32)
+    over = np.zeros(days.shape[1:], dtype=np.int32)
+    for today in days:
+        ended = ~today & (run > 0)
+        short += np.where(ended, np.maximum(min_len - run, 0), 0)
+        run = np.where(today, run + 1, 0)
+        over += today & (run > max_len)
+    return short.astype(np.int64) + over
+
+
+def _sequence_penalty_runs(active, run, min_len, max_len):
+    """
+    sequence_penalty without a loop over the days, from the length of the
+    active sequence at every day; faster for a few rows, but its temporaries
+    are D times larger.
+    """
+    day = np.arange(active.shape[-1], dtype=np.int32)
+    run, min_len, max_len = run[..., None], min_len[..., None], max_len[..., None]
+    # Days since the last inactive day, continuing the history's sequence
+    # before the first one
+    last_off = np.maximum.accumulate(np.where(active, np.int32(-1), day), axis=-1)
+    length = np.where(active, day - last_off + np.where(last_off < 0, run, 0), 0)
+    # A sequence ends on an inactive day that follows an active one
+    before = np.concatenate((run, length[..., :-1]), axis=-1)
+    short = np.where(~active & (before > 0), np.maximum(min_len - before, 0), 0)
+    return short.sum(axis=-1, dtype=np.int64) + (length > max_len).sum(axis=-1)
+
+
+class RosterEvaluator:
+    """
+    INRC-II evaluation of roster matrices for one scenario, history and set
+    of weeks: the hard constraint checks (H1-H4) and the soft penalties (S1-S7).
+
+    The week data (coverage, shift-off requests) and the history are turned
+    into arrays once, so that many rosters can be evaluated quickly. Every
+    method takes either one (N, D) roster or a stack of them (B, N, D) and
+    returns arrays with the same leading axes. D may be shorter than the
+    weeks (e.g. a rolling-horizon stage); only its days are evaluated.
+
+    The hard checks count violations: H1 cells holding no valid shift/skill
+    code (a matrix cannot hold two assignments a day), H2 nurses missing below
+    the minimum coverage, H3 forbidden shift successions (the first day
+    against the history's last shift) and H4 assignments to a skill the nurse
+    does not have.
+    """
+
+    def __init__(self, context, nurse_history, weekdays):
+        self.context = context
+        num_shifts, num_skills = len(context.S), len(context.SK)
+        self.num_codes = num_shifts * num_skills
+        (self.assignments, self.weekends, self.last_shift, self.cons_assign,
+         self.cons_work, self.cons_off) = context.history_arrays(nurse_history)
+        self.coverage = build_coverage(weekdays, context.S, context.SK).reshape(
+            -1, self.num_codes, 2)
+
+        # Shift-off requests as (nurse, day, shift index or -1 for Any)
+        requests = [(context.nurse_index[request['nurse']],
+                     week_index * 7 + DAY_NAMES.index(request['day']),
+                     -1 if request['shiftType'] == 'Any'
+                     else context.shift_index[request['shiftType']])
+                    for week_index, weekday in enumerate(weekdays)
+                    for request in weekday.get('shiftOffRequests', [])]
+        self.requests = np.array(requests, dtype=np.int64).reshape(-1, 3)
+
+    def coverage_counts(self, rosters):
+        """
+        Return the number of nurses per (day, shift/skill code), shape
+        (..., D, |S| * |SK|).
+        """
+        D = rosters.shape[-1]
+        batch = rosters.reshape(-1, *rosters.shape[-2:])
+        valid = (batch >= 0) & (batch < self.num_codes)
+        index = ((np.arange(len(batch))[:, None, None] * D + np.arange(D)) * self.num_codes
+                 + batch)
+        counts = np.bincount(index[valid], minlength=len(batch) * D * self.num_codes)
+        return counts.reshape(*rosters.shape[:-2], D, self.num_codes)
+
+    def hard_violations(self, rosters):
+        """
+        Return {'H1': (..., N), 'H2': (...,), 'H3': (..., N), 'H4': (..., N)}
+        violation counts; H2 is per roster since coverage is not per nurse.
+        """
+        rosters = np.asarray(rosters)
+        context = self.context
+        num_skills = len(context.SK)
+        D = rosters.shape[-1]
+        invalid = (rosters < -1) | (rosters >= self.num_codes)
+        work = (rosters >= 0) & ~invalid
+        code = np.where(work, rosters, 0)
+        shift = np.where(work, code // num_skills, -1)
+
+        shortfall = self.coverage[:D, :, COV_MIN] - self.coverage_counts(rosters)
+        previous = np.concatenate(
+            (np.broadcast_to(self.last_shift[:, None], shift.shape[:-1] + (1,)),
+             shift[..., :-1]), axis=-1)
+        both = (previous >= 0) & (shift >= 0)
+        forbidden = both & context.forbidden[np.maximum(previous, 0), np.maximum(shift, 0)]
+        nurses = np.arange(rosters.shape[-2])[:, None]
+        missing_skill = work & ~context.nurse_skill_mask[nurses, code % num_skills]
+        return {
+            'H1': invalid.sum(axis=-1),
+            'H2': np.maximum(shortfall, 0).sum(axis=(-2, -1)),
+            'H3': forbidden.sum(axis=-1),
+            'H4': missing_skill.sum(axis=-1),
+        }
+
+    def coverage_cost(self, rosters):
+        """
+        Return the weighted S1 penalty per roster: nurses missing below the
+        optimal coverage.
+        """
+        rosters = np.asarray(rosters)
+        D = rosters.shape[-1]
+        shortfall = self.coverage[:D, :, COV_OPT] - self.coverage_counts(rosters)
+        return np.maximum(shortfall, 0).sum(axis=(-2, -1)) * WEIGHTS['S1']
+
+    def nurse_costs(self, rosters):
+        """
+        Return the weighted penalties of the nurse constraints (S2-S7) as a
+        dict family -> (..., N) array with one entry per nurse.
+        """
+        rosters = np.asarray(rosters)
+        context = self.context
+        num_shifts, num_skills = len(context.S), len(context.SK)
+        D = rosters.shape[-1]
+        work = (rosters >= 0) & (rosters < self.num_codes)
+        shift = np.where(work, rosters // num_skills, -1)
+        costs = {}
+
+        # S2: consecutive working days and consecutive assignments per shift type
+        costs['S2_day'] = sequence_penalty(
+            work, self.cons_work, context.min_cons_work, context.max_cons_work)
+        costs['S2_shift'] = sum(
+            sequence_penalty(shift == s, np.where(self.last_shift == s, self.cons_assign, 0),
+                             context.min_cons_shift[s], context.max_cons_shift[s])
+            for s in range(num_shifts))
+
+        # S3: consecutive days off
+        costs['S3'] = sequence_penalty(
+            ~work, self.cons_off, context.min_cons_off, context.max_cons_off)
+
+        # S4: shift-off requests
+        requests = self.requests[self.requests[:, 1] < D]
+        n, d, s = requests.T
+        not_granted = np.where(s < 0, work[..., n, d], shift[..., n, d] == s)
+        costs['S4'] = not_granted.astype(np.int64) @ (n[:, None] == np.arange(rosters.shape[-2]))
+
+        # S5: complete weekends; S7: total working weekends
+        saturday, sunday = work[..., 5::7], work[..., 6::7]
+        weeks = min(saturday.shape[-1], sunday.shape[-1])
+        saturday, sunday = saturday[..., :weeks], sunday[..., :weeks]
+        costs['S5'] = ((saturday != sunday) & context.complete_weekends[:, None]).sum(axis=-1)
+        worked_weekends = self.weekends + (saturday | sunday).sum(axis=-1)
+        costs['S7'] = np.maximum(worked_weekends - context.max_weekends, 0)
+
+        # S6: total assignments
+        total = self.assignments + work.sum(axis=-1)
+        costs['S6'] = (np.maximum(total - context.max_assignments, 0)
+                       + np.maximum(context.min_assignments - total, 0))
+
+        return {family: penalties * WEIGHTS[family] for family, penalties in costs.items()}
+
+    def evaluate(self, rosters):
+        """
+        Return the full evaluation as a dict of arrays:
+            'hard':           {H1..H4: (...,)} violation counts
+            'hard_per_nurse': {H1, H3, H4: (..., N)}
+            'soft':           {S1, S2_day, ..., S7: (...,)} weighted penalties
+            'soft_per_nurse': {S2_day, ..., S7: (..., N)}
+            'total':          (...,) sum of the soft penalties
+            'feasible':       (...,) True when no hard constraint is violated
+        """
+        hard_per_nurse = self.hard_violations(rosters)
+        soft_per_nurse = self.nurse_costs(rosters)
+        hard = {name: counts if name == 'H2' else counts.sum(axis=-1)
+                for name, counts in hard_per_nurse.items()}
+        soft = {'S1': self.coverage_cost(rosters)}
+        soft.update({family: penalties.sum(axis=-1)
+                     for family, penalties in soft_per_nurse.items()})
+        del hard_per_nurse['H2']
+        return {
+            'hard': hard,
+            'hard_per_nurse': hard_per_nurse,
+            'soft': soft,
+            'soft_per_nurse': soft_per_nurse,
+            'total': sum(soft.values()),
+            'feasible': sum(hard.values()) == 0,
+        }
+
+
+def evaluate_roster(roster, context, nurse_history, weekdays):
+    """
+    Evaluate one roster and return the breakdown as plain JSON-ready values:
+    hard violation counts, soft penalties, the total, the feasibility and
+    per nurse (by id) the hard violations and soft penalties.
+    """
+    result = RosterEvaluator(context, nurse_history, weekdays).evaluate(np.asarray(roster))
+    per_nurse = {}
+    for n, name in enumerate(context.nurses):
+        per_nurse[name] = {
+            **{key: int(values[n]) for key, values in result['hard_per_nurse'].items()},
+            **{key: int(values[n]) for key, values in result['soft_per_nurse'].items()},
+        }
+    return {
+        'feasible': bool(result['feasible']),
+        'total': int(result['total']),
+        'hard': {key: int(value) for key, value in result['hard'].items()},
+        'soft': {key: int(value) for key, value in result['soft'].items()},
+        'nurses': per_nurse,
+    }
+
+
+def roster_cost(roster, context, nurse_history, weekdays):
+    """
+    Return the INRC-II soft constraint penalties of a roster over the weeks in
+    `weekdays`, starting from `nurse_history`, as a dict with one entry per
+    WEIGHTS key plus 'total'. The totals (S6, S7) are charged for the end of
+    these weeks, including the history counts.
+    """
+    evaluator = RosterEvaluator(context, nurse_history, weekdays)
+    costs = {'S1': int(evaluator.coverage_cost(roster))}
+    for family, penalties in evaluator.nurse_costs(roster).items():
+        costs[family] = int(penalties.sum())
+    costs['total'] = sum(costs.values())
+    return costs
+
+
+def coverage_cost(roster, context, weekdays):
+    """
+    Return the weighted S1 penalty: nurses missing below the optimal coverage.
+    """
+    return int(RosterEvaluator(context, [], weekdays).coverage_cost(roster))
+
+
+def nurse_costs(roster, context, nurse_history, weekdays):
+    """
+    Return the weighted penalties of the nurse constraints (S2-S7) of a
+    roster as a dict family -> (N,) array with one entry per nurse.
+    """
+    return RosterEvaluator(context, nurse_history, weekdays).nurse_costs(roster)
+
+
+def next_history(roster, context, nurse_history, week):
+    """
+    Return the INRC-II history after the days of `roster` (normally one week),
+    in the format of the H0-*.json files: the nurseHistory counters continue
+    from `nurse_history`. `week` is the index of the next week.
+    """
+    num_skills = len(context.SK)
+    assignments, weekends, last_shift, cons_assign, cons_work, cons_off = \
+        context.history_arrays(nurse_history)
+    work = roster >= 0
+    shift = np.where(work, roster // num_skills, -1)
+
+    for d in range(roster.shape[1]):
+        today, s = work[:, d], shift[:, d]
+        cons_assign = np.where(today, np.where(s == last_shift, cons_assign + 1, 1), 0)
+        cons_work = np.where(today, cons_work + 1, 0)
+        cons_off = np.where(today, 0, cons_off + 1)
+        last_shift = s
+    assignments = assignments + work.sum(axis=1)
+    weekends = weekends + (work[:, 5::7] | work[:, 6::7]).sum(axis=1)
+
+    return {
+        "week": week,
+        "scenario": context.scenario_id,
+        "nurseHistory": [{
+            "nurse": name,
+            "numberOfAssignments": int(assignments[n]),
+            "numberOfWorkingWeekends": int(weekends[n]),
+            "lastAssignedShiftType": context.S[last_shift[n]] if last_shift[n] >= 0 else "None",
+            "numberOfConsecutiveAssignments": int(cons_assign[n]),
+            "numberOfConsecutiveWorkingDays": int(cons_work[n]),
+            "numberOfConsecutiveDaysOff": int(cons_off[n]),
+        } for n, name in enumerate(context.nurses)],
+    }
+
+
+def load_roster(paths, context):
+    """
+    Load a roster matrix from a .npy file, or from sol-week*.json solution
+    files (or a folder holding them) placed by their 'week' field.
+    """
+    if len(paths) == 1 and paths[0].endswith('.npy'):
+        return np.load(paths[0])
+    if len(paths) == 1 and os.path.isdir(paths[0]):
+        paths = sorted(glob.glob(os.path.join(paths[0], 'sol-week*.json')))
+    solutions = []
+    for path in paths:
+        with open(path) as f:
+            solutions.append(json.load(f))
+
+    num_weeks = max(solution['week'] for solution in solutions) + 1
+    roster = np.full((len(context.nurses), num_weeks * 7), -1, dtype=np.int32)
+    day_index = {day[:3]: d for d, day in enumerate(DAY_NAMES)}
+    skill_index = {sk: i for i, sk in enumerate(context.SK)}
+    for solution in solutions:
+        for assignment in solution['assignments']:
+            d = solution['week'] * 7 + day_index[assignment['day'][:3]]
+            roster[context.nurse_index[assignment['nurse']], d] = (
+                context.shift_index[assignment['shiftType']] * len(context.SK)
+                + skill_index[assignment['skill']])
+    return roster
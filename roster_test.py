@@ -0,0 +1,218 @@
+import json
+import os
+import unittest
+
+import numpy as np
+
+from coverage_tensor import DAY_NAMES
+from roster import WEIGHTS, RosterContext, RosterEvaluator, next_history, roster_cost
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input')
+
+
+def load_instance(instance, history, weeks):
+    folder = os.path.join(INPUT, instance)
+
+    def load(name):
+        with open(os.path.join(folder, name)) as f:
+            return json.load(f)
+
+    scenario = load(f'Sc-{instance}.json')
+    nurse_history = load(f'H0-{instance}-{history}.json')['nurseHistory']
+    weekdays = [load(f'WD-{instance}-{week}.json') for week in weeks]
+    return scenario, nurse_history, weekdays
+
+
+def random_rosters(context, days, count, seed):
+    rng = np.random.default_rng(seed)
+    codes = len(context.S) * len(context.SK)
+    shape = (count, len(context.nurses), days)
+    return np.where(rng.random(shape) < 0.6, rng.integers(0, codes, shape), -1).astype(np.int32)
+
+
+def runs(states, first_state, first_length):
+    """
+    Split a sequence of states, continuing a history that ends with
+    `first_length` days of `first_state`, into (state, length, ended,
+    history days) runs.
+    """
+    result = []
+    state, length, from_history = first_state, first_length, first_length
+    for today in states:
+        if today == state and state is not None:
+            length += 1
+            continue
+        if state is not None and length > 0:
+            result.append((state, length, True, from_history))
+        state, length, from_history = today, 1, 0
+    result.append((state, length, False, from_history))
+    return result
+
+
+def naive_soft_costs(roster, scenario, nurse_history, weekdays):
+    """
+    The INRC-II soft penalties of a roster, nurse by nurse and day by day
+    from the scenario dicts.
+    """
+    S = [shift['id'] for shift in scenario['shiftTypes']]
+    SK = scenario['skills']
+    shift_types = {shift['id']: shift for shift in scenario['shiftTypes']}
+    contracts = {contract['id']: contract for contract in scenario['contracts']}
+    history = {entry['nurse']: entry for entry in nurse_history}
+    D = roster.shape[1]
+    cost = dict.fromkeys(WEIGHTS, 0)
+
+    def assignment(n, d):
+        code = roster[n, d]
+        return (S[code // len(SK)], SK[code % len(SK)]) if code >= 0 else None
+
+    for w, weekday in enumerate(weekdays):
+        for requirement in weekday['requirements']:
+            for day, day_name in enumerate(DAY_NAMES):
+                needed = requirement[f'requirementOn{day_name}']['optimal']
+                present = sum(assignment(n, w * 7 + day) == (requirement['shiftType'], requirement['skill'])
+                              for n in range(roster.shape[0]))
+                cost['S1'] += max(0, needed - present)
+        for request in weekday.get('shiftOffRequests', []):
+            n = [nurse['id'] for nurse in scenario['nurses']].index(request['nurse'])
+            worked = assignment(n, w * 7 + DAY_NAMES.index(request['day']))
+            if worked and request['shiftType'] in ('Any', worked[0]):
+                cost['S4'] += 1
+
+    for n, nurse in enumerate(scenario['nurses']):
+        contract, past = contracts[nurse['contract']], history[nurse['id']]
+        work = [roster[n, d] >= 0 for d in range(D)]
+        working = past['numberOfConsecutiveWorkingDays'] > 0
+        length = past['numberOfConsecutiveWorkingDays'] if working else past['numberOfConsecutiveDaysOff']
+        for state, length, ended, from_history in runs(work, working, length):
+            kind = 'WorkingDays' if state else 'DaysOff'
+            low = contract[f'minimumNumberOfConsecutive{kind}']
+            high = contract[f'maximumNumberOfConsecutive{kind}']
+            cost['S2_day' if state else 'S3'] += (
+                (max(0, low - length) if ended else 0)
+                + max(0, length - high) - max(0, from_history - high))
+
+        last = past['lastAssignedShiftType']
+        last = None if last == 'None' else last
+        shifts = [assignment(n, d)[0] if work[d] else None for d in range(D)]
+        for state, length, ended, from_history in runs(
+                shifts, last, past['numberOfConsecutiveAssignments'] if last else 0):
+            if state is None:
+                continue
+            low = shift_types[state]['minimumNumberOfConsecutiveAssignments']
+            high = shift_types[state]['maximumNumberOfConsecutiveAssignments']
+            cost['S2_shift'] += (
+                (max(0, low - length) if ended else 0)
+                + max(0, length - high) - max(0, from_history - high))
+
+        weekends = past['numberOfWorkingWeekends']
+        for w in range(D // 7):
+            saturday, sunday = work[w * 7 + 5], work[w * 7 + 6]
+            cost['S5'] += bool(contract['completeWeekends']) and saturday != sunday
+            weekends += saturday or sunday
+        cost['S7'] += max(0, weekends - contract['maximumNumberOfWorkingWeekends'])
+        assignments = past['numberOfAssignments'] + sum(work)
+        cost['S6'] += (max(0, assignments - contract['maximumNumberOfAssignments'])
+                       + max(0, contract['minimumNumberOfAssignments'] - assignments))
+
+    return {family: value * WEIGHTS[family] for family, value in cost.items()}
+
+
+def naive_hard_violations(roster, scenario, nurse_history, weekdays):
+    """
+    The INRC-II hard constraint violations (H1-H4) of a roster, counted cell
+    by cell from the scenario dicts.
+    """
+    S = [shift['id'] for shift in scenario['shiftTypes']]
+    SK = scenario['skills']
+    forbidden = {(succession['precedingShiftType'], shift)
+                 for succession in scenario['forbiddenShiftTypeSuccessions']
+                 for shift in succession['succeedingShiftTypes']}
+    last_shift = {entry['nurse']: entry['lastAssignedShiftType'] for entry in nurse_history}
+    violations = dict.fromkeys(('H1', 'H2', 'H3', 'H4'), 0)
+
+    for n, nurse in enumerate(scenario['nurses']):
+        previous = last_shift[nurse['id']]
+        for d in range(roster.shape[1]):
+            code = roster[n, d]
+            if code < -1 or code >= len(S) * len(SK):
+                violations['H1'] += 1
+                previous = None
+                continue
+            if code < 0:
+                previous = None
+                continue
+            shift, skill = S[code // len(SK)], SK[code % len(SK)]
+            violations['H3'] += (previous, shift) in forbidden
+            violations['H4'] += skill not in nurse['skills']
+            previous = shift
+
+    for w, weekday in enumerate(weekdays):
+        for requirement in weekday['requirements']:
+            code = S.index(requirement['shiftType']) * len(SK) + SK.index(requirement['skill'])
+            for day, day_name in enumerate(DAY_NAMES):
+                present = int((roster[:, w * 7 + day] == code).sum())
+                violations['H2'] += max(0, requirement[f'requirementOn{day_name}']['minimum'] - present)
+    return violations
+
+
+class RosterEvaluatorTest(unittest.TestCase):
+    def test_batch_matches_naive_evaluation(self):
+        for instance, history, weeks in (('n030w4', 1, [1, 2, 3, 4]), ('n120w8', 1, range(8))):
+            scenario, nurse_history, weekdays = load_instance(instance, history, weeks)
+            context = RosterContext(scenario)
+            rosters = random_rosters(context, 7 * len(weeks), 40, seed=2)
+            # Invalid codes count as H1 violations
+            rosters[0, 0, 0] = len(context.S) * len(context.SK)
+            rosters[1, 3, 4] = -5
+            evaluator = RosterEvaluator(context, nurse_history, weekdays)
+            result = evaluator.evaluate(rosters)
+            for b, roster in enumerate(rosters):
+                hard = naive_hard_violations(roster, scenario, nurse_history, weekdays)
+                self.assertEqual({name: int(counts[b]) for name, counts in result['hard'].items()}, hard)
+                self.assertEqual(bool(result['feasible'][b]), sum(hard.values()) == 0)
+                if hard['H1'] == 0:
+                    soft = naive_soft_costs(roster, scenario, nurse_history, weekdays)
+                    self.assertEqual({family: int(cost[b]) for family, cost in result['soft'].items()}, soft)
+
+    def test_single_roster_matches_batch(self):
+        # A large batch and a single roster take the two sequence_penalty paths
+        scenario, nurse_history, weekdays = load_instance('n120w8', 2, range(8))
+        context = RosterContext(scenario)
+        rosters = random_rosters(context, 56, 60, seed=3)
+        evaluator = RosterEvaluator(context, nurse_history, weekdays)
+        batch = evaluator.nurse_costs(rosters)
+        for b in range(0, len(rosters), 7):
+            single = evaluator.nurse_costs(rosters[b])
+            for family, penalties in single.items():
+                np.testing.assert_array_equal(penalties, batch[family][b], family)
+
+
+class RosterCostTest(unittest.TestCase):
+    def test_matches_naive_evaluation(self):
+        for instance, history, weeks in (('n030w4', 0, [1, 2, 3, 4]), ('n040w8', 1, [0, 3, 5, 7, 2, 1, 4, 6])):
+            scenario, nurse_history, weekdays = load_instance(instance, history, weeks)
+            context = RosterContext(scenario)
+            for roster in random_rosters(context, 7 * len(weeks), 20, seed=0):
+                costs = roster_cost(roster, context, nurse_history, weekdays)
+                expected = naive_soft_costs(roster, scenario, nurse_history, weekdays)
+                self.assertEqual({family: costs[family] for family in WEIGHTS}, expected)
+                self.assertEqual(costs['total'], sum(expected.values()))
+
+    def test_costs_add_up_across_next_history(self):
+        scenario, nurse_history, weekdays = load_instance('n030w4', 0, [1, 2])
+        context = RosterContext(scenario)
+        for roster in random_rosters(context, 14, 50, seed=1):
+            whole = roster_cost(roster, context, nurse_history, weekdays)
+            first = roster_cost(roster[:, :7], context, nurse_history, weekdays[:1])
+            history = next_history(roster[:, :7], context, nurse_history, 1)['nurseHistory']
+            second = roster_cost(roster[:, 7:], context, history, weekdays[1:])
+            for family in ('S1', 'S2_day', 'S2_shift', 'S3', 'S4', 'S5'):
+                self.assertEqual(whole[family], first[family] + second[family], family)
+            # The totals are charged once, at the end of the horizon
+            for family in ('S6', 'S7'):
+                self.assertEqual(whole[family], second[family], family)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import itertools
+import random
+import unittest
+
+import numpy as np
+from pysat.solvers import Solver
+
+import global_nurse_rostering_sat as nrs
+from clause_store import ClauseStore
+from roster import sequence_penalty
+
+WEIGHT = 7
+
+
+class SequenceCounterTest(unittest.TestCase):
+    def test_every_assignment_costs_its_validator_penalty(self):
+        # Fixing the day literals must propagate every auxiliary variable,
+        # and the soft clauses left false must cost the validator's penalty
+        rng = random.Random(2)
+        for trial in range(300):
+            horizon = rng.randint(1, 10)
+            min_len, max_len = rng.randint(0, 5), rng.randint(0, 6)
+            run = rng.choice((0, rng.randint(1, 7)))
+            nrs.init_registry(1, horizon, 2, ['A'], ['k'], {0: ['k']})
+            nrs.init_formula()
+            # Odd trials encode days off, i.e. negated e literals as S3 does
+            sign = -1 if trial % 2 else 1
+            active = [sign * nrs.registry.e(0, d) for d in range(horizon)]
+            nrs.encode_sequence_counter(active, run, min_len, max_len, WEIGHT, ('test', 0))
+
+            hard = [list(clause) for weight, clause in nrs.formula if weight == ClauseStore.HARD]
+            soft = [(weight, clause) for weight, clause in nrs.formula if weight != ClauseStore.HARD]
+            variables = {abs(literal) for _, clause in nrs.formula for literal in clause}
+            with Solver(bootstrap_with=hard) as solver:
+                for bits in itertools.product((False, True), repeat=horizon):
+                    assumptions = [literal if bit else -literal for literal, bit in zip(active, bits)]
+                    status, implied = solver.propagate(assumptions=assumptions)
+                    self.assertTrue(status)
+                    implied = set(implied)
+                    self.assertLessEqual(variables, {abs(literal) for literal in implied})
+                    cost = sum(weight for weight, clause in soft
+                               if not any(literal in implied for literal in clause))
+                    expected = WEIGHT * int(sequence_penalty(np.array(bits), run, min_len, max_len))
+                    self.assertEqual(cost, expected, (horizon, min_len, max_len, run, bits))
+
+
+class FamilyModesTest(unittest.TestCase):
+    def test_defaults_and_overrides(self):
+        self.assertEqual(nrs.sequence_encoding_modes(None), dict.fromkeys(nrs.SEQUENCE_FAMILIES, 'window'))
+        self.assertEqual(nrs.sequence_encoding_modes(['window', 'S3=counter']),
+                         {'S2_day': 'window', 'S2_shift': 'window', 'S3': 'counter'})
+        self.assertEqual(nrs.amo_encoding_modes(['H3=ladder']), {'H1': 'pairwise', 'aux': 'pairwise', 'H3': 'ladder'})
+        for spec in ('lattice', 'S4=window', 'H1=ladder'):
+            with self.assertRaises(ValueError):
+                nrs.sequence_encoding_modes([spec])
+
+
+if __name__ == '__main__':
+    unittest.main()
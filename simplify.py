@@ -0,0 +1,220 @@
+import numpy as np
+
+from clause_store import ClauseStore
+
+# Why a clause was removed, in the order the checks run
+REMOVALS = ('tautology', 'satisfied', 'duplicate_hard', 'subsumed_soft', 'merged_soft')
+
+
+def clause_families(formula):
+    """
+    Return (family names, family index of every clause) from the ranges
+    recorded by ClauseStore.mark(); clauses added after the last mark get the
+    family 'unmarked'.
+    """
+    names = list(formula.family_counts)
+    sizes = [counts["hard"] + counts["soft"] for counts in formula.family_counts.values()]
+    rest = len(formula) - sum(sizes)
+    if rest:
+        names.append('unmarked')
+        sizes.append(rest)
+    return names, np.repeat(np.arange(len(names)), sizes)
+
+
+def simplify_formula(formula):
+    """
+    Return a smaller formula with the same optimal models and costs, and a
+    report of what was removed per family.
+
+    - Literals repeated within a clause are dropped, and clauses holding a
+      literal and its negation (tautologies) are removed.
+    - Clauses satisfied by a hard unit clause are removed (the units stay).
+    - Identical clauses (same literal set) are kept once: when one of them is
+      hard, the hard clause stays and soft copies are subsumed by it;
+      otherwise the first soft clause stays with the weights of all copies.
+
+    The surviving clauses keep their order, so the families stay contiguous
+    and family_counts is recomputed for them. The literals of a clause come
+    out sorted by variable.
+    """
+    literals = np.frombuffer(formula.literals, dtype=np.int32)
+    offsets = np.frombuffer(formula.offsets, dtype=np.int64)
+    weights = np.frombuffer(formula.weights, dtype=np.int64).copy()
+    count = len(weights)
+    hard = weights == ClauseStore.HARD
+    names, family = clause_families(formula)
+
+    # Sort the literals of each clause by variable, so that repeats and
+    # complementary pairs are neighbours
+    clause = np.repeat(np.arange(count), np.diff(offsets))
+    top = int(np.abs(literals).max(initial=0))
+    order_key = (clause * (2 * top + 2) + 2 * np.abs(literals).astype(np.int64)
+                 + (literals > 0))
+    literals = literals[np.argsort(order_key)]
+    same_clause = clause[1:] == clause[:-1]
+    tautology = np.zeros(count, dtype=bool)
+    tautology[clause[1:][same_clause & (literals[1:] == -literals[:-1])]] = True
+    single = np.ones(len(literals), dtype=bool)
+    single[1:] = ~same_clause | (literals[1:] != literals[:-1])
+    literals, clause = literals[single], clause[single]
+    lengths = np.bincount(clause, minlength=count)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # Clauses satisfied by the hard units
+    unit = hard & (lengths == 1)
+    forced = np.zeros(2 * top + 1, dtype=bool)
+    forced[literals[starts[unit]] + top] = True
+    satisfied = np.zeros(count, dtype=bool)
+    satisfied[clause[forced[literals + top]]] = True
+    satisfied &= ~unit & ~tautology
+
+    # Group the remaining clauses by their literal set, one length at a time
+    alive = ~tautology & ~satisfied
+    group = np.full(count, -1, dtype=np.int64)
+    groups = 0
+    for length in np.unique(lengths[alive]):
+        ids = np.flatnonzero(alive & (lengths == length))
+        rows = literals[starts[ids][:, None] + np.arange(length)]
+        order = np.lexsort(rows.T[::-1])
+        rows = rows[order]
+        new = np.ones(len(ids), dtype=bool)
+        new[1:] = (rows[1:] != rows[:-1]).any(axis=1)
+        group[ids[order]] = groups + np.cumsum(new) - 1
+        groups += int(np.count_nonzero(new))
+
+    # The representative of a group is its first hard clause, else its first
+    # clause; a soft representative carries the weights of the whole group
+    ids = np.flatnonzero(alive)
+    ordered = ids[np.lexsort((ids, ~hard[ids], group[ids]))]
+    first = np.ones(len(ordered), dtype=bool)
+    first[1:] = group[ordered][1:] != group[ordered][:-1]
+    keep = np.zeros(count, dtype=bool)
+    keep[ordered[first]] = True
+    group_hard = np.zeros(groups, dtype=bool)
+    group_hard[group[alive & hard]] = True
+    group_weight = np.zeros(groups, dtype=np.int64)
+    np.add.at(group_weight, group[alive & ~hard], weights[alive & ~hard])
+    soft_keep = keep & ~hard
+    weights[soft_keep] = group_weight[group[soft_keep]]
+
+    removed = alive & ~keep
+    reasons = {
+        'tautology': tautology,
+        'satisfied': satisfied,
+        'duplicate_hard': removed & hard,
+        'subsumed_soft': removed & ~hard & group_hard[np.maximum(group, 0)],
+        'merged_soft': removed & ~hard & ~group_hard[np.maximum(group, 0)],
+    }
+
+    simplified = ClauseStore()
+    simplified.add_flat(weights[keep], literals[keep[clause]], np.cumsum(lengths[keep]))
+    report = {}
+    for index, name in enumerate(names):
+        in_family = family == index
+        kept = in_family & keep
+        counts = {"hard": int(np.count_nonzero(kept & hard)),
+                  "soft": int(np.count_nonzero(kept & ~hard))}
+        if name != 'unmarked':
+            simplified.family_counts[name] = counts
+        report[name] = {
+            "before": {"hard": int(np.count_nonzero(in_family & hard)),
+                       "soft": int(np.count_nonzero(in_family & ~hard))},
+            "after": counts,
+            **{reason: int(np.count_nonzero(in_family & reasons[reason])) for reason in REMOVALS},
+        }
+    simplified._marked_hard = sum(counts["hard"] for counts in simplified.family_counts.values())
+    simplified._marked_soft = sum(counts["soft"] for counts in simplified.family_counts.values())
+    return simplified, report
+
+
+def propagate_units(formula):
+    """
+    Run unit propagation over the hard clauses and remove what it decides.
+
+    Returns (formula, fixed literals, report). The fixed literals are the
+    back-map of the new formula: their variables no longer occur in it (see
+    ClauseStore.complete_model). Clauses holding a true literal are removed,
+    false literals are stripped from the others. A soft clause whose literals
+    are all false is violated by every model; it keeps one literal and gets a
+    hard unit clause pinning it, appended as the family 'propagation', so the
+    costs stay the same.
+
+    When propagation derives a conflict the hard clauses are unsatisfiable;
+    the formula is then returned unchanged with an empty back-map and
+    report['conflict'] set.
+    """
+    literals = np.frombuffer(formula.literals, dtype=np.int32)
+    offsets = np.frombuffer(formula.offsets, dtype=np.int64)
+    weights = np.frombuffer(formula.weights, dtype=np.int64)
+    count = len(weights)
+    hard = weights == ClauseStore.HARD
+    names, family = clause_families(formula)
+    clause = np.repeat(np.arange(count), np.diff(offsets))
+    variable = np.abs(literals)
+    sign = np.sign(literals).astype(np.int8)
+    value = np.zeros(int(variable.max(initial=0)) + 1, dtype=np.int8)
+
+    # Propagate in rounds over the hard clauses that are not satisfied yet
+    open_literals = np.flatnonzero(hard[clause])
+    rounds = 0
+    conflict = np.any(hard & (offsets[1:] == offsets[:-1]))
+    while not conflict:
+        literal_value = value[variable[open_literals]] * sign[open_literals]
+        owner = clause[open_literals]
+        satisfied = np.zeros(count, dtype=bool)
+        satisfied[owner[literal_value > 0]] = True
+        unassigned = np.bincount(owner[literal_value == 0], minlength=count)
+        if np.any(~satisfied[owner] & (unassigned[owner] == 0)):
+            conflict = True
+            break
+        units = open_literals[(literal_value == 0) & ~satisfied[owner] & (unassigned[owner] == 1)]
+        if len(units) == 0:
+            break
+        rounds += 1
+        value[variable[units]] = sign[units]
+        open_literals = open_literals[~satisfied[owner]]
+    if conflict:
+        return formula, np.zeros(0, dtype=np.int32), {"conflict": True, "rounds": rounds}
+
+    literal_value = value[variable] * sign
+    satisfied = np.zeros(count, dtype=bool)
+    satisfied[clause[literal_value > 0]] = True
+    lengths = np.bincount(clause[literal_value == 0], minlength=count)
+    violated = ~satisfied & (lengths == 0) & ~hard
+    keep = ~satisfied
+    keep_literal = keep[clause] & (literal_value == 0)
+    # Violated soft clauses keep their first literal
+    starts = offsets[:-1]
+    keep_literal[starts[violated]] = True
+    lengths[violated] = 1
+
+    simplified = ClauseStore()
+    simplified.add_flat(weights[keep], literals[keep_literal], np.cumsum(lengths[keep]))
+    report = {}
+    for index, name in enumerate(names):
+        in_family = family == index
+        kept = in_family & keep
+        counts = {"hard": int(np.count_nonzero(kept & hard)),
+                  "soft": int(np.count_nonzero(kept & ~hard))}
+        if name != 'unmarked':
+            simplified.family_counts[name] = counts
+        report[name] = {
+            "before": {"hard": int(np.count_nonzero(in_family & hard)),
+                       "soft": int(np.count_nonzero(in_family & ~hard))},
+            "after": counts,
+            "satisfied": int(np.count_nonzero(in_family & satisfied)),
+            "stripped_literals": int(np.count_nonzero(
+                in_family[clause] & keep[clause] & ~keep_literal)),
+            "violated_soft": int(np.count_nonzero(in_family & violated)),
+        }
+    simplified._marked_hard = sum(counts["hard"] for counts in simplified.family_counts.values())
+    simplified._marked_soft = sum(counts["soft"] for counts in simplified.family_counts.values())
+    pinned = np.unique(literals[starts[violated]])
+    if len(pinned):
+        simplified.add_hard_rows(-pinned[:, None])
+        simplified.mark('propagation')
+
+    fixed_vars = np.flatnonzero(value)
+    fixed = (fixed_vars * value[fixed_vars]).astype(np.int32)
+    return simplified, fixed, {"conflict": False, "rounds": rounds,
+                               "fixed_variables": len(fixed), "families": report}
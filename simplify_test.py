@@ -0,0 +1,94 @@
+import itertools
+import random
+import unittest
+
+from clause_store import ClauseStore
+from simplify import propagate_units, simplify_formula
+
+NUM_VARS = 7
+
+
+def assignments():
+    """
+    The true variables of every assignment of NUM_VARS variables.
+    """
+    for bits in itertools.product((False, True), repeat=NUM_VARS):
+        yield [v + 1 for v in range(NUM_VARS) if bits[v]]
+
+
+def optimum(formula):
+    """
+    The least soft cost of an assignment satisfying the hard clauses, or
+    None when there is none.
+    """
+    costs = [soft for hard, soft in map(formula.evaluate, assignments()) if hard == 0]
+    return min(costs, default=None)
+
+
+def random_formula(rng, duplicates):
+    """
+    A formula of three marked families of random hard and soft clauses over
+    NUM_VARS variables; with `duplicates`, most families end with a copy of
+    an earlier clause (shuffled, hard or soft).
+    """
+    formula = ClauseStore()
+    for family in ('A', 'B', 'C'):
+        for _ in range(rng.randint(0, 12)):
+            clause = [rng.choice((-1, 1)) * rng.randint(1, NUM_VARS)
+                      for _ in range(rng.choice((1, 1, 2, 2, 3)))]
+            if rng.random() < 0.4:
+                formula.add_hard(clause)
+            else:
+                formula.add_soft(rng.randint(1, 5), clause)
+        if duplicates and len(formula) and rng.random() < 0.7:
+            clause = list(formula.clause(rng.randrange(len(formula))))
+            rng.shuffle(clause)
+            if rng.random() < 0.5:
+                formula.add_hard(clause)
+            else:
+                formula.add_soft(rng.randint(1, 5), clause)
+        formula.mark(family)
+    return formula
+
+
+class SimplifyFormulaTest(unittest.TestCase):
+    def test_same_feasible_assignments_and_costs(self):
+        rng = random.Random(1)
+        for trial in range(300):
+            formula = random_formula(rng, duplicates=True)
+            simplified, _ = simplify_formula(formula)
+            counts = simplified.family_counts.values()
+            self.assertEqual(sum(count['hard'] + count['soft'] for count in counts), len(simplified))
+            for true_vars in assignments():
+                hard, soft = formula.evaluate(true_vars)
+                simplified_hard, simplified_soft = simplified.evaluate(true_vars)
+                self.assertEqual(hard == 0, simplified_hard == 0, trial)
+                if hard == 0:
+                    self.assertEqual(soft, simplified_soft, trial)
+
+
+class PropagateUnitsTest(unittest.TestCase):
+    def test_completed_models_keep_their_costs(self):
+        rng = random.Random(2)
+        for trial in range(400):
+            formula = random_formula(rng, duplicates=False)
+            propagated, fixed, report = propagate_units(formula)
+            if report['conflict']:
+                self.assertIsNone(optimum(formula), trial)
+                continue
+            propagated.fixed = fixed
+            for true_vars in assignments():
+                hard, soft = propagated.evaluate(true_vars)
+                if hard == 0:
+                    self.assertEqual(formula.evaluate(propagated.complete_model(true_vars)), (0, soft), trial)
+            self.assertEqual(optimum(propagated), optimum(formula), trial)
+
+            # The fixed variables only remain in the units pinning them
+            fixed_vars = {abs(int(literal)) for literal in fixed}
+            for _, clause in propagated:
+                if len(clause) > 1:
+                    self.assertFalse(fixed_vars & {abs(literal) for literal in clause}, trial)
+
+
+if __name__ == '__main__':
+    unittest.main()
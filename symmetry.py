@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+import numpy as np
+
+from coverage_tensor import DAY_NAMES
+
+
+def nurse_classes(N, nurse_skills, nurse_contracts, contracts, nurse_history, nurse_name_to_index,
+                  weekdays):
+    """
+    Group the nurses that are interchangeable in the instance: same contract
+    terms, same skill set, same history (every field but the nurse id) and
+    the same shift-off requests in every week. Swapping two nurses of a class
+    maps every roster to one of the same cost.
+
+    Contracts are compared by their terms rather than their ids, since the
+    rolling-horizon stages give every nurse a contract of its own.
+
+    Returns the classes of at least two nurses as sorted lists of nurse
+    indices, ordered by their first nurse.
+    """
+    history = {nurse_name_to_index[entry['nurse']]:
+               tuple(sorted((key, value) for key, value in entry.items() if key != 'nurse'))
+               for entry in nurse_history or []}
+    requests = defaultdict(list)
+    for week, weekday in enumerate(weekdays):
+        for request in weekday.get('shiftOffRequests', []):
+            requests[nurse_name_to_index[request['nurse']]].append(
+                (week, DAY_NAMES.index(request['day']), request['shiftType']))
+
+    groups = defaultdict(list)
+    for n in range(N):
+        contract = tuple(sorted((key, str(value)) for key, value in contracts[nurse_contracts[n]].items()
+                                if key != 'id'))
+        key = (contract, tuple(sorted(nurse_skills.get(n, []))),
+               history.get(n), tuple(sorted(requests[n])))
+        groups[key].append(n)
+    return sorted((nurses for nurses in groups.values() if len(nurses) > 1),
+                  key=lambda nurses: nurses[0])
+
+
+def lex_leader_roster(roster, classes):
+    """
+    Reorder the rows of each class so that the roster satisfies the
+    symmetry-breaking order of constraint_symmetry_breaking: comparing the
+    x variables day by day, shift by shift and skill by skill, an earlier
+    nurse of a class has the first true variable where two nurses differ.
+    Within a day that is the smaller shift/skill code, and any code beats a
+    day off.
+    """
+    roster = np.array(roster, copy=True)
+    for nurses in classes:
+        rows = roster[nurses]
+        keys = np.where(rows >= 0, rows, np.iinfo(rows.dtype).max)
+        order = np.lexsort(keys.T[::-1])
+        roster[nurses] = rows[order]
+    return roster
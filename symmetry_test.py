@@ -0,0 +1,99 @@
+import itertools
+import unittest
+
+import numpy as np
+
+import global_nurse_rostering_sat as nrs
+from clause_store import ClauseStore
+from roster_test import load_instance
+from symmetry import lex_leader_roster, nurse_classes
+
+
+def instance_classes(instance, history, weeks):
+    scenario, nurse_history, weekdays = load_instance(instance, history, weeks)
+    nurse_name_to_index = {nurse['id']: n for n, nurse in enumerate(scenario['nurses'])}
+    nurse_skills = {n: nurse['skills'] for n, nurse in enumerate(scenario['nurses'])}
+    nurse_contracts = {n: nurse['contract'] for n, nurse in enumerate(scenario['nurses'])}
+    contracts = {contract['id']: contract for contract in scenario['contracts']}
+    classes = nurse_classes(len(scenario['nurses']), nurse_skills, nurse_contracts, contracts,
+                            nurse_history, nurse_name_to_index, weekdays)
+    return scenario, nurse_history, weekdays, classes
+
+
+class NurseClassesTest(unittest.TestCase):
+    def test_classes_share_everything_but_the_nurse(self):
+        scenario, nurse_history, weekdays, classes = instance_classes('n030w4', 0, [1])
+        self.assertTrue(classes)
+        history = {entry['nurse']: entry for entry in nurse_history}
+        requests = [{(request['day'], request['shiftType'])
+                     for request in weekdays[0]['shiftOffRequests'] if request['nurse'] == nurse['id']}
+                    for nurse in scenario['nurses']]
+        seen = set()
+        for nurses in classes:
+            self.assertGreater(len(nurses), 1)
+            self.assertEqual(nurses, sorted(nurses))
+            self.assertFalse(seen & set(nurses))
+            seen.update(nurses)
+            first = scenario['nurses'][nurses[0]]
+            for n in nurses[1:]:
+                nurse = scenario['nurses'][n]
+                self.assertEqual(nurse['contract'], first['contract'])
+                self.assertEqual(sorted(nurse['skills']), sorted(first['skills']))
+                self.assertEqual({**history[nurse['id']], 'nurse': None}, {**history[first['id']], 'nurse': None})
+                self.assertEqual(requests[n], requests[nurses[0]])
+
+    def test_contracts_compared_by_terms(self):
+        # Rolling-horizon stages give every nurse a contract of its own
+        scenario, nurse_history, weekdays, classes = instance_classes('n030w4', 0, [1])
+        nurse_name_to_index = {nurse['id']: n for n, nurse in enumerate(scenario['nurses'])}
+        nurse_skills = {n: nurse['skills'] for n, nurse in enumerate(scenario['nurses'])}
+        contracts = {contract['id']: contract for contract in scenario['contracts']}
+        own_contracts = {f"{nurse['contract']}/{n}": dict(contracts[nurse['contract']], id=f"{nurse['contract']}/{n}")
+                         for n, nurse in enumerate(scenario['nurses'])}
+        nurse_contracts = {n: f"{nurse['contract']}/{n}" for n, nurse in enumerate(scenario['nurses'])}
+        self.assertEqual(nurse_classes(len(scenario['nurses']), nurse_skills, nurse_contracts, own_contracts,
+                                       nurse_history, nurse_name_to_index, weekdays), classes)
+
+
+class LexLeaderTest(unittest.TestCase):
+    def test_clauses_allow_exactly_the_ordered_vectors(self):
+        # Three nurses of one class; every assignment of their x variables
+        # must be extendable to the auxiliary variables iff the x vectors
+        # are in non-increasing lexicographic order
+        for D, num_shifts, num_skills in ((1, 1, 1), (2, 2, 1), (1, 2, 2), (3, 1, 1)):
+            skills = [f'k{i}' for i in range(num_skills)]
+            nrs.init_registry(3, D, 1, [f's{i}' for i in range(num_shifts)], skills,
+                              {n: skills for n in range(3)})
+            nrs.formula = ClauseStore()
+            nrs.constraint_symmetry_breaking([[0, 1, 2]])
+            registry = nrs.registry
+            vectors = [[registry.x(n, d, s, sk) for d in range(D) for s in range(num_shifts)
+                        for sk in range(num_skills)] for n in range(3)]
+            x_vars = sorted(v for vector in vectors for v in vector)
+            aux_vars = list(range(registry.aux_base, registry.top + 1))
+            for bits in itertools.product((False, True), repeat=len(x_vars)):
+                true_x = [v for v, bit in zip(x_vars, bits) if bit]
+                values = [[v in true_x for v in vector] for vector in vectors]
+                ordered = values[0] >= values[1] >= values[2]
+                satisfiable = any(
+                    nrs.formula.evaluate(true_x + [a for a, bit in zip(aux_vars, aux_bits) if bit])[0] == 0
+                    for aux_bits in itertools.product((False, True), repeat=len(aux_vars)))
+                self.assertEqual(satisfiable, ordered, (D, num_shifts, num_skills, bits))
+
+    def test_lex_leader_roster_satisfies_the_order(self):
+        rng = np.random.default_rng(4)
+        classes = [[0, 2, 5], [1, 4]]
+        for _ in range(50):
+            roster = np.where(rng.random((6, 7)) < 0.5, rng.integers(0, 8, (6, 7)), -1).astype(np.int32)
+            leader = lex_leader_roster(roster, classes)
+            for nurses in classes:
+                self.assertEqual(sorted(map(tuple, leader[nurses])), sorted(map(tuple, roster[nurses])))
+                # A smaller code beats a larger one, and any code beats a day off
+                keys = [tuple(np.where(row >= 0, row, 1 << 30)) for row in leader[nurses]]
+                self.assertEqual(keys, sorted(keys))
+            others = [n for n in range(6) if not any(n in nurses for nurses in classes)]
+            np.testing.assert_array_equal(leader[others], roster[others])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+
+
+class VariableRegistry:
+    """
+    Integer numbering of every SAT variable used by the encoding.
+
+    The decision variables live in four dense blocks whose IDs are computed
+    arithmetically from index tuples:
+        x(n, d, s, sk): nurse n works shift s with skill sk on day d
+        o(n, d, s):     nurse n works shift s on day d
+        e(n, d):        nurse n works on day d
+        q(n, w):        nurse n works in the weekend of week w
+    Shifts and skills are passed as their positions in S and SK. The x block is
+    compact: a nurse only gets x variables for the skills listed for them.
+
+    Auxiliary variables (penalty variables, encoder internals) are handed out as
+    contiguous integer blocks. Each block keeps a name template and a key tuple,
+    and a name is only formatted when name_of() or mapping() is called.
+    """
+
+    def __init__(self, N, D, W, S, SK, nurse_skills):
+        self.N = N
+        self.D = D
+        self.W = W
+        self.S = list(S)
+        self.SK = list(SK)
+        self.num_shifts = len(self.S)
+        self.shift_index = {s: i for i, s in enumerate(self.S)}
+        self.skill_index = {sk: i for i, sk in enumerate(self.SK)}
+
+        # Skill indices of each nurse and the position of a skill among them
+        self.nurse_skill_ids = [
+            [self.skill_index[sk] for sk in nurse_skills.get(n, [])] for n in range(N)]
+        self._skill_pos = []
+        for skill_ids in self.nurse_skill_ids:
+            pos = [-1] * len(self.SK)
+            for p, k in enumerate(skill_ids):
+                pos[k] = p
+            self._skill_pos.append(pos)
+
+        # x block: one sub-block of D * |S| * |skills(n)| variables per nurse
+        self.x_base = array('q', [1])
+        for n in range(N):
+            self.x_base.append(
+                self.x_base[n] + D * self.num_shifts * len(self.nurse_skill_ids[n]))
+        self.o_base = self.x_base[N]
+        self.e_base = self.o_base + N * D * self.num_shifts
+        self.q_base = self.e_base + N * D
+        self.aux_base = self.q_base + N * W
+        self.top = self.aux_base - 1
+
+        # Channel variables that were actually requested by a constraint
+        self.o_used = bytearray(N * D * self.num_shifts)
+        self.e_used = bytearray(N * D)
+        self.q_used = bytearray(N * W)
+
+        # Auxiliary blocks: start IDs plus the template/key used to name them
+        self._block_starts = array('q')
+        self._block_templates = []
+        self._block_keys = []
+
+        # (nurse, day, code) arrays over the x block, see _x_columns()
+        self._x_cols = None
+
+    def __getstate__(self):
+        # The x columns are rebuilt on demand; no need to pickle them
+        state = dict(self.__dict__)
+        state['_x_cols'] = None
+        return state
+
+    # Decision variables
+
+    def has_skill(self, n, sk):
+        return self._skill_pos[n][sk] >= 0
+
+    def x(self, n, d, s, sk):
+        skill_count = len(self.nurse_skill_ids[n])
+        return (self.x_base[n] + (d * self.num_shifts + s) * skill_count
+                + self._skill_pos[n][sk])
+
+    def o(self, n, d, s):
+        assert 0 <= d < self.D, f"day {d} outside the horizon of {self.D} days"
+        index = (n * self.D + d) * self.num_shifts + s
+        self.o_used[index] = 1
+        return self.o_base + index
+
+    def e(self, n, d):
+        assert 0 <= d < self.D, f"day {d} outside the horizon of {self.D} days"
+        index = n * self.D + d
+        self.e_used[index] = 1
+        return self.e_base + index
+
+    def q(self, n, w):
+        assert 0 <= w < self.W, f"week {w} outside the horizon of {self.W} weeks"
+        index = n * self.W + w
+        self.q_used[index] = 1
+        return self.q_base + index
+
+    def decode_x(self, var):
+        """
+        Return (n, d, s, sk) for an x variable ID, or None for any other ID.
+        """
+        if not 1 <= var < self.o_base:
+            return None
+        n = bisect_right(self.x_base, var) - 1
+        cell, pos = divmod(var - self.x_base[n], len(self.nurse_skill_ids[n]))
+        d, s = divmod(cell, self.num_shifts)
+        return n, d, s, self.nurse_skill_ids[n][pos]
+
+    def roster_matrix(self, model):
+        """
+        Return the roster of a model as an (N, D) int array: entry [n, d] is
+        s * |SK| + sk when nurse n works shift S[s] with skill SK[sk] on day d,
+        and -1 when the nurse is off.
+
+        `model` is either the IDs of the variables set to true or a boolean
+        array whose entry i is the value of variable i + 1. Only the x block is
+        looked at.
+        """
+        nurse, day, code = self._x_columns()
+        model = np.asarray(model)
+        if model.dtype == bool:
+            value = np.zeros(self.o_base, dtype=bool)
+            x_values = model[:self.o_base - 1]
+            value[1:len(x_values) + 1] = x_values
+        else:
+            model = model.astype(np.int64, copy=False)
+            value = np.zeros(self.o_base, dtype=bool)
+            value[model[(model > 0) & (model < self.o_base)]] = True
+        roster = np.full((self.N, self.D), -1, dtype=np.int32)
+        roster[nurse[value], day[value]] = code[value]
+        return roster
+
+    def roster_literals(self, roster, cells=None):
+        """
+        Return the literals of the x, o, e and q variables that encode `roster`
+        (the inverse of roster_matrix), e.g. to use as solver phases. Only the
+        days the roster covers get literals, so it may be shorter than D.
+
+        With `cells`, an (N, D) bool mask, only the x literals of the masked
+        (nurse, day) cells are returned.
+        """
+        nurse, day, code = self._x_columns()
+        days = min(roster.shape[1], self.D)
+        roster = np.asarray(roster[:, :days])
+        work = roster >= 0
+        shift = np.where(work, roster // len(self.SK), -1)
+
+        x_ids = np.flatnonzero((nurse >= 0) & (day < days))
+        if cells is not None:
+            x_ids = x_ids[cells[nurse[x_ids], day[x_ids]]]
+        x_true = roster[nurse[x_ids], day[x_ids]] == code[x_ids]
+        if cells is not None:
+            return np.where(x_true, x_ids, -x_ids)
+
+        n, d, s = np.meshgrid(np.arange(self.N), np.arange(days),
+                              np.arange(self.num_shifts), indexing='ij')
+        o_ids = self.o_base + (n * self.D + d) * self.num_shifts + s
+        o_true = shift[n, d] == s
+
+        n, d = np.meshgrid(np.arange(self.N), np.arange(days), indexing='ij')
+        e_ids = self.e_base + n * self.D + d
+
+        weeks = min(days // 7, self.W)
+        n, w = np.meshgrid(np.arange(self.N), np.arange(weeks), indexing='ij')
+        q_ids = self.q_base + n * self.W + w
+        q_true = work[n, w * 7 + 5] | work[n, w * 7 + 6]
+
+        ids = np.concatenate((x_ids, o_ids.ravel(), e_ids.ravel(), q_ids.ravel()))
+        true = np.concatenate((x_true, o_true.ravel(), work.ravel(), q_true.ravel()))
+        return np.where(true, ids, -ids)
+
+    def _x_columns(self):
+        """
+        Nurse, day and shift/skill code of every x variable, indexed by ID.
+        Built once.
+        """
+        if self._x_cols is None:
+            nurse = np.full(self.o_base, -1, dtype=np.int32)
+            day = np.zeros(self.o_base, dtype=np.int32)
+            code = np.full(self.o_base, -1, dtype=np.int32)
+            for n, skill_ids in enumerate(self.nurse_skill_ids):
+                start, end = self.x_base[n], self.x_base[n + 1]
+                cells = np.arange(end - start).reshape(
+                    self.D, self.num_shifts, len(skill_ids))
+                nurse[start:end] = n
+                day[start:end] = (cells // (self.num_shifts * len(skill_ids))).ravel()
+                shifts = np.arange(self.num_shifts)[None, :, None]
+                skills = np.asarray(skill_ids, dtype=np.int32)[None, None, :]
+                code[start:end] = np.broadcast_to(
+                    shifts * len(self.SK) + skills, cells.shape).ravel()
+            self._x_cols = (nurse, day, code)
+        return self._x_cols
+
+    # Auxiliary variables
+
+    def new_block(self, count, template, key=()):
+        """
+        Reserve `count` fresh variables and return the first ID.
+
+        `template` is formatted as template.format(*key, j=offset, v=id) when a
+        name is requested, e.g. "penalty_s1_{}_{}_{}_{j}".
+        """
+        start = self.top + 1
+        if count > 0:
+            self._block_starts.append(start)
+            self._block_templates.append(template)
+            self._block_keys.append(key)
+            self.top += count
+        return start
+
+    def new_var(self, template, key=()):
+        return self.new_block(1, template, key)
+
+    def claim(self, top_var, template, key=()):
+        """
+        Register the variables an external encoder created above self.top.
+        """
+        if top_var > self.top:
+            self.new_block(top_var - self.top, template, key)
+
+    def absorb(self, other):
+        """
+        Take over the auxiliary variables of `other`, a copy of this registry
+        made before any auxiliary allocation that was then used elsewhere (e.g.
+        in a worker process). Its blocks are moved above self.top and the used
+        channel bitmaps are merged.
+
+        Returns the offset to add to the auxiliary IDs (>= aux_base) of clauses
+        built against `other`.
+        """
+        offset = self.top + 1 - self.aux_base
+        for start, template, key in zip(
+                other._block_starts, other._block_templates, other._block_keys):
+            self._block_starts.append(start + offset)
+            self._block_templates.append(template)
+            self._block_keys.append(key)
+        self.top = other.top + offset
+        for name in ('o_used', 'e_used', 'q_used'):
+            used = getattr(self, name)
+            merged = (int.from_bytes(used, 'little')
+                      | int.from_bytes(getattr(other, name), 'little'))
+            used[:] = merged.to_bytes(len(used), 'little')
+        return offset
+
+    # Human-readable names
+
+    def name_of(self, var):
+        if var < 1 or var > self.top:
+            return None
+        if var < self.o_base:
+            n, d, s, sk = self.decode_x(var)
+            return f"x_{n}_{d}_{self.S[s]}_{self.SK[sk]}"
+        if var < self.e_base:
+            cell, s = divmod(var - self.o_base, self.num_shifts)
+            n, d = divmod(cell, self.D)
+            return f"o_{n}_{d}_{self.S[s]}"
+        if var < self.q_base:
+            n, d = divmod(var - self.e_base, self.D)
+            return f"e_{n}_{d}"
+        if var < self.aux_base:
+            n, w = divmod(var - self.q_base, self.W)
+            return f"q_{n}_{w}"
+        i = bisect_right(self._block_starts, var) - 1
+        return self._block_templates[i].format(
+            *self._block_keys[i], j=var - self._block_starts[i], v=var)
+
+    def mapping(self):
+        """
+        Yield (id, name) for every allocated variable.
+        """
+        for var in range(1, self.top + 1):
+            yield var, self.name_of(var)
+
+    def family_counts(self):
+        """
+        Return the number of variables per family (x, o, e, q and one entry per
+        auxiliary template prefix such as "aux_s1_enc" or "penalty_s6_max").
+        """
+        counts = {
+            'x': self.o_base - 1,
+            'o': self.e_base - self.o_base,
+            'e': self.q_base - self.e_base,
+            'q': self.aux_base - self.q_base,
+        }
+        ends = list(self._block_starts[1:]) + [self.top + 1]
+        for start, end, template in zip(self._block_starts, ends, self._block_templates):
+            family = template.split('{', 1)[0].rstrip('_')
+            counts[family] = counts.get(family, 0) + end - start
+        return counts